@@ -7,8 +7,9 @@ __author__ = '@SergeGoussev'
 __licence__ = 'MIT'
 
 from nlpru.clean import Cleaner
-from nlpru.semantics import Semantics
-from nlpru.topics import FindTopics
+from nlpru.semantics import Semantics, SimilarityIndex
+from nlpru.topics import FindTopics, TopicMatcher
 from nlpru.conversation import Conversations
-from nlpru.models import Convert_to_tweet_dictionary
+from nlpru.models import Convert_to_tweet_dictionary, Convert_to_tweet_store, TweetStore
+from nlpru.resources import Warmup
 from nlpru.error import nlpruError, ConversationError, TopicModelError, InputError
\ No newline at end of file
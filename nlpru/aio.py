@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.aio
+
+asyncio version of nlpru.stream.Label_tweets, for services fed by a
+streaming consumer: tweets are taken from an async iterator, labelled a batch
+at a time in a bounded pool of threads or processes (check words -> topic
+match, as in FindTopics.Keyword_Match, optionally cleaning the text first)
+and come back as an async stream, in the order they came in.
+
+Memory is bounded at every step: at most max_queued tweets wait to be
+batched and at most max_in_flight batches are being labelled (or waiting to
+be taken by the consumer). When the consumer falls behind the source is
+simply not read, which pushes back on the producer.
+
+    queue = TweetQueue(maxsize=10000)
+    # the consumer callback does: await queue.Put(twtid, {'text': text})
+    async for twtid, tweet in Label_stream(queue, topic_dict):
+        ...tweet['clean_words'], tweet['topic']...
+"""
+from __future__ import print_function
+import asyncio
+import collections
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from nlpru.error import InputError
+from nlpru.parallel import _init_worker_
+from nlpru.stream import _Labeller, _init_labeller, _label_chunk
+from nlpru.tokenizer import nltk_word_tokenize
+from nlpru.topics import _get_matcher
+
+# marks the end of the tweets (or an error reading them) in the intake queue
+_end = object()
+
+
+class TweetQueue:
+    '''
+    TweetQueue - bounded async source of tweets for Label_stream, filled by
+    producers running in the same event loop (i.e. a streaming consumer's
+    callback) and read by one consumer: Put() waits while the queue is full
+
+    @parameters:
+        - maxsize - maximum number of tweets waiting in the queue
+    '''
+
+    def __init__(self, maxsize=1000):
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._closed = False
+        self._ended = False
+
+    async def Put(self, twtid, tweet):
+        '''
+        Put - add a tweet ({'text': ..., ...}), waiting for room if needed
+        '''
+        if self._closed:
+            raise InputError("Put() on a closed TweetQueue")
+        await self._queue.put((twtid, tweet))
+
+    async def Close(self):
+        '''
+        Close - no more tweets, the stream ends once the queue is read
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        await self._queue.put(_end)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._ended:
+            raise StopAsyncIteration
+        item = await self._queue.get()
+        if item is _end:
+            self._ended = True
+            raise StopAsyncIteration
+        return item
+
+
+async def _read(tweets, queue):
+    '''
+    move the tweets of an async (or plain) iterable into the intake queue,
+    then the end marker with the error that stopped the reading (if any)
+    '''
+    try:
+        if hasattr(tweets, '__aiter__'):
+            async for tweet in tweets:
+                await queue.put(tweet)
+        else:
+            for tweet in tweets:
+                await queue.put(tweet)
+    except Exception as e:
+        await queue.put((_end, e))
+    else:
+        await queue.put((_end, None))
+
+
+_thread_state = threading.local()
+
+
+def _init_thread_labeller(matcher, tokenizer, clean_options):
+    _thread_state.labeller = _Labeller(matcher, tokenizer, clean_options)
+
+
+def _label_thread_chunk(texts):
+    return _thread_state.labeller.label(texts)
+
+
+def _executor(executor, workers, labeller_args):
+    '''
+    (pool, function labelling a list of texts in it) for executor 'thread'
+    or 'process', every worker gets its own labeller
+    '''
+    if executor == 'thread':
+        return (ThreadPoolExecutor(max_workers=workers,
+                                   initializer=_init_thread_labeller,
+                                   initargs=labeller_args),
+                _label_thread_chunk)
+    if executor == 'process':
+        return (ProcessPoolExecutor(max_workers=workers,
+                                    initializer=_init_worker_,
+                                    initargs=(['morph', 'stopwords'],
+                                              _init_labeller, labeller_args)),
+                _label_chunk)
+    raise InputError("executor must be 'thread' or 'process'")
+
+
+async def Label_stream(tweets,
+                       topic_dict,
+                       clean=False,
+                       clean_options=None,
+                       tokenizer=None,
+                       batch_size=1000,
+                       max_in_flight=4,
+                       max_queued=None,
+                       max_wait=None,
+                       executor='thread',
+                       workers=None):
+    '''
+    Label_stream - async generator that adds 'clean_words' and 'topic' to
+    every (twtid, tweet) of an async iterable, in the order of the input
+
+    @parameters:
+        - tweets - async iterable (i.e. a TweetQueue) or plain iterable of
+        (twtid, tweet)
+        - topic_dict, clean, clean_options, tokenizer - see
+        nlpru.stream.Label_tweets
+        - batch_size - number of tweets labelled at a time
+        - max_in_flight - maximum number of batches sent to the pool and not
+        yet taken by the consumer
+        - max_queued - maximum number of tweets read from the source ahead of
+        the batches (default batch_size)
+        - max_wait - (optional) seconds after which a batch that is not full
+        is sent anyway, so that a slow source does not hold tweets back
+        - executor - 'thread' (default) or 'process', the kind of pool the
+        batches are labelled in
+        - workers - size of the pool (default as in concurrent.futures)
+
+    Closing the generator early stops reading the source and shuts the pool
+    down.
+    '''
+    if batch_size < 1 or max_in_flight < 1:
+        raise InputError("batch_size and max_in_flight must be positive")
+    matcher = _get_matcher(topic_dict)
+    if tokenizer is None:
+        tokenizer = nltk_word_tokenize
+    if clean:
+        clean_options = dict(clean_options or {})
+    else:
+        clean_options = None
+    pool, label = _executor(executor, workers,
+                            (matcher, tokenizer, clean_options))
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_queued or batch_size)
+    reader = loop.create_task(_read(tweets, queue))
+    # (batch, future of its labels), oldest first
+    pending = collections.deque()
+    batch = []
+    started = None
+    getter = None
+    finished = False
+
+    def submit():
+        pending.append((batch, loop.run_in_executor(
+            pool, label, [tweet['text'] for _, tweet in batch])))
+
+    try:
+        while True:
+            # only read on while there is room for the batch being collected
+            if getter is None and not finished and \
+                    len(pending) < max_in_flight:
+                getter = asyncio.ensure_future(queue.get())
+            waiting = [future for future in
+                       (getter, pending[0][1] if pending else None)
+                       if future is not None]
+            if not waiting:
+                break
+            timeout = None
+            if getter is not None and batch and max_wait is not None:
+                timeout = max(0.0, started + max_wait - loop.time())
+            await asyncio.wait(waiting, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            while pending and pending[0][1].done():
+                done, future = pending.popleft()
+                for (twtid, tweet), (clean_words, topic) in zip(
+                        done, future.result()):
+                    tweet['clean_words'] = clean_words
+                    tweet['topic'] = topic
+                    yield twtid, tweet
+            if getter is not None and getter.done():
+                item = getter.result()
+                getter = None
+                if item[0] is _end:
+                    if item[1] is not None:
+                        raise item[1]
+                    finished = True
+                    if batch:
+                        submit()
+                        batch = []
+                    continue
+                batch.append(item)
+                if len(batch) == 1:
+                    started = loop.time()
+                if len(batch) >= batch_size:
+                    submit()
+                    batch = []
+            elif timeout is not None and loop.time() >= started + max_wait:
+                submit()
+                batch = []
+    finally:
+        if getter is not None:
+            getter.cancel()
+        reader.cancel()
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
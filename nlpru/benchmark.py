@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.benchmark
+
+timing harness for the library, so that regressions are visible between
+versions. Every benchmark returns a plain dictionary that can be dumped to
+json and compared.
+
+    python -m nlpru.benchmark --sizes 10000 100000 --output results.json
+
+The pipeline benchmark runs on a synthetic corpus (Synthetic_tweets,
+Synthetic_conversations) that is the same for the same seed on every run
+and every version.
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# a few tweets to time against when no corpus is given
+_sample_tweets = [
+    u"RT @D_Azaroff: какое расследование,почему б не указать, что наш "
+    u"Самарский ио \U0001F601 https://t.co/abc123 #самара",
+    u"Из-за погоды рейсы задерживаются... \"Аэрофлот\" обещает компенсации!",
+    u"кто-нибудь знает, где купить билеты на 23 февраля? \U0001F44D\U0001F3FB",
+    u"@user_1 @user_2 вот он не бот, можно обратиться напрямую, не откажет",
+    u"Путин встретился с губернатором #новости #россия http://ria.ru/x.html",
+]
+
+# run in a fresh interpreter - the import has to be measured from scratch
+_startup_script = """
+import json, sys, time, tracemalloc
+tracemalloc.start()
+start = time.perf_counter()
+import nlpru
+import_seconds = time.perf_counter() - start
+import_memory = tracemalloc.get_traced_memory()[1]
+modules = len(sys.modules)
+warmup = {{}}
+if {warmup}:
+    from nlpru import resources
+    for name in sorted(resources._loaders):
+        try:
+            resources.Get(name)
+        except Exception as e:
+            warmup[name] = 'failed: {{}}'.format(e)
+    warmup.update(resources.Loaded_resources())
+print(json.dumps({{'import_seconds': import_seconds,
+                  'import_peak_bytes': import_memory,
+                  'modules_loaded': modules,
+                  'warmup_seconds': warmup}}))
+"""
+
+
+def Startup_benchmark(repeat=5, warmup=True):
+    '''
+    Startup_benchmark - measure the cost of "import nlpru" in a fresh
+    interpreter, and (if warmup=True) how long each lazily loaded resource
+    takes to load afterwards
+
+    returns: dictionary with the best import time, the peak memory allocated
+    during the import, number of modules loaded and the load time of every
+    resource (from the last run)
+    '''
+    script = _startup_script.format(warmup=bool(warmup))
+    runs = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        runs.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+    return {'benchmark': 'startup',
+            'python': sys.version.split()[0],
+            'repeat': repeat,
+            'import_seconds': min(run['import_seconds'] for run in runs),
+            'import_peak_bytes': max(run['import_peak_bytes'] for run in runs),
+            'modules_loaded': runs[-1]['modules_loaded'],
+            'warmup_seconds': runs[-1]['warmup_seconds']}
+
+
+def _time_tokenizer(tokenize, documents, repeat):
+    '''
+    best time over repeat runs of tokenizing all the documents, and the
+    number of tokens produced
+    '''
+    best = None
+    for i in range(repeat):
+        n_tokens = 0
+        start = time.perf_counter()
+        for doc in documents:
+            n_tokens += len(list(tokenize(doc)))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, n_tokens
+
+
+def Tokenizer_benchmark(documents=None, repeat=3, compare_nltk=True):
+    '''
+    Tokenizer_benchmark - throughput of the nlpru tokenizer modes (and of
+    nltk.word_tokenize if it is installed and compare_nltk=True)
+
+    @parameters:
+        - documents - list of documents to tokenize, by default a small sample
+        of tweets repeated 2000 times
+        - repeat - number of runs, the best one is reported
+
+    returns: dictionary of docs/s and tokens/s by tokenizer
+    '''
+    from nlpru.tokenizer import Tokenizer
+    if documents is None:
+        documents = _sample_tweets * 2000
+    tokenizers = [('nlpru_social', Tokenizer(mode='social')),
+                  ('nlpru_word_tokenize', Tokenizer(mode='word_tokenize'))]
+    if compare_nltk:
+        try:
+            from nltk.tokenize import word_tokenize
+            tokenizers.append(('nltk_word_tokenize', word_tokenize))
+        except ImportError:
+            pass
+    results = {}
+    for name, tokenize in tokenizers:
+        seconds, n_tokens = _time_tokenizer(tokenize, documents, repeat)
+        results[name] = {'seconds': seconds,
+                         'docs_per_second': len(documents) / seconds,
+                         'tokens_per_second': n_tokens / seconds,
+                         'tokens': n_tokens}
+    return {'benchmark': 'tokenizer',
+            'python': sys.version.split()[0],
+            'documents': len(documents),
+            'repeat': repeat,
+            'results': results}
+
+
+# ----------------------synthetic corpus----------------------------------------------
+_words = (
+    u"расследование расследования расследованию губернатор губернатора "
+    u"губернатору выборы выборов выборах президент президента президенту "
+    u"правительство правительства министр министра министерство суд суда "
+    u"суде приговор приговора дело дела делу уголовный уголовного "
+    u"уголовное полиция полиции задержали задержан митинг митинга "
+    u"митинге протест протеста оппозиция оппозиции власть власти "
+    u"город города городе москва москвы москве россия россии россию "
+    u"страна страны стране закон закона законе депутат депутата депутаты "
+    u"дума думы думе бюджет бюджета деньги денег рубль рублей цены цен "
+    u"погода погоды рейсы рейс аэропорт аэропорта самолёт самолета "
+    u"новости новость сегодня вчера завтра утром вечером наш наша наши "
+    u"почему какое какой какая вот он она они мы вы не бот можно нужно "
+    u"обратиться напрямую сказал сказала заявил заявила обещает обещал "
+    u"будет был была были есть нет очень просто опять снова люди людей "
+    u"человек человека работа работы школа школы больница больницы "
+    u"дорога дороги ремонт ремонта хорошо плохо конечно кто-нибудь "
+    u"из-за где когда потом тоже ещё уже только").split()
+_emoji = [u"\U0001F601", u"\U0001F44D", u"\U0001F44D\U0001F3FB",
+          u"\U0001F602", u"\U0001F621", u"\u2764\uFE0F", u"\U0001F1F7\U0001F1FA"]
+_hashtags = [u"#новости", u"#россия", u"#москва", u"#выборы", u"#самара",
+             u"#митинг", u"#погода"]
+_punctuation = [u",", u".", u"!", u"?", u"...", u" -", u":"]
+# swears as they appear in tweets (nlpru.stop_words.swear_words are the
+# patterns that remove them)
+_swears = [u"пиздец", u"ёбаный", u"хуйня", u"жопа", u"бля", u"п***ц",
+           u"твою мать"]
+
+# topics used by the Keyword_Match benchmark, matched on lemmas of _words
+benchmark_topics = {
+    "politics": {'contains': ["выборы", "президент", "дума", "депутат"],
+                 'not': ["погода"]},
+    "courts": {'contains': ["суд", "приговор", "уголовный дело"]},
+    "protest": ["митинг", "протест", "оппозиция"],
+    "weather": {'contains': ["погода", {'near': ["рейс", "аэропорт"],
+                                         'within': 3}]},
+}
+
+
+def Synthetic_tweets(n, seed=0):
+    '''
+    Synthetic_tweets - list of n (twtid, text) of made up Russian tweets with
+    retweet prefixes, mentions, hashtags, urls, emoji and swears. The same
+    seed always gives the same tweets.
+    '''
+    rand = random.Random(seed)
+    tweets = []
+    for i in range(n):
+        parts = []
+        if rand.random() < 0.15:
+            parts.append(u"RT @user_{}:".format(rand.randrange(5000)))
+        for j in range(rand.choice((0, 0, 1, 2))):
+            parts.append(u"@user_{}".format(rand.randrange(5000)))
+        for j in range(rand.randint(5, 20)):
+            word = rand.choice(_words)
+            if j == 0 and rand.random() < 0.5:
+                word = word.capitalize()
+            parts.append(word)
+            if rand.random() < 0.12:
+                parts[-1] += rand.choice(_punctuation)
+        if rand.random() < 0.05:
+            parts.insert(rand.randrange(1, len(parts)), rand.choice(_swears))
+        if rand.random() < 0.3:
+            parts.append(rand.choice(_emoji))
+        for j in range(rand.choice((0, 0, 1, 2))):
+            parts.append(rand.choice(_hashtags))
+        if rand.random() < 0.3:
+            parts.append(u"https://t.co/{:x}".format(rand.getrandbits(40)))
+        tweets.append((str(10 ** 17 + i), u" ".join(parts)))
+    return tweets
+
+
+def Synthetic_conversations(twtids, depth=5, linked_share=0.5, seed=0):
+    '''
+    Synthetic_conversations - reply/quote/retweet links between tweets, as
+    the keyword arguments of Conversations (reply_list, quote_list,
+    retweet_list): linked_share of the tweets reply to (50%), quote (25%) or
+    retweet (25%) an earlier tweet, threads are at most depth links deep
+    '''
+    rand = random.Random(seed)
+    links = {'reply_list': [], 'quote_list': [], 'retweet_list': []}
+    levels = []
+    for i, twtid in enumerate(twtids):
+        level = 0
+        if i and rand.random() < linked_share:
+            parent = rand.randrange(max(0, i - 1000), i)
+            if levels[parent] < depth:
+                level = levels[parent] + 1
+                kind = rand.choice(('reply_list', 'reply_list',
+                                    'quote_list', 'retweet_list'))
+                links[kind].append((twtid, twtids[parent]))
+        levels.append(level)
+    return links
+
+
+# ----------------------pipeline benchmark--------------------------------------------
+def _percentiles(latencies):
+    '''
+    p50/p90/p99/max of a list of latencies in seconds, in milliseconds
+    '''
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+
+    def at(q):
+        return 1000.0 * latencies[min(len(latencies) - 1,
+                                      int(q * len(latencies)))]
+    return {'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99),
+            'max_ms': 1000.0 * latencies[-1]}
+
+
+def _run_stage(run, items, measure_memory):
+    '''
+    time run() (which returns the list of per item latencies, or None), then
+    if measure_memory run it again under tracemalloc for the peak memory
+    '''
+    start = time.perf_counter()
+    latencies = run()
+    seconds = time.perf_counter() - start
+    result = {'seconds': seconds,
+              'items': items,
+              'items_per_second': items / seconds if seconds else None}
+    if latencies:
+        result.update(_percentiles(latencies))
+    if measure_memory:
+        tracemalloc.start()
+        run()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def Pipeline_benchmark(sizes=(10000, 100000, 1000000),
+                       seed=0,
+                       stages=None,
+                       depth=5,
+                       max_words=1000000,
+                       similarity_window=1000,
+                       similarity_queries=50,
+                       measure_memory=True):
+    '''
+    Pipeline_benchmark - throughput, latency percentiles and peak memory of
+    the main steps, on synthetic corpora of the given sizes
+
+    @parameters:
+        - sizes - numbers of tweets
+        - stages - names of the stages to run (default all): 'clean_document',
+        'check_word', 'keyword_match', 'recategorize_topics', 'get_similarity'
+        (clean_document runs with remove_swears=True, so that every removal
+        is timed)
+        - depth - maximum depth of the synthetic conversations
+        - max_words - at most this many words are put through Check_word
+        - similarity_window, similarity_queries - Get_similarity is called
+        similarity_queries times, each on similarity_window tweets
+        - measure_memory - run every stage a second time under tracemalloc
+
+    returns: dictionary by size and stage of seconds, items/s, p50/p90/p99/max
+    latency (per call, where it makes sense) and peak bytes
+    '''
+    import nlpru
+    from nlpru import (Cleaner, FindTopics, Conversations, Semantics)
+    from nlpru.cache import lemma_cache
+    from nlpru.tokenizer import nltk_word_tokenize
+    all_stages = ['clean_document', 'check_word', 'keyword_match',
+                  'recategorize_topics', 'get_similarity']
+    stages = all_stages if stages is None else stages
+    results = {'benchmark': 'pipeline',
+               'python': sys.version.split()[0],
+               'nlpru': nlpru.__version__,
+               'seed': seed,
+               'sizes': {}}
+    for n in sizes:
+        tweets = Synthetic_tweets(n, seed=seed)
+        texts = [text for twtid, text in tweets]
+        cleaner = Cleaner()
+        lemma_cache.Clear()
+        size_results = {}
+        if 'clean_document' in stages:
+            def run():
+                latencies = []
+                for text in texts:
+                    start = time.perf_counter()
+                    cleaner.Clean_document(text, remove_swears=True)
+                    latencies.append(time.perf_counter() - start)
+                return latencies
+            size_results['clean_document'] = _run_stage(run, n, measure_memory)
+        if 'check_word' in stages:
+            words = []
+            for text in texts:
+                words.extend(nltk_word_tokenize(text))
+                if len(words) >= max_words:
+                    break
+            words = words[:max_words]
+
+            def run():
+                lemma_cache.Clear()
+                latencies = []
+                for word in words:
+                    start = time.perf_counter()
+                    cleaner.Check_word(word)
+                    latencies.append(time.perf_counter() - start)
+                return latencies
+            size_results['check_word'] = _run_stage(run, len(words),
+                                                    measure_memory)
+            size_results['check_word']['cache'] = lemma_cache.Stats()
+        tweet_dict = None
+        if 'keyword_match' in stages or 'recategorize_topics' in stages:
+            def run(topic_dict):
+                topics = FindTopics(tweet_dict={twtid: {'text': text}
+                                                for twtid, text in tweets})
+                return topics.Keyword_Match(topic_dict)
+            # Keyword_Match changes the topic_dict it is given, so every run
+            # gets its own copy, made before the timer starts
+            topic_dicts = [json.loads(json.dumps(benchmark_topics))
+                           for i in range(2)]
+            start = time.perf_counter()
+            tweet_dict = run(topic_dicts[0])
+            if 'keyword_match' in stages:
+                seconds = time.perf_counter() - start
+                size_results['keyword_match'] = {
+                    'seconds': seconds, 'items': n,
+                    'items_per_second': n / seconds}
+                if measure_memory:
+                    tracemalloc.start()
+                    run(topic_dicts[1])
+                    size_results['keyword_match']['peak_bytes'] = \
+                        tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+        if 'recategorize_topics' in stages:
+            links = Synthetic_conversations([twtid for twtid, text in tweets],
+                                            depth=depth, seed=seed)
+            original = {twtid: value['topic']
+                        for twtid, value in tweet_dict.items()}
+
+            def run():
+                for twtid, topic in original.items():
+                    tweet_dict[twtid]['topic'] = topic
+                Conversations(**links).Recategorize_topics(
+                    "politics", tweet_dict=tweet_dict)
+            n_links = sum(len(pairs) for pairs in links.values())
+            size_results['recategorize_topics'] = _run_stage(
+                run, n, measure_memory)
+            size_results['recategorize_topics']['links'] = n_links
+        if 'get_similarity' in stages:
+            semantics = Semantics(clean='All')
+            rand = random.Random(seed)
+            window = min(similarity_window, n)
+            # drawn once, so the memory run works on the same windows
+            firsts = [rand.randrange(0, n - window + 1)
+                      for i in range(similarity_queries)]
+
+            def run():
+                latencies = []
+                for first in firsts:
+                    start = time.perf_counter()
+                    semantics.Get_similarity(texts[first:first + window])
+                    latencies.append(time.perf_counter() - start)
+                return latencies
+            size_results['get_similarity'] = _run_stage(
+                run, similarity_queries, measure_memory)
+            size_results['get_similarity']['window'] = window
+        results['sizes'][str(n)] = size_results
+    return results
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m nlpru.benchmark',
+        description='nlpru benchmarks, printed (or written) as json')
+    parser.add_argument('--suite', nargs='+',
+                        default=['startup', 'tokenizer', 'pipeline'],
+                        choices=['startup', 'tokenizer', 'pipeline'])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--stages', nargs='+', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure peak memory (halves the time)')
+    parser.add_argument('--output', default=None,
+                        help='json file to write the results to')
+    args = parser.parse_args(argv)
+    results = []
+    if 'startup' in args.suite:
+        results.append(Startup_benchmark())
+    if 'tokenizer' in args.suite:
+        results.append(Tokenizer_benchmark())
+    if 'pipeline' in args.suite:
+        results.append(Pipeline_benchmark(sizes=args.sizes,
+                                          seed=args.seed,
+                                          stages=args.stages,
+                                          measure_memory=not args.no_memory))
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output is not None:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.cache
+
+process wide, size bounded cache of morphological results. Tweet vocabulary
+is very repetitive, so the lemma of a word (and the Check_word verdict for a
+given set of options) is only worked out once and then reused by Cleaner and
+Semantics.
+"""
+from __future__ import print_function
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from nlpru import resources
+
+# pymorphy2 grammemes that mark a proper noun (names, surnames, patronymics,
+# place names, organisations)
+proper_noun_grammemes = ('Name', 'Surn', 'Patr', 'Geox', 'Orgn')
+
+
+class LemmaCache:
+    '''
+    LemmaCache - least recently used cache of morphological analyses (normal
+    form, is it a proper noun) and Check_word verdicts, keyed on the
+    lowercased token. When more than maxsize entries are stored the least
+    recently used one is evicted.
+    '''
+
+    def __init__(self, maxsize=200000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def Lookup(self, key):
+        '''
+        return the stored value for the key (marking it as recently used),
+        or None if it is not in the cache
+        '''
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            # evicted by another thread in the meantime
+            pass
+        return value
+
+    def Store(self, key, value):
+        '''
+        store a value, evicting the least recently used entries if the cache
+        is full
+        '''
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def Analysis(self, word):
+        '''
+        Analysis - (normal form, is proper noun) of a word, from the most
+        likely pymorphy2 parse of the lowercased word
+        '''
+        key = word.lower()
+        analysis = self.Lookup(key)
+        if analysis is None or analysis[1] is None:
+            parse = resources.Get('morph').parse(key)[0]
+            analysis = (parse.normal_form,
+                        any(grammeme in parse.tag
+                            for grammeme in proper_noun_grammemes))
+            self.Store(key, analysis)
+        return analysis
+
+    def Lemma(self, word):
+        '''
+        Lemma - the pymorphy2 normal form of a word (lowercased)
+        '''
+        return self.Analysis(word)[0]
+
+    def Is_proper_noun(self, word):
+        '''
+        Is_proper_noun - True if pymorphy2 tags the word as a name, surname,
+        patronymic, place or organisation
+        '''
+        return self.Analysis(word)[1]
+
+    def Resize(self, maxsize):
+        '''
+        change the maximum number of entries, evicting if needed
+        '''
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def Clear(self):
+        '''
+        empty the cache and reset the counters
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def Stats(self):
+        '''
+        Stats - dictionary of the hit/miss/eviction counters, the current size
+        and the hit rate
+        '''
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def Save_vocabulary(self, path):
+        '''
+        Save_vocabulary - write the cached word analyses to a text file (one
+        "word<tab>lemma<tab>proper noun 0/1" per line), most recently used
+        last, so that another process can be pre-seeded with Load_vocabulary()
+        '''
+        with self._lock:
+            pairs = [(key, value) for key, value in self._entries.items()
+                     if type(key) is str]
+        with io.open(path, 'w', encoding='utf-8') as f:
+            for word, (lemma, proper) in pairs:
+                if proper is None:
+                    f.write(u'{}\t{}\n'.format(word, lemma))
+                else:
+                    f.write(u'{}\t{}\t{}\n'.format(word, lemma, int(proper)))
+        return len(pairs)
+
+    def Load_vocabulary(self, path):
+        '''
+        Load_vocabulary - pre-seed the cache from a file written by
+        Save_vocabulary(). Lines without the proper noun column, or with only
+        a word, are also accepted - what is missing is worked out when first
+        needed, or on loading for a bare word.
+
+        returns: number of words loaded
+        '''
+        n = 0
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                fields = line.split('\t')
+                if len(fields) >= 3:
+                    self.Store(fields[0].lower(),
+                               (fields[1], fields[2] == '1'))
+                elif len(fields) == 2:
+                    self.Store(fields[0].lower(), (fields[1], None))
+                else:
+                    self.Analysis(line)
+                n += 1
+        return n
+
+
+# the cache shared by the whole library
+lemma_cache = LemmaCache()
+
+
+def Text_hash(text):
+    '''
+    Text_hash - short hash of a tweet text, used to notice edited texts
+    '''
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class LemmaStore:
+    '''
+    LemmaStore - on-disk (sqlite) cache of the clean words of every tweet,
+    keyed by tweet id and the options they were computed with, and checked
+    against a hash of the tweet text. Re-running FindTopics on an unchanged
+    corpus then needs no morphological analysis at all.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS clean_words (
+                                twtid TEXT NOT NULL,
+                                options TEXT NOT NULL,
+                                text_hash TEXT NOT NULL,
+                                words TEXT NOT NULL,
+                                PRIMARY KEY (twtid, options))""")
+        self._db.commit()
+
+    def Get_many(self, tweets, options):
+        '''
+        Get_many - clean words stored for a list of (twtid, text) computed
+        with the given options (a string); returns a dictionary by twtid of
+        those found whose text has not changed
+        '''
+        hashes = {str(twtid): (twtid, Text_hash(text)) for twtid, text in tweets}
+        found = {}
+        ids = list(hashes)
+        # stay under sqlite's limit on the number of query parameters
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows = self._db.execute(
+                "SELECT twtid, text_hash, words FROM clean_words "
+                "WHERE options = ? AND twtid IN ({})".format(
+                    ','.join('?' * len(batch))),
+                [options] + batch)
+            for twtid, text_hash, words in rows:
+                original_id, expected_hash = hashes[twtid]
+                if text_hash == expected_hash:
+                    found[original_id] = json.loads(words)
+        return found
+
+    def Put_many(self, rows, options):
+        '''
+        Put_many - store (twtid, text, clean words) rows computed with the
+        given options
+        '''
+        self._db.executemany(
+            "INSERT OR REPLACE INTO clean_words VALUES (?, ?, ?, ?)",
+            [(str(twtid), options, Text_hash(text),
+              json.dumps(words, ensure_ascii=False))
+             for twtid, text, words in rows])
+        self._db.commit()
+
+    def Close(self):
+        self._db.close()
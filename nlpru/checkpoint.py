@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.checkpoint
+
+on-disk (sqlite) checkpoints of long FindTopics.Keyword_Match and
+Conversations.Recategorize_topics/Recategorize_all_topics runs, so that a run
+that was stopped can be started again from where it got to:
+
+    checkpoint = Checkpoint('job.checkpoint')
+    tweets = FindTopics(tweet_dict=tweets).Keyword_Match(
+        topic_dict, checkpoint=checkpoint)
+    Conversations(reply_list=replies).Recategorize_topics(
+        'topic 1', tweet_dict=tweets, checkpoint=checkpoint)
+
+Running the same code again with the same checkpoint file gives the same
+output as a run that was never stopped. Only what changed is written: the
+clean words and topic of every chunk of tweets as it is done, and the tweets
+recategorized in every round of the spread through the conversations (the
+last round written is the frontier the spread goes on from).
+
+Tweet ids must be strings or integers, they are stored as json.
+"""
+from __future__ import print_function
+import hashlib
+import json
+import numbers
+import sqlite3
+
+from nlpru.cache import Text_hash
+from nlpru.error import InputError
+
+
+def _encode_id(twtid):
+    '''
+    json of a tweet id, which must be a string or an integer so that it comes
+    back the same (and hashable) when read
+    '''
+    if isinstance(twtid, str):
+        return json.dumps(twtid, ensure_ascii=False)
+    if isinstance(twtid, numbers.Integral) and not isinstance(twtid, bool):
+        return json.dumps(int(twtid))
+    raise InputError("Checkpoints need string or integer tweet ids, "
+                     "not {!r}".format(twtid))
+
+
+def Input_hash(tweets, links):
+    '''
+    Input_hash - hash of the input of a recategorization: the (twtid, topic)
+    of every tweet and the (twtid, parent) pairs of every kind of link, in
+    their order
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for twtid, topic in tweets:
+        digest.update(u'{}\t{}\n'.format(
+            _encode_id(twtid), json.dumps(topic, ensure_ascii=False)
+        ).encode('utf-8'))
+    for kind in links:
+        digest.update(b'--\n')
+        for twtid, parent in kind:
+            digest.update(u'{}\t{}\n'.format(
+                _encode_id(twtid), _encode_id(parent)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    '''
+    Checkpoint - sqlite file holding the progress of a job
+
+    @parameters:
+        - path - the file, created if it does not exist
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS stages (
+                stage TEXT PRIMARY KEY,
+                identity TEXT NOT NULL,
+                round_done INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS tweets (
+                twtid TEXT NOT NULL,
+                options TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                words TEXT NOT NULL,
+                topic TEXT,
+                PRIMARY KEY (twtid, options));
+            CREATE TABLE IF NOT EXISTS changes (
+                stage TEXT NOT NULL,
+                round INTEGER NOT NULL,
+                twtid TEXT NOT NULL,
+                label TEXT NOT NULL,
+                topics TEXT);
+            CREATE INDEX IF NOT EXISTS changes_stage ON changes (stage, round);
+            """)
+        self._db.commit()
+
+    # ----------------------Keyword_Match---------------------------------------------------
+    def Put_tweets(self, rows, options):
+        '''
+        Put_tweets - store (twtid, text, clean words, topic) rows computed with
+        the given options (a string)
+        '''
+        self._db.executemany(
+            "INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?, ?)",
+            [(_encode_id(twtid), options, Text_hash(text),
+              json.dumps(words, ensure_ascii=False), topic)
+             for twtid, text, words, topic in rows])
+        self._db.commit()
+
+    def Tweets(self, options):
+        '''
+        Tweets - generator of the stored (twtid, text hash, clean words, topic)
+        computed with the given options
+        '''
+        rows = self._db.execute(
+            "SELECT twtid, text_hash, words, topic FROM tweets "
+            "WHERE options = ?", (options,))
+        for twtid, text_hash, words, topic in rows:
+            yield json.loads(twtid), text_hash, json.loads(words), topic
+
+    # ----------------------recategorization-----------------------------------------------
+    def Start(self, stage, identity):
+        '''
+        Start - begin (or go back to) a stage of recategorization; identity is
+        a string identifying its input (see Input_hash), a checkpoint of the
+        same stage made from another input is an error
+
+        returns: number of the last round written
+        '''
+        row = self._db.execute(
+            "SELECT identity, round_done FROM stages WHERE stage = ?",
+            (stage,)).fetchone()
+        if row is None:
+            self._db.execute("INSERT INTO stages VALUES (?, ?, 0)",
+                             (stage, identity))
+            self._db.commit()
+            return 0
+        if row[0] != identity:
+            raise InputError("Checkpoint {} of {} was made from another "
+                             "input".format(self.path, stage))
+        return row[1]
+
+    def Put_round(self, stage, round_number, rows):
+        '''
+        Put_round - store the (twtid, label, topics) recategorized in a round,
+        the round only counts once it is all written
+        '''
+        with self._db:
+            # a round left half written by a stopped run is written again
+            self._db.execute(
+                "DELETE FROM changes WHERE stage = ? AND round >= ?",
+                (stage, round_number))
+            self._db.executemany(
+                "INSERT INTO changes VALUES (?, ?, ?, ?, ?)",
+                [(stage, round_number, _encode_id(twtid), label,
+                  json.dumps(sorted(topics), ensure_ascii=False)
+                  if topics is not None else None)
+                 for twtid, label, topics in rows])
+            self._db.execute(
+                "UPDATE stages SET round_done = ? WHERE stage = ?",
+                (round_number, stage))
+
+    def Changes(self, stage, round_done):
+        '''
+        Changes - generator of the (round, twtid, label, topics) written for a
+        stage up to round round_done, in the order they were made
+        '''
+        rows = self._db.execute(
+            "SELECT round, twtid, label, topics FROM changes "
+            "WHERE stage = ? AND round <= ? ORDER BY rowid",
+            (stage, round_done))
+        for round_number, twtid, label, topics in rows:
+            yield (round_number, json.loads(twtid), label,
+                   json.loads(topics) if topics is not None else None)
+
+    def Clear(self):
+        '''
+        Clear - forget everything, to start a job again from nothing
+        '''
+        with self._db:
+            self._db.execute("DELETE FROM stages")
+            self._db.execute("DELETE FROM tweets")
+            self._db.execute("DELETE FROM changes")
+
+    def Close(self):
+        self._db.close()
@@ -3,21 +3,20 @@
 nlpru.clean
 """
 from __future__ import print_function
-import pymorphy2
 import string
 import re
-import emoji
-import nltk
-import sys
+from functools import lru_cache, partial
 #from nltk import word_tokenize
 from nlpru import stop_words as tsw
-from nltk.corpus import stopwords
+from nlpru import resources
+from nlpru import stats as _stats
+from nlpru.cache import lemma_cache
+from nlpru.parallel import Chunked, Map_chunks
 
 # --------------------------
-# create stopwords and lemmatization
-stop = stopwords.words('russian')
+# create stopwords - the nltk stopwords and the pymorphy2 analyzer are
+# loaded lazily through nlpru.resources
 exclude = list(string.punctuation)
-morph = pymorphy2.MorphAnalyzer()
 for each in tsw.sw:
     exclude.append(each)
 
@@ -29,12 +28,145 @@ en_alphabet.append('і')
 numbers = list(tsw.numbers)
 consonants = list(tsw.ru_consonants)
 
-emojis = ''.join(each for each in emoji.UNICODE_EMOJI)
-
-non_bmp_map = dict.fromkeys(range(0x10000, sys.maxunicode + 1), 0xfffd)
+# punctuation whose spacing is normalised by Clean_document, paired with what
+# it is replaced by (the '.' and '?' replacements keep their escape backslash,
+# as the original re.sub() based implementation did)
+spacing_chars = [(',', ','), ('.', '\\.'), ('?', '\\?'),
+                 ('!', '!'), (':', ':'), (';', ';')]
 # --------------------------
 
 
+class _CleaningEngine:
+    '''
+    _CleaningEngine - the precompiled form of one combination of the
+    Clean_document options. The removal stages are compiled once and skipped
+    when the document cannot match them, emoji/special characters/new lines
+    are handled by str.translate tables and spacing is normalised in one pass.
+    Use _get_engine() rather than building it directly so that engines are
+    shared.
+
+    The output is the same as the original step by step Clean_document
+    (checked against it in tests/test_clean.py), except that:
+     - emoji are removed (the original pattern never matched)
+     - swears are removed in one left to right pass over the alternation of
+       all of them, and every hit is removed (the original removed only the
+       first two hits of each one, one swear after the other). A swear that
+       only appears once another is removed is kept: 'ещётвою матьбля' gives
+       'ещё', where the original gave 'ещля' (removing 'твою мать' made 'ёб')
+    '''
+
+    def __init__(self,
+                 remove_RTs,
+                 remove_hashtags,
+                 remove_mentions,
+                 remove_urls,
+                 remove_emoji,
+                 remove_swears,
+                 remove_special_chars):
+        # (trigger, patterns) pairs applied in order - the trigger is a plain
+        # substring that must be present for any of the patterns to match
+        self._stages = []
+        if remove_RTs:
+            self._stages.append(('RT ', [re.compile('RT (.*?) ')]))
+        if remove_hashtags:
+            self._stages.append(('#', [
+                re.compile('#(.+?) '),  # hashtags - in the middle
+                re.compile('#(.+?)$')]))  # hashtags - in the end
+        if remove_mentions:
+            self._stages.append(('@', [
+                re.compile(r'@\w* '),  # mentions - in the middle
+                re.compile(r'@\w*$')]))  # mentions - in the end
+        if remove_urls:
+            self._stages.append(('http', [
+                # urls in the middle of the tweet
+                re.compile('http(.+?) '),
+                # urls at the end of the tweet, or followed by a new line
+                re.compile('http(?:.+?$|.+?\n)')]))
+        emoji_table = {}
+        if remove_emoji:
+            emoji_table = dict.fromkeys(
+                ord(char) for char in resources.Get('emoji_chars'))
+        self._swears = None
+        if remove_swears:
+            self._swears = re.compile('|'.join(['твою мать'] + swears))
+            # emoji has to go before the swears, and special chars after
+            self._pre_table = emoji_table
+            emoji_table = {}
+        else:
+            self._pre_table = None
+        self._post_table = dict(emoji_table)
+        if remove_special_chars:
+            self._post_table.update(
+                dict.fromkeys(ord(char) for char in tsw.special_chars))
+        # remove white spaces, i.e. new lines
+        self._post_table[ord('\n')] = '.'
+        self._spacing = re.compile(
+            '[ ' + re.escape(''.join(c for c, _ in spacing_chars)) + ']+')
+
+    def clean(self, doc):
+        '''
+        clean - apply the compiled stages to a single document
+        '''
+        for trigger, patterns in self._stages:
+            if trigger in doc:
+                for pattern in patterns:
+                    doc = pattern.sub('', doc)
+        if self._swears is not None:
+            if self._pre_table:
+                doc = doc.translate(self._pre_table)
+            doc = self._swears.sub('', doc)
+        doc = doc.translate(self._post_table)
+        doc = self._spacing.sub(_normalize_spacing, doc)
+        return doc.strip()
+
+
+def _normalize_spacing(match):
+    '''
+    regex callback for a run of spaces and punctuation
+    '''
+    return _normalize_run(match.group(0))
+
+
+@lru_cache(maxsize=4096)
+def _normalize_run(run):
+    '''
+    validate that spaces that should exist actually exist - every space sits
+    in a run of spaces/punctuation, so this gives the same result as applying
+    the rules to the whole document
+    '''
+    for character, replacement in spacing_chars:
+        run = run.replace(' ' + character, replacement)
+        run = run.replace(character, replacement + ' ')
+    return re.sub(' +', ' ', run)  # remove extra spaces
+
+
+@lru_cache(maxsize=None)
+def _get_engine(*flags):
+    '''
+    return the _CleaningEngine for a combination of Clean_document flags,
+    compiling it on first use
+    '''
+    return _CleaningEngine(*flags)
+
+
+def _clean_chunk(flags, documents):
+    '''
+    worker side of Cleaner.Clean_corpus
+    '''
+    engine = _get_engine(*flags)
+    return [engine.clean(doc) for doc in documents]
+
+
+def __getattr__(name):
+    # backwards compatibility for the former module level resources
+    if name == 'stop':
+        return list(resources.Get('stopwords'))
+    if name == 'morph':
+        return resources.Get('morph')
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
 class Cleaner:
     '''
     The Cleaner object works by cleaning a specified piece of text for
@@ -67,39 +199,106 @@ class Cleaner:
          - remove_hashtags
          - remove_mentions
         '''
-        doc = input_document
-        # RTs
-        if remove_RTs == True:
-            doc = re.sub('RT (.*?) ', '', doc)
-        if remove_hashtags == True:
-            doc = re.sub('#(.+?) ', '', doc)  # hashtags - in the middle
-            doc = re.sub('#(.+?)$', '', doc)  # hashtags - in the end
-        if remove_mentions == True:
-            doc = re.sub('@\w* ', '', doc)  # mentions - in the middle
-            doc = re.sub('@\w*$', '', doc)  # mentions - in the emd
-        if remove_urls == True:
-            # urls in the middle of the tweet
-            doc = re.sub('http(.+?) ', '', doc)
-            doc = re.sub('http(.+?)$', '', doc)  # urls at the end of the tweet
-            # urls in the middle of the tweet
-            doc = re.sub('http(.+?)\n', '', doc)
-        if remove_emoji == True:
-            doc = re.sub(emojis, '', doc)  # emojis version
-        if remove_swears == True:
-            doc = re.sub('твою мать', '', doc, re.IGNORECASE)
-            for swear in swears:
-                doc = re.sub(swear, '', doc, re.IGNORECASE)
-        if remove_special_chars == True:
-            doc = re.sub(
-                """[→©ђ°ѓ¡|\|=/\\▶►‼?~é̄̃`«»;џ�_●▪™“„#ї*&%¿$\-\”<>'|/?~`\+\：«»;_“„&^№€…)(—]""", '', doc)
-        doc = re.sub('\n', '.', doc)  # remove white spaces, i.e. new lines
-        # validate that spaces that should exist actually exist
-        for character in [',', r'\.', r'\?', r'!', r':', r';']:
-            doc = re.sub(' '+character, character, doc)
-            doc = re.sub(character, character+' ', doc)
-        doc = re.sub(' +', ' ', doc)  # remove extra spaces
-        doc = doc.strip()
-        return doc
+        engine = _get_engine(remove_RTs == True,
+                             remove_hashtags == True,
+                             remove_mentions == True,
+                             remove_urls == True,
+                             remove_emoji == True,
+                             remove_swears == True,
+                             remove_special_chars == True)
+        if _stats.active is not None:
+            with _stats.active.Timer('clean_document'):
+                return engine.clean(input_document)
+        return engine.clean(input_document)
+
+    def Clean_documents(self,
+                        input_documents,
+                        remove_RTs=True,
+                        remove_hashtags=True,
+                        remove_mentions=True,
+                        remove_urls=True,
+                        remove_emoji=True,
+                        remove_swears=False,
+                        remove_special_chars=True):
+        '''
+        Clean_documents - batch version of Clean_document, cleans every
+        document of an iterable with the same options
+
+        input:
+        - input_documents - any iterable of strings (list, generator, etc)
+        output:
+        - generator of the cleaned strings, in the input order
+
+        Options are the same as for Clean_document
+        '''
+        engine = _get_engine(remove_RTs == True,
+                             remove_hashtags == True,
+                             remove_mentions == True,
+                             remove_urls == True,
+                             remove_emoji == True,
+                             remove_swears == True,
+                             remove_special_chars == True)
+        stats = _stats.active
+        for doc in input_documents:
+            if stats is not None:
+                with stats.Timer('clean_document'):
+                    cleaned = engine.clean(doc)
+                yield cleaned
+            else:
+                yield engine.clean(doc)
+
+    def Clean_corpus(self,
+                     corpus,
+                     processes=None,
+                     chunksize=1000,
+                     remove_RTs=True,
+                     remove_hashtags=True,
+                     remove_mentions=True,
+                     remove_urls=True,
+                     remove_emoji=True,
+                     remove_swears=False,
+                     remove_special_chars=True):
+        '''
+        Clean_corpus - cleans a whole corpus, optionally in several processes
+
+        input:
+        - corpus - either a dictionary of tweets ({'twtid':{'text':...},...})
+        or any iterable of strings
+        - processes - number of worker processes to use. None (default) or 1
+        cleans in this process
+        - chunksize - number of documents sent to a worker at a time
+        output:
+        - for a dictionary of tweets, a dictionary of the cleaned text by
+        twtid, otherwise a list of the cleaned strings. Either way in the
+        order of the input, and the same as cleaning them one by one
+
+        Options are the same as for Clean_document
+        '''
+        flags = (remove_RTs == True,
+                 remove_hashtags == True,
+                 remove_mentions == True,
+                 remove_urls == True,
+                 remove_emoji == True,
+                 remove_swears == True,
+                 remove_special_chars == True)
+        if type(corpus) is dict:
+            ids = list(corpus)
+            documents = (corpus[twtid]['text'] for twtid in ids)
+        else:
+            ids = None
+            documents = corpus
+        if processes is None or processes <= 1:
+            cleaned = list(self.Clean_documents(documents, *flags))
+        else:
+            cleaned = []
+            for result in Map_chunks(partial(_clean_chunk, flags),
+                                     Chunked(documents, chunksize),
+                                     processes,
+                                     resource_names=['emoji_chars']):
+                cleaned.extend(result)
+        if ids is None:
+            return cleaned
+        return dict(zip(ids, cleaned))
 
     def Check_word(self,
                    word,
@@ -127,9 +326,72 @@ class Cleaner:
         acronyms)
          - if lemmatize=True (default), the normal form of the word is returned
          - if remove_proper_nouns=True (default), proper nouns (plural/singlular),
-        usually place names or indivdual names, are removed
+        usually place names or indivdual names, are removed. Proper nouns are
+        those pymorphy2 tags as Name, Surn, Patr, Geox or Orgn
+
+        Results are cached (see nlpru.cache.lemma_cache), so a word is only
+        checked once for a given set of options. With nlpru.stats enabled the
+        rejected words are counted by reason ('check_word' counters)
+        '''
+        # verdicts are cached on the lowercased word and the options used
+        key = (word.lower(),
+               lemmatize == True,
+               remove_proper_nouns == True,
+               allow_acronyms == False,
+               exclude_english_words == True)
+        verdict = lemma_cache.Lookup(key)
+        if verdict is None:
+            verdict = self._check_word_(word, *key[1:])
+            lemma_cache.Store(key, verdict)
+        if _stats.active is not None:
+            _stats.active.Count('check_word', verdict[2] or 'ok')
+        return {'word': verdict[0], 'status': verdict[1]}
+
+    def Check_words(self,
+                    words,
+                    lemmatize=True,
+                    remove_proper_nouns=True,
+                    allow_acronyms=False,
+                    exclude_english_words=True):
+        '''
+        Check_words - batch version of Check_word. Every distinct word of the
+        list is only checked (and parsed) once.
+
+        input:
+        - words - list (or any iterable) of tokens
+        output:
+        - list of Check_word result dictionaries, in the order of the input
+
+        Options are the same as for Check_word
         '''
+        words = list(words)
+        verdicts = {}
+        for word in words:
+            if word not in verdicts:
+                verdicts[word] = self.Check_word(
+                    word,
+                    lemmatize=lemmatize,
+                    remove_proper_nouns=remove_proper_nouns,
+                    allow_acronyms=allow_acronyms,
+                    exclude_english_words=exclude_english_words)
+        return [dict(verdicts[word]) for word in words]
+
+    def _check_word_(self,
+                     word,
+                     lemmatize,
+                     remove_proper_nouns,
+                     disallow_acronyms,
+                     exclude_english_words):
+        """
+        uncached Check_word, returns the (word, status, reason) verdict -
+        reason is None for accepted words, otherwise why it was rejected:
+        'stopword', 'non_cyrillic', 'digits', 'short', 'acronym',
+        'english_letters', 'empty_lemma' or 'proper_noun'
+        """
+        stop = resources.Get('stopwords')
+        word_lower = word.lower()
         result = {}
+        reason = None
         if (word.lower() not in stop) and \
            (word.lower() not in exclude) and \
            len(set(word.lower()).intersection(set(ru_alphabet))) > 0 and \
@@ -137,36 +399,56 @@ class Cleaner:
            len(word) > 2:
             result['word'] = word.lower()
             result['status'] = 'ok'
-            if allow_acronyms == False and \
+            if disallow_acronyms and \
                len(set(word.lower()).intersection(set(consonants))) == 0:
                 result['word'] = ''
                 result['status'] = 'empty'
-            if exclude_english_words == True and \
+                reason = 'acronym'
+            if exclude_english_words and \
                len(set(word.lower()).intersection(set(en_alphabet))) > 0:
                 result['word'] = ''
                 result['status'] = 'empty'
-            if lemmatize == True:
-                word = morph.normal_forms(result['word'])[0]
+                reason = 'english_letters'
+            if lemmatize:
+                word = lemma_cache.Lemma(result['word'])
                 result['word'] = word
                 if len(word) > 0:
                     result['status'] = 'ok'
+                    reason = None
                 else:
                     result['status'] = 'empty'
-            if remove_proper_nouns == True:
-                if len(nltk.pos_tag([result['word']])[0]) > 0:
-                    if nltk.pos_tag([result['word']])[0][1] == 'NNP' or \
-                       nltk.pos_tag([result['word']])[0][1] == 'NNPS':
-                        result['word'] = ''
-                        result['status'] = 'empty'
+                    reason = reason or 'empty_lemma'
+            # proper nouns - from the same pymorphy2 parse as the lemma
+            if remove_proper_nouns and len(result['word']) > 0 and \
+               lemma_cache.Is_proper_noun(word_lower):
+                result['word'] = ''
+                result['status'] = 'empty'
+                reason = 'proper_noun'
             if (result['word'] in stop) and \
                (result['word'] in exclude):
                 result['word'] = ''
                 result['status'] = 'empty'
+                reason = 'stopword'
 
         else:
             result['word'] = ''
             result['status'] = 'empty'
-        return result
+            reason = _rejection_reason(word)
+        return (result['word'], result['status'], reason)
+
+
+def _rejection_reason(word):
+    """
+    which of the first checks of Check_word a word failed
+    """
+    word_lower = word.lower()
+    if word_lower in resources.Get('stopwords') or word_lower in exclude:
+        return 'stopword'
+    if not set(word_lower).intersection(ru_alphabet):
+        return 'non_cyrillic'
+    if set(word_lower).intersection(numbers):
+        return 'digits'
+    return 'short'
 
 
 if __name__ == '__main__':
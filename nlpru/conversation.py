@@ -3,8 +3,14 @@
 nlpru.conversation
 """
 from __future__ import print_function
+import heapq
+import itertools
+import json
+from nlpru import stats as _stats
+from nlpru.checkpoint import Input_hash
 from nlpru.error import ConversationError
-from nlpru.models import Convert_to_tweet_dictionary
+from nlpru.models import Convert_to_tweet_dictionary, _tweet_access
+from nlpru.topics import _topics_label, two_topics_label, many_topics_label
 
 
 class Conversations:
@@ -13,7 +19,7 @@ class Conversations:
     to the topic by checking the conversation thread affects.  
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, no_topic_label="none detected", topics=None, **kwargs):
         """
         @parameters:
         - retweet_list - list of retweets in the manner of 
@@ -22,8 +28,22 @@ class Conversations:
             [('tweet id','replyng to tweet id'),...]
         - quote_list - list of all times a quote is made in the manner of
             [('tweet id','quoting tweet id'),...]
+
+        for the incremental methods (Add_tweet, Add_edge, Set_topic), see
+        Recategorize_all_topics for their meaning:
+        - no_topic_label - label of the tweets without a topic
+        - topics - labels to spread, by default all of them
         """
         self._validate_input_(kwargs)
+        self._live_no_topic = no_topic_label
+        self._live_topics = set(topics) if topics is not None else None
+        # incremental state: the topic each tweet was added with, and for the
+        # tweets on (or reached by) a topic, the distance to the nearest tweet
+        # on a topic and the topics at that distance
+        self._base = {}
+        self._dist = {}
+        self._reach = {}
+        self._sequence = itertools.count()
 
     def _validate_input_(self, kwargs):
         """
@@ -34,25 +54,41 @@ class Conversations:
                 self._retweets = {each[0]: each[1]
                                   for each in kwargs['retweet_list']}
             else:
-                self._retweets = []
+                self._retweets = {}
             if 'quote_list' in kwargs:
                 self._quotes = {each[0]: each[1]
                                 for each in kwargs['quote_list']}
             else:
-                self._quotes = []
+                self._quotes = {}
             if 'reply_list' in kwargs:
                 self._replies = {each[0]: each[1]
                                  for each in kwargs['reply_list']}
             else:
-                self._replies = []
+                self._replies = {}
         except Exception as e:
             raise ConversationError(
                 "Improper input for Conversations:" + str(e))
+        self._children = None
+        self._hops = {}
+        self._counts = {}
+
+    def _build_children_(self):
+        """
+        reverse adjacency of the conversation links: tweet id -> ids of the
+        tweets that reply to, quote or retweet it
+        """
+        children = {}
+        for links in (self._replies, self._quotes, self._retweets):
+            for twtid, parent in links.items():
+                children.setdefault(parent, []).append(twtid)
+        self._children = children
 
     # ----------------------main function---------------------------------------------
     def Recategorize_topics(self,
                             topic_for_which_to_check,
                             no_topic_label="none detected",
+                            hop_distance=False,
+                            checkpoint=None,
                             **kwargs):
         """
         Check and recategorize the tweets NOT about the topic but should be
@@ -63,6 +99,13 @@ class Conversations:
                 default - 'none detected'
             - topic_for_which_to_check - what is the label you want to check for?
                 for ex: topic_for_which_to_check = 'topic 1'
+            - hop_distance - if True, record for every recategorized tweet how
+                many links away it is from a tweet that was on the topic, see
+                Hop_distances()
+            - checkpoint - (optional) nlpru.checkpoint.Checkpoint the tweets
+                recategorized in every round are written to. Run again with
+                the same checkpoint (and input) the rounds already written are
+                applied from it and the spread goes on from the last one
 
         @other parameters - tweets
             If you are inputting a list of tuples:
@@ -76,6 +119,7 @@ class Conversations:
             - tweet_dict - dictionary of tweets by twtid as the key
                 - NOTE: the following dict is expected:
                     {'twtid':{'text':'bla bla bla ... ',...},....}
+            - or a nlpru.models.TweetStore (as tweet_dict or tweet_store)
 
 
         @returns: dict of tweets and their topics 
@@ -83,57 +127,391 @@ class Conversations:
         self._topic_for_which_to_check = topic_for_which_to_check
         self._no_topic_label = no_topic_label
         self._tweet_dict = Convert_to_tweet_dictionary(**kwargs)
-        return self._recategorize_mast_()
+        self._tweets = _tweet_access(self._tweet_dict)
+        self._record_hops = hop_distance
+        self._hops = {}
+        self._counts = {}
+        with _stats.Timer('recategorize_topics'):
+            return self._recategorize_mast_(checkpoint)
+
+    def Recategorize_all_topics(self,
+                                topics=None,
+                                no_topic_label="none detected",
+                                hop_distance=False,
+                                checkpoint=None,
+                                **kwargs):
+        """
+        Recategorize the tweets NOT about any topic for many topics at once, in
+        a single pass through the conversations
+
+        A tweet takes the topics of the nearest tweets on a topic it is linked
+        to (by reply, quote or retweet, directly or through other tweets
+        without a topic). If more than one topic reaches it at that same
+        distance it is labelled as in Keyword_Match: 'applies to 2 topics' or
+        'applies to more than 2 topics' - and it passes all of those topics on
+
+        @parameters:
+            - topics - list of the topic labels to spread, by default every
+                label found other than no_topic_label and the 'applies to 2
+                topics'/'applies to more than 2 topics' labels
+            - no_topic_label, hop_distance, checkpoint and the tweets - as in
+                Recategorize_topics
+
+        @returns: dict of tweets and their topics, the number of tweets
+            each topic spread to is given by Recategorized_counts()
+        """
+        self._no_topic_label = no_topic_label
+        self._tweet_dict = Convert_to_tweet_dictionary(**kwargs)
+        self._tweets = _tweet_access(self._tweet_dict)
+        self._record_hops = hop_distance
+        self._hops = {}
+        self._counts = {}
+        with _stats.Timer('recategorize_all_topics'):
+            return self._recategorize_all_mast_(topics, checkpoint)
+
+    def Hop_distances(self):
+        """
+        Hop_distances - dictionary by twtid of the number of reply/quote/retweet
+        links between each tweet recategorized by the last Recategorize_topics
+        (called with hop_distance=True) and the nearest tweet on the topic
+        """
+        return self._hops
+
+    def Recategorized_counts(self):
+        """
+        Recategorized_counts - dictionary by topic of the number of tweets
+        the topic spread to in the last Recategorize_topics or
+        Recategorize_all_topics. A tweet reached by several topics (labelled
+        'applies to 2 topics' or 'applies to more than 2 topics') is counted
+        for each of them, so the counts can add up to more than the number of
+        tweets recategorized
+        """
+        return self._counts
+
+    def Links(self):
+        """
+        Links - generator of (tweet id, parent tweet id, kind) of all the
+        links, kind being 'reply', 'quote' or 'retweet'
+        """
+        for kind, links in (('reply', self._replies),
+                            ('quote', self._quotes),
+                            ('retweet', self._retweets)):
+            for twtid, parent in links.items():
+                yield twtid, parent, kind
+
+    def Graph(self):
+        """
+        Graph - the links as a nlpru.graph.ConversationGraph (numpy arrays),
+        for thread and cascade analytics: roots, depths, thread sizes, etc.
+        """
+        from nlpru.graph import ConversationGraph
+        return ConversationGraph(reply_list=self._replies,
+                                 quote_list=self._quotes,
+                                 retweet_list=self._retweets)
+
+    # ----------------------incremental updates--------------------------------------------
+    def Add_tweet(self, twtid, topic="none detected"):
+        """
+        Add_tweet - add a tweet (with the topic found by Keyword_Match) and
+        spread its topic, or the topic of the tweets it is linked to, to the
+        tweets linked to it - including replies, quotes and retweets of it
+        that were added before the tweet itself. Adding a known tweet again
+        changes its topic, as Set_topic
+        """
+        if twtid in self._base:
+            return self.Set_topic(twtid, topic)
+        if self._children is None:
+            self._build_children_()
+        self._base[twtid] = topic
+        heap = []
+        self._offer_base_(twtid, heap)
+        self._relax_(heap)
+
+    def Add_tweets(self, **kwargs):
+        """
+        Add_tweets - add many tweets (as a tweet dict, TweetStore, ... like in
+        Recategorize_topics) and spread their topics in one go
+        """
+        if self._children is None:
+            self._build_children_()
+        tweets = _tweet_access(Convert_to_tweet_dictionary(**kwargs))
+        changed = []
+        for twtid in tweets.Ids():
+            topic = tweets.Topic(twtid)
+            if topic is None:
+                topic = self._live_no_topic
+            if twtid in self._base:
+                changed.append(twtid)
+            self._base[twtid] = topic
+        if changed:
+            self._recompute_(changed)
+        heap = []
+        for twtid in tweets.Ids():
+            self._offer_base_(twtid, heap)
+        self._relax_(heap)
+
+    def Add_edge(self, twtid, parent, kind='reply'):
+        """
+        Add_edge - add a link from twtid to the tweet it replies to, quotes or
+        retweets (kind - 'reply', 'quote' or 'retweet'), the tweets do not
+        have to be added yet. As in the lists given to Conversations, a tweet
+        has at most one link of each kind - a new one replaces the old one
+        """
+        links = {'reply': self._replies,
+                 'quote': self._quotes,
+                 'retweet': self._retweets}.get(kind)
+        if links is None:
+            raise ConversationError("Unknown kind of link: {}".format(kind))
+        if self._children is None:
+            self._build_children_()
+        old_parent = links.get(twtid)
+        if old_parent == parent:
+            return
+        links[twtid] = parent
+        self._children.setdefault(parent, []).append(twtid)
+        if old_parent is not None:
+            self._children[old_parent].remove(twtid)
+            if twtid in self._base:
+                # losing a link can take a topic away, work the tweet out again
+                self._recompute_([twtid])
+        elif parent in self._dist and \
+                self._base.get(twtid, None) == self._live_no_topic:
+            heap = []
+            self._offer_(twtid, self._dist[parent] + 1, self._reach[parent], heap)
+            self._relax_(heap)
+
+    def Set_topic(self, twtid, topic):
+        """
+        Set_topic - change the (Keyword_Match) topic of a tweet and update the
+        tweets that depend on it
+        """
+        if twtid not in self._base:
+            return self.Add_tweet(twtid, topic)
+        if self._base[twtid] == topic:
+            return
+        self._base[twtid] = topic
+        self._recompute_([twtid])
+
+    def Topic(self, twtid):
+        """
+        Topic - current topic label of a tweet added with Add_tweet
+        """
+        base = self._base[twtid]
+        if base != self._live_no_topic or twtid not in self._reach:
+            return base
+        return _topics_label(self._reach[twtid])
+
+    def Topics(self):
+        """
+        Topics - dictionary by twtid of the current topic label of every tweet
+        added with Add_tweet
+        """
+        return {twtid: self.Topic(twtid) for twtid in self._base}
+
+    def _is_seed_(self, topic):
+        if self._live_topics is not None:
+            return topic in self._live_topics
+        return topic not in (None, self._live_no_topic,
+                             two_topics_label, many_topics_label)
+
+    def _parents_(self, twtid):
+        for links in (self._replies, self._quotes, self._retweets):
+            if twtid in links:
+                yield links[twtid]
+
+    def _offer_base_(self, twtid, heap):
+        """
+        offer a tweet the distance it gets from its own topic, or else from
+        the tweets it is linked to
+        """
+        base = self._base[twtid]
+        if self._is_seed_(base):
+            self._offer_(twtid, 0, frozenset([base]), heap)
+        elif base == self._live_no_topic:
+            for parent in self._parents_(twtid):
+                if parent in self._dist:
+                    self._offer_(twtid, self._dist[parent] + 1,
+                                 self._reach[parent], heap)
+
+    def _offer_(self, twtid, dist, topics, heap):
+        current = self._dist.get(twtid)
+        if current is None or dist < current:
+            self._dist[twtid] = dist
+            self._reach[twtid] = topics
+        elif dist == current and not topics <= self._reach[twtid]:
+            self._reach[twtid] = self._reach[twtid] | topics
+        else:
+            return
+        heapq.heappush(heap, (dist, next(self._sequence), twtid))
+
+    def _relax_(self, heap):
+        """
+        spread the offered distances/topics to the tweets without a topic
+        linked to them, nearest first, only as far as something changes
+        """
+        while heap:
+            dist, _, twtid = heapq.heappop(heap)
+            if self._dist.get(twtid) != dist:
+                continue
+            topics = self._reach[twtid]
+            for child in self._children.get(twtid, ()):
+                if self._base.get(child, None) == self._live_no_topic:
+                    self._offer_(child, dist + 1, topics, heap)
+
+    def _recompute_(self, twtids):
+        """
+        forget what the tweets and everything depending on them (the tweets
+        without a topic linked to them, directly or not) were reached by, and
+        work it out again from the tweets around them
+        """
+        region = set(twtids)
+        stack = list(twtids)
+        while stack:
+            for child in self._children.get(stack.pop(), ()):
+                if child not in region and \
+                        self._base.get(child, None) == self._live_no_topic:
+                    region.add(child)
+                    stack.append(child)
+        for twtid in region:
+            self._dist.pop(twtid, None)
+            self._reach.pop(twtid, None)
+        heap = []
+        for twtid in region:
+            if twtid in self._base:
+                self._offer_base_(twtid, heap)
+        self._relax_(heap)
 
     # ----------------------supporting functions-----------------------------------------
-    def _recategorize_mast_(self):
+    def _recategorize_mast_(self, checkpoint=None):
         """
         main function that recagorizes tweets based on the initial input of tweets
+
+        the topic spreads breadth first from the tweets on the topic to the
+        tweets without one that reply to, quote or retweet them (and so on), so
+        every tweet and link is only looked at once. A tweet recategorized in
+        round i is i links away from the nearest tweet that was on the topic
+        """
+        if self._children is None:
+            self._build_children_()
+        tweets = self._tweets
+        topic = self._topic_for_which_to_check
+        no_topic = self._no_topic_label
+        frontier = [tweet for tweet in tweets.Ids() if tweets.Topic(tweet) == topic]
+        i = 1
+        if checkpoint is not None:
+            stage = 'recategorize_topics ' + json.dumps(topic,
+                                                        ensure_ascii=False)
+            round_done, last_round = self._resume_(checkpoint, stage)
+            if round_done:
+                frontier = [tweet for tweet, _ in last_round]
+                i = round_done + 1
+        while frontier:
+            changed = []
+            for parent in frontier:
+                for tweet in self._children.get(parent, ()):
+                    # only change the topic if the tweet was NOT on a topic
+                    if tweet in tweets and tweets.Topic(tweet) == no_topic:
+                        tweets.Set_topic(tweet, topic)
+                        changed.append(tweet)
+                        if self._record_hops:
+                            self._hops[tweet] = i
+            _stats.Event('recategorize_round', topic=topic, round=i,
+                         recategorized=len(changed))
+            _stats.Count('propagation', 'rounds')
+            _stats.Count('propagation', 'recategorized', len(changed))
+            if changed:
+                self._count_([topic], len(changed))
+            if checkpoint is not None:
+                checkpoint.Put_round(stage, i, [(tweet, topic, None)
+                                                for tweet in changed])
+            i += 1
+            frontier = changed
+        return self._tweet_dict
+
+    def _recategorize_all_mast_(self, topics, checkpoint=None):
         """
-        # create a copy of the original tweet dict to work with
-#        tweet_dict = self._tweet_dict.copy()
+        same breadth first spread as _recategorize_mast_, but the frontier
+        carries the set of topics of every tweet. The tweets reached in a round
+        are only labelled at the end of it, so one reached from several topics
+        in the same round gets all of them, whatever the order of the links
+        """
+        if self._children is None:
+            self._build_children_()
+        tweets = self._tweets
+        no_topic = self._no_topic_label
+        if topics is None:
+            not_topics = (None, no_topic, two_topics_label, many_topics_label)
+        else:
+            topics = set(topics)
+        frontier = {}
+        for tweet in tweets.Ids():
+            topic = tweets.Topic(tweet)
+            if (topic in topics) if topics is not None else (topic not in not_topics):
+                frontier[tweet] = frozenset([topic])
         i = 1
-        while True:
-            n_changed = 0
-            # iterate over all the tweets in the master input dict
-            for tweet, value in self._tweet_dict.items():
-                # only check and change the topic if the topic was NOT on the topic of interest
-                if value['topic'] == self._no_topic_label:
-                    result = self._recategorize_check_tweet_(tweet)
-                    if result == "change":
-                        self._tweet_dict[tweet]['topic'] = self._topic_for_which_to_check
-                        n_changed += 1
-            print("{i} iteration completed, recategorized this round: {n}".format(
-                i=i, n=n_changed))
+        if checkpoint is not None:
+            stage = 'recategorize_all_topics ' + json.dumps(
+                sorted(topics) if topics is not None else None,
+                ensure_ascii=False)
+            round_done, last_round = self._resume_(checkpoint, stage)
+            if round_done:
+                frontier = {tweet: frozenset(tweet_topics)
+                            for tweet, tweet_topics in last_round}
+                i = round_done + 1
+        while frontier:
+            reached = {}
+            for parent, parent_topics in frontier.items():
+                for tweet in self._children.get(parent, ()):
+                    if tweet in reached:
+                        reached[tweet] = reached[tweet] | parent_topics
+                    elif tweet in tweets and tweets.Topic(tweet) == no_topic:
+                        reached[tweet] = parent_topics
+            for tweet, tweet_topics in reached.items():
+                tweets.Set_topic(tweet, _topics_label(tweet_topics))
+                self._count_(tweet_topics)
+                if self._record_hops:
+                    self._hops[tweet] = i
+            _stats.Event('recategorize_round', topic=None, round=i,
+                         recategorized=len(reached))
+            _stats.Count('propagation', 'rounds')
+            _stats.Count('propagation', 'recategorized', len(reached))
+            if checkpoint is not None:
+                checkpoint.Put_round(stage, i, [
+                    (tweet, _topics_label(tweet_topics), tweet_topics)
+                    for tweet, tweet_topics in reached.items()])
             i += 1
-            # if no more tweets are being changed, exit the loop
-            if n_changed == 0:
-                break
+            frontier = reached
         return self._tweet_dict
 
-    def _recategorize_check_tweet_(self, twtid):
-        """
-        check the tweet that is inputted as about the applicable rules
-        """
-        # default 'result' of the check is None. If a match is made with any of the convo links,
-        # then 'result' is updated.
-        result = None
-        # check replies -- if this tweet was a reply to the other tweet
-        if twtid in self._replies and self._replies[twtid] in self._tweet_dict:
-            # check if the topic of the replied to tweet was on the topic we are listening to
-            if self._tweet_dict[self._replies[twtid]]['topic'] == self._topic_for_which_to_check:
-                result = "change"
-        # check quotes -- if this tweet quoted another tweet
-        if twtid in self._quotes and self._quotes[twtid] in self._tweet_dict:
-            # now check if the topic of the quoted tweet was on the topic of interest
-            if self._tweet_dict[self._quotes[twtid]]['topic'] == self._topic_for_which_to_check:
-                result = "change"
-        # check retweets -- if this tweet retweeted another tweet
-        if twtid in self._retweets and self._retweets[twtid] in self._tweet_dict:
-            # if the retweeted tweet was on the topic, then change the retweeting tweet topic
-            if self._tweet_dict[self._retweets[twtid]]['topic'] == self._topic_for_which_to_check:
-                result = "change"
-        return result
+    def _resume_(self, checkpoint, stage):
+        """
+        apply the rounds of a stage already in the checkpoint (as they were
+        made) and return the number of the last one with its (twtid, topics)
+        - the frontier to go on from
+        """
+        tweets = self._tweets
+        identity = json.dumps(self._no_topic_label, ensure_ascii=False) + \
+            ' ' + Input_hash(((tweet, tweets.Topic(tweet))
+                              for tweet in tweets.Ids()),
+                             [self._replies.items(), self._quotes.items(),
+                              self._retweets.items()])
+        round_done = checkpoint.Start(stage, identity)
+        last_round = []
+        for i, tweet, label, tweet_topics in checkpoint.Changes(stage,
+                                                                round_done):
+            tweets.Set_topic(tweet, label)
+            self._count_(tweet_topics if tweet_topics is not None
+                         else [label])
+            if self._record_hops:
+                self._hops[tweet] = i
+            if i == round_done:
+                last_round.append((tweet, tweet_topics))
+        _stats.Count('propagation', 'rounds_from_checkpoint', round_done)
+        return round_done, last_round
+
+    def _count_(self, topics, n=1):
+        for topic in topics:
+            self._counts[topic] = self._counts.get(topic, 0) + n
 
 
 if __name__ == '__main__':
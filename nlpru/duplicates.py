@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.duplicates
+
+near duplicate (copypasta) detection: tweets are turned into MinHash
+signatures of their word or character n-grams and grouped by locality
+sensitive hashing (LSH), so that only tweets sharing a band of their
+signature are ever compared. The cost grows linearly with the number of
+tweets, and tweets can be added in batches as they come.
+"""
+from __future__ import print_function
+import itertools
+import zlib
+
+import numpy as np
+
+from nlpru.cache import lemma_cache
+from nlpru.error import InputError
+from nlpru.semantics import Semantics
+
+
+def _lsh_bands(threshold, num_perm):
+    '''
+    (bands, rows per band) for which the LSH "S-curve" rises at the Jaccard
+    threshold: tweets sharing a band are likely above it, others are not
+    '''
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicates:
+    '''
+    NearDuplicates - finds groups of (near) identical tweets
+
+    @parameters:
+        - threshold - estimated Jaccard similarity of the n-grams above which
+        two tweets are near duplicates
+        - num_perm - length of the MinHash signatures (more is more precise
+        and slower)
+        - shingles - 'word' (n-grams of words) or 'char' (n-grams of
+        characters)
+        - ngram - size of the n-grams, default 3 words or 5 characters
+        - clean, tokenizer - as in Semantics, how tweets are cleaned (default
+        'All') and split into words
+        - use_normal_form - lemmatize the words first (default True, so that
+        changed word endings do not hide a copy)
+        - seed - seed of the hash functions, signatures are only comparable
+        between objects made with the same seed and num_perm
+    '''
+
+    def __init__(self,
+                 threshold=0.8,
+                 num_perm=128,
+                 shingles='word',
+                 ngram=None,
+                 clean='All',
+                 tokenizer=None,
+                 use_normal_form=True,
+                 seed=1):
+        if shingles not in ('word', 'char'):
+            raise InputError("shingles must be 'word' or 'char'")
+        if not 0 < threshold <= 1:
+            raise InputError("threshold must be between 0 and 1")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingles = shingles
+        self.ngram = ngram if ngram is not None else (
+            3 if shingles == 'word' else 5)
+        self.use_normal_form = use_normal_form
+        self._semantics = Semantics(clean=clean, tokenizer=tokenizer)
+        # multiply-shift hash functions, one per permutation
+        random = np.random.RandomState(seed)
+        self._a = random.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64) * \
+            np.uint64(2) + np.uint64(1)
+        self._b = random.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = _lsh_bands(threshold, num_perm)
+        self._buckets = [{} for i in range(self.bands)]
+        self._signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self.ids = []
+        self._positions = {}
+        self._parent = []
+        self._members = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ----------------------signatures--------------------------------------------------
+    def Shingles(self, document):
+        '''
+        Shingles - set of the n-grams of a (cleaned) document
+        '''
+        if self._semantics.clean is not None:
+            document = self._semantics.__clean_doc__(document)
+        words = [word.lower() for word in self._semantics._tokenize(document)
+                 if any(character.isalnum() for character in word)]
+        if self.use_normal_form:
+            words = [lemma_cache.Lemma(word) for word in words]
+        if self.shingles == 'char':
+            text = ' '.join(words)
+            if len(text) <= self.ngram:
+                return {text} if text else set()
+            return {text[i:i + self.ngram]
+                    for i in range(len(text) - self.ngram + 1)}
+        if len(words) <= self.ngram:
+            return {' '.join(words)} if words else set()
+        return {' '.join(words[i:i + self.ngram])
+                for i in range(len(words) - self.ngram + 1)}
+
+    def Signature(self, document):
+        '''
+        Signature - MinHash signature of a document (None if it has no words)
+        '''
+        shingles = self.Shingles(document)
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8'))
+                              for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        values = (np.outer(self._a, hashes) + self._b[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+    def __band_keys__(self, signature):
+        rows = self.rows
+        return [hash(signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(self.bands)]
+
+    def Jaccard(self, first, second):
+        '''
+        Jaccard - estimated Jaccard similarity of two added tweets (by id)
+        '''
+        return self.__similarity__(self._signatures[self._positions[first]],
+                                   self._signatures[self._positions[second]])
+
+    def __similarity__(self, signature, other):
+        return float(np.count_nonzero(signature == other)) / self.num_perm
+
+    # ----------------------clusters------------------------------------------------------
+    def __find__(self, position):
+        parent = self._parent
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    def __union__(self, first, second):
+        first, second = self.__find__(first), self.__find__(second)
+        if first == second:
+            return
+        if len(self._members[first]) < len(self._members[second]):
+            first, second = second, first
+        self._parent[second] = first
+        self._members[first].extend(self._members.pop(second))
+
+    def Add(self, docs_list, ids=None):
+        '''
+        Add - add a batch of tweets, grouping each with the tweets already
+        added that it is a near duplicate of
+
+        @parameters:
+            - docs_list - list (or iterable) of tweet texts
+            - ids - their ids, by default numbers counting on from the number
+            of tweets added so far
+
+        returns: number of tweets added (tweets without any words are skipped)
+        '''
+        if ids is None:
+            ids = itertools.count(len(self.ids))
+        added = 0
+        for twtid, document in zip(ids, docs_list):
+            if twtid in self._positions:
+                raise InputError("Duplicate tweet id: {}".format(twtid))
+            signature = self.Signature(document)
+            if signature is None:
+                continue
+            position = len(self.ids)
+            if position == len(self._signatures):
+                self._signatures = np.concatenate(
+                    [self._signatures, np.empty_like(self._signatures)])
+            self._signatures[position] = signature
+            self.ids.append(twtid)
+            self._positions[twtid] = position
+            self._parent.append(position)
+            self._members[position] = [position]
+            for buckets, key in zip(self._buckets, self.__band_keys__(signature)):
+                # a bucket keeps one tweet of each group that fell into it
+                bucket = buckets.setdefault(key, [])
+                for other in bucket:
+                    if self.__find__(other) != self.__find__(position) and \
+                            self.__similarity__(signature,
+                                                self._signatures[other]) >= self.threshold:
+                        self.__union__(position, other)
+                root = self.__find__(position)
+                if all(self.__find__(other) != root for other in bucket):
+                    bucket.append(position)
+            added += 1
+        return added
+
+    def Query(self, document):
+        '''
+        Query - the added tweets a document is a near duplicate of
+
+        returns: list of (tweet id, estimated Jaccard), most similar first
+        '''
+        signature = self.Signature(document)
+        if signature is None:
+            return []
+        roots = set()
+        for buckets, key in zip(self._buckets, self.__band_keys__(signature)):
+            for other in buckets.get(key, ()):
+                roots.add(self.__find__(other))
+        # every tweet of the groups that share a band with the document
+        positions = np.array([position for root in roots
+                              for position in self._members[root]],
+                             dtype=np.int64)
+        if not len(positions):
+            return []
+        similarity = np.count_nonzero(
+            self._signatures[positions] == signature, axis=1) / self.num_perm
+        order = np.argsort(-similarity, kind='stable')
+        return [(self.ids[positions[i]], float(similarity[i]))
+                for i in order if similarity[i] >= self.threshold]
+
+    def Clusters(self, min_size=2):
+        '''
+        Clusters - list of the groups (lists of tweet ids) of near duplicates
+        with at least min_size tweets, largest first
+        '''
+        return sorted(([self.ids[position] for position in sorted(members)]
+                       for members in self._members.values()
+                       if len(members) >= min_size),
+                      key=len, reverse=True)
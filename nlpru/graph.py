@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.graph
+
+compact, array backed version of the conversation links (replies, quotes,
+retweets) for thread and cascade analytics on large corpora. Tweets are
+numbered 0..n-1 (graph.ids gives the tweet id of each number) and every query
+works on whole numpy arrays at once, without python loops over the tweets.
+"""
+from __future__ import print_function
+import numpy as np
+
+from nlpru.error import ConversationError
+
+# kinds of links, in the order of precedence used when a tweet has more than
+# one (a reply defines the thread before a quote, a quote before a retweet)
+link_kinds = ('reply', 'quote', 'retweet')
+
+
+class ConversationGraph:
+    '''
+    ConversationGraph - the reply/quote/retweet links of a corpus as numpy
+    arrays: for every kind of link an array of the parent of every tweet (-1
+    for none), and children in compressed sparse row (CSR) form
+
+    @parameters (same inputs as Conversations):
+        - retweet_list, reply_list, quote_list - lists of (tweet id, parent
+        tweet id); or, for large graphs, a pair of numpy arrays (tweet ids,
+        parent tweet ids) of integer ids
+        - ids - (optional) tweet ids to include even if they have no links
+
+    As in Conversations a tweet has at most one link of each kind, the last
+    one given is kept.
+    '''
+
+    def __init__(self, ids=None, **kwargs):
+        inputs = {'reply': kwargs.get('reply_list'),
+                  'quote': kwargs.get('quote_list'),
+                  'retweet': kwargs.get('retweet_list')}
+        try:
+            pairs = {kind: _as_arrays(links) for kind, links in inputs.items()
+                     if links is not None}
+            pairs = {kind: pair for kind, pair in pairs.items() if len(pair[0])}
+        except (TypeError, ValueError, IndexError) as e:
+            raise ConversationError(
+                "Improper input for ConversationGraph: " + str(e))
+        kinds = [kind for kind in link_kinds if kind in pairs]
+        columns = [column for kind in kinds for column in pairs[kind]]
+        if ids is not None:
+            columns.append(np.asarray(ids))
+        if columns:
+            # number the tweets, all the columns in one sort
+            self.ids, numbers = np.unique(np.concatenate(columns),
+                                          return_inverse=True)
+        else:
+            self.ids = np.array([], dtype=np.int64)
+        n = len(self.ids)
+        index_dtype = np.int32 if n < 2 ** 31 else np.int64
+        offsets = np.cumsum([0] + [len(column) for column in columns])
+        self._parents = {}
+        for kind in link_kinds:
+            parent = np.full(n, -1, dtype=index_dtype)
+            if kind in pairs:
+                i = 2 * kinds.index(kind)
+                child = numbers[offsets[i]:offsets[i + 1]]
+                parent_ids = numbers[offsets[i + 1]:offsets[i + 2]]
+                # keep the last link of every tweet
+                last = len(child) - 1 - np.unique(child[::-1],
+                                                  return_index=True)[1]
+                parent[child[last]] = parent_ids[last]
+            self._parents[kind] = parent
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ----------------------ids-----------------------------------------------------------
+    def Index(self, twtids):
+        '''
+        Index - numbers of the given tweet ids (an array, -1 for unknown ids)
+        '''
+        twtids = np.asarray(twtids)
+        if len(self.ids) == 0:
+            return np.full(twtids.shape, -1, dtype=np.int64)
+        index = np.searchsorted(self.ids, twtids)
+        index[index == len(self.ids)] = 0
+        return np.where(self.ids[index] == twtids, index, -1)
+
+    # ----------------------structure-----------------------------------------------------
+    def Parents(self, kinds=None):
+        '''
+        Parents - array of the parent number of every tweet (-1 for none)
+        following the given kinds of links (default all, a reply first, then a
+        quote, then a retweet)
+        '''
+        kinds = _kinds(kinds)
+        key = ('parents', kinds)
+        if key not in self._cache:
+            parent = self._parents[kinds[-1]].copy()
+            for kind in kinds[-2::-1]:
+                has = self._parents[kind] >= 0
+                parent[has] = self._parents[kind][has]
+            self._cache[key] = parent
+        return self._cache[key]
+
+    def Children(self, kinds=None):
+        '''
+        Children - (indptr, indices) CSR arrays of the children of every
+        tweet: the children of tweet i are indices[indptr[i]:indptr[i + 1]]
+        '''
+        kinds = _kinds(kinds)
+        key = ('children', kinds)
+        if key not in self._cache:
+            parent = self.Parents(kinds)
+            child = np.flatnonzero(parent >= 0)
+            order = np.argsort(parent[child], kind='stable')
+            indices = child[order].astype(parent.dtype)
+            counts = np.bincount(parent[child], minlength=len(self.ids))
+            indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self._cache[key] = (indptr, indices)
+        return self._cache[key]
+
+    def _roots_and_depths_(self, kinds):
+        '''
+        root and depth of every tweet by pointer jumping: every round each
+        tweet jumps to its pointer's pointer, so log2(depth) vectorised rounds
+        are enough. Tweets in (or below) a cycle of links get -1 for both
+        '''
+        key = ('roots', kinds)
+        if key not in self._cache:
+            parent = self.Parents(kinds)
+            n = len(parent)
+            has_parent = parent >= 0
+            pointer = np.where(has_parent, parent, np.arange(n, dtype=parent.dtype))
+            depth = has_parent.astype(np.int64)
+            for i in range(max(n, 1).bit_length() + 1):
+                next_pointer = pointer[pointer]
+                if np.array_equal(next_pointer, pointer):
+                    break
+                depth += depth[pointer]
+                pointer = next_pointer
+            in_cycle = parent[pointer] >= 0
+            pointer[in_cycle] = -1
+            depth[in_cycle] = -1
+            self._cache[key] = (pointer, depth)
+        return self._cache[key]
+
+    # ----------------------analytics-----------------------------------------------------
+    def Roots(self, kinds=None):
+        '''
+        Roots - array of the number of the first tweet of the conversation
+        of every tweet (itself if it has no parent)
+        '''
+        return self._roots_and_depths_(_kinds(kinds))[0]
+
+    def Depths(self, kinds=None):
+        '''
+        Depths - array of the number of links between every tweet and its root
+        '''
+        return self._roots_and_depths_(_kinds(kinds))[1]
+
+    def Cascade_sizes(self, kinds=None):
+        '''
+        Cascade_sizes - (roots, sizes) arrays: every root that has at least one
+        tweet below it and the number of tweets in its cascade (root included)
+        '''
+        roots = self.Roots(kinds)
+        counts = np.bincount(roots[roots >= 0], minlength=len(self.ids))
+        roots = np.flatnonzero(counts > 1)
+        return roots, counts[roots]
+
+    def Thread_sizes(self, kinds=('reply',)):
+        '''
+        Thread_sizes - array of the size of the conversation every tweet is
+        part of (by default reply threads; 1 for a tweet on its own, 0 for
+        tweets in a cycle of links)
+        '''
+        roots = self.Roots(kinds)
+        counts = np.bincount(roots[roots >= 0], minlength=len(self.ids))
+        return np.where(roots >= 0, counts[np.maximum(roots, 0)], 0)
+
+
+def _kinds(kinds):
+    '''
+    validated tuple of link kinds, in the order of precedence
+    '''
+    if kinds is None:
+        return link_kinds
+    if isinstance(kinds, str):
+        kinds = (kinds,)
+    unknown = set(kinds) - set(link_kinds)
+    if unknown or not kinds:
+        raise ConversationError("Unknown kind of link: {}".format(
+            ', '.join(sorted(map(str, unknown))) or 'none given'))
+    return tuple(kind for kind in link_kinds if kind in kinds)
+
+
+def _as_arrays(links):
+    '''
+    (tweet ids, parent ids) arrays from a list of pairs or a pair of arrays
+    '''
+    if isinstance(links, tuple) and len(links) == 2 and \
+            all(isinstance(column, np.ndarray) for column in links):
+        child, parent = links
+    else:
+        if isinstance(links, dict):
+            links = links.items()
+        links = list(links)
+        child = np.array([each[0] for each in links])
+        parent = np.array([each[1] for each in links])
+    if child.shape != parent.shape or child.ndim != 1:
+        raise ValueError("tweet and parent ids do not match up")
+    return child, parent
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.hashing
+
+out of core tf-idf for corpora too large for Get_similarity/SimilarityIndex:
+n-grams are hashed into a fixed number of features (no vocabulary is kept),
+documents are read from an iterator a batch at a time, the document
+frequencies are added up batch by batch and the term counts of every batch
+are written to disk as a chunk. The idf weights are applied when the chunks
+are read back, so documents can keep being added and memory use depends on
+the batch size and the number of features only.
+"""
+from __future__ import print_function
+import io
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from nlpru.error import InputError
+from nlpru.parallel import Chunked
+from nlpru.semantics import Semantics, _keep_top_k, Pairwise_similarity
+
+
+class HashedCorpus:
+    '''
+    HashedCorpus - a directory of hashed term count chunks, with the document
+    frequencies needed for tf-idf
+
+        corpus = HashedCorpus('tweets_tfidf', clean='All')
+        corpus.Add(tweet_text_generator, batch_size=10000)
+        corpus.Query(["какое расследование"], top_k=5)
+
+    @parameters:
+        - path - directory of the corpus, opened if it already exists (its
+        saved options are then used)
+        - n_features - number of hashed features
+        - clean, tokenizer, use_normal_form, clean_documents, stop_words,
+        use_ngrams - as in Semantics.Get_similarity
+    '''
+
+    def __init__(self,
+                 path,
+                 n_features=2 ** 20,
+                 clean=None,
+                 tokenizer=None,
+                 use_normal_form=False,
+                 clean_documents=True,
+                 stop_words=None,
+                 use_ngrams=True):
+        self.path = path
+        meta_path = os.path.join(path, 'corpus.json')
+        if os.path.exists(meta_path):
+            with io.open(meta_path, encoding='utf-8') as f:
+                self._meta = json.load(f)
+            self._df = np.load(os.path.join(path, 'df.npy'))
+        else:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._meta = {'options': {'n_features': n_features,
+                                      'clean': clean,
+                                      'use_normal_form': use_normal_form,
+                                      'clean_documents': clean_documents,
+                                      'stop_words': (sorted(stop_words)
+                                                     if stop_words is not None
+                                                     else None),
+                                      'use_ngrams': use_ngrams},
+                          'documents': 0,
+                          'chunks': []}
+            self._df = np.zeros(n_features, dtype=np.int64)
+        self.options = self._meta['options']
+        self._semantics = Semantics(clean=self.options['clean'],
+                                    tokenizer=tokenizer)
+        self._hasher = None
+
+    def __len__(self):
+        return self._meta['documents']
+
+    def __counts__(self, docs_list):
+        '''
+        hashed n-gram counts of (cleaned/lemmatized) documents
+        '''
+        if self._hasher is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._hasher = HashingVectorizer(
+                n_features=self.options['n_features'],
+                stop_words=self.options['stop_words'],
+                ngram_range=((2, 3) if self.options['use_ngrams'] == True
+                             else (1, 1)),
+                alternate_sign=False,
+                norm=None)
+        docs_list = self._semantics.__prepare_docs__(
+            docs_list,
+            self.options['clean_documents'],
+            self.options['use_normal_form'])
+        return self._hasher.transform(docs_list).tocsr()
+
+    def Add(self, docs, batch_size=10000):
+        '''
+        Add - read documents from any iterable a batch at a time, write their
+        counts as a chunk and update the document frequencies
+
+        returns: number of documents added
+        '''
+        added = 0
+        for batch in Chunked(docs, batch_size):
+            counts = self.__counts__(batch)
+            self._df += np.bincount(counts.indices,
+                                    minlength=len(self._df)).astype(np.int64)
+            name = 'chunk_{:06d}.npz'.format(len(self._meta['chunks']))
+            sparse.save_npz(os.path.join(self.path, name), counts)
+            self._meta['chunks'].append({'file': name,
+                                         'offset': self._meta['documents'],
+                                         'documents': counts.shape[0]})
+            self._meta['documents'] += counts.shape[0]
+            self.__save_meta__()
+            added += counts.shape[0]
+        return added
+
+    def __save_meta__(self):
+        # written after every chunk, so a corpus stays usable if a long run
+        # stops half way
+        np.save(os.path.join(self.path, 'df.npy'), self._df)
+        meta_path = os.path.join(self.path, 'corpus.json')
+        with io.open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def Idf(self):
+        '''
+        Idf - current (smoothed, as in sklearn) idf weight of every feature
+        '''
+        n = self._meta['documents']
+        return np.log((1.0 + n) / (1.0 + self._df)) + 1.0
+
+    def __tfidf__(self, counts, idf):
+        from sklearn.preprocessing import normalize
+        return normalize(counts @ sparse.diags(idf), copy=False)
+
+    def Transform(self, docs_list):
+        '''
+        Transform - L2 normalized tf-idf matrix of documents, with the idf of
+        the corpus
+        '''
+        return self.__tfidf__(self.__counts__(docs_list), self.Idf())
+
+    def Chunks(self):
+        '''
+        Chunks - generator of (index of the first document, tf-idf matrix) of
+        every chunk, read from disk one at a time
+        '''
+        idf = self.Idf()
+        for chunk in self._meta['chunks']:
+            counts = sparse.load_npz(os.path.join(self.path, chunk['file']))
+            yield chunk['offset'], self.__tfidf__(counts, idf)
+
+    def Query(self, docs_list, top_k=10, threshold=None, block_size=1000):
+        '''
+        Query - the documents of the corpus most similar to each document,
+        going through the chunks one at a time
+
+        returns: list (one per document) of lists of (document index,
+        similarity), most similar first
+        '''
+        if top_k is None and threshold is None:
+            raise InputError("Give top_k and/or threshold")
+        query = self.Transform(docs_list)
+        found = []
+        for offset, matrix in self.Chunks():
+            similarity = Pairwise_similarity(query, other=matrix, top_k=top_k,
+                                             threshold=threshold,
+                                             block_size=block_size).tocoo()
+            found.append((similarity.row, similarity.col + offset,
+                          similarity.data))
+        results = [[] for i in range(query.shape[0])]
+        if not found:
+            return results
+        rows, cols, data = (np.concatenate(column) for column in zip(*found))
+        if top_k is not None:
+            rows, cols, data = _keep_top_k(rows, cols, data, top_k)
+        else:
+            order = np.lexsort((cols, -data, rows))
+            rows, cols, data = rows[order], cols[order], data[order]
+        for row, col, value in zip(rows, cols, data):
+            results[row].append((int(col), float(value)))
+        return results
@@ -4,18 +4,134 @@ nlpru.models
 
 contains all cleaners, and misc functions required by other functions within the library
 """
+import sys
+from array import array
+
 from nlpru.error import InputError
+from nlpru.parallel import Chunked
+
+# ways of passing tweets in batches, with the parameters each one needs
+_batch_inputs = {
+    'tweet_cursor': ['tweet_text_index', 'tweet_id_index'],
+    'tweet_iter': ['tweet_text_index', 'tweet_id_index'],
+    'tweet_dataframe': ['tweet_text_column', 'tweet_id_column'],
+}
+
+
+def Tweet_batches(batch_size=1000, **kwargs):
+    '''
+    Tweet_batches - generator of lists of (twtid, text, other) read a batch at
+    a time, so that the whole raw result set is never held in memory
+
+    @parameters (one of):
+        - tweet_cursor - an executed DB-API cursor (i.e. sqlite3), read with
+        fetchmany(batch_size)
+        - tweet_iter - any iterable/generator of rows (tuples)
+            for both, tweet_text_index and tweet_id_index give the position of
+            the text and of the id in a row, the other fields go to 'other' -
+            except the first field, which is never put in 'other' (as for a
+            tweet_list, so the same rows give the same tweets either way)
+        - tweet_dataframe - a pandas DataFrame, with tweet_text_column and
+        tweet_id_column naming the columns; the other columns go to 'other'.
+        Columns are converted a batch at a time, not row by row
+    '''
+    if batch_size < 1:
+        raise InputError("batch_size must be a positive integer")
+    if 'tweet_dataframe' in kwargs:
+        batches = _dataframe_batches(kwargs['tweet_dataframe'],
+                                     kwargs['tweet_text_column'],
+                                     kwargs['tweet_id_column'],
+                                     batch_size)
+    else:
+        if 'tweet_cursor' in kwargs:
+            rows = _cursor_batches(kwargs['tweet_cursor'], batch_size)
+        else:
+            rows = Chunked(kwargs['tweet_iter'], batch_size)
+        batches = _row_batches(rows,
+                               kwargs['tweet_text_index'],
+                               kwargs['tweet_id_index'])
+    for batch in batches:
+        yield batch
+
+
+def _cursor_batches(cursor, batch_size):
+    if not hasattr(cursor, 'fetchmany'):
+        raise InputError("Improper tweet_cursor, a DB-API cursor is expected")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _row_batches(batches, tweet_text_index, tweet_id_index):
+    vars_to_get = None
+    for rows in batches:
+        try:
+            if vars_to_get is None:
+                # from 1, like for a tweet_list
+                vars_to_get = [i for i in range(1, len(rows[0]))
+                               if i not in [tweet_text_index, tweet_id_index]]
+            yield [(row[tweet_id_index], row[tweet_text_index],
+                    [row[i] for i in vars_to_get]) for row in rows]
+        except (IndexError, KeyError, TypeError) as e:
+            raise InputError("Improper tweet rows inputted: {}".format(e))
+
+
+def _dataframe_batches(dataframe, tweet_text_column, tweet_id_column,
+                       batch_size):
+    try:
+        other_columns = [column for column in dataframe.columns
+                         if column not in [tweet_text_column, tweet_id_column]]
+        for start in range(0, len(dataframe), batch_size):
+            batch = dataframe.iloc[start:start + batch_size]
+            ids = batch[tweet_id_column].tolist()
+            texts = batch[tweet_text_column].tolist()
+            if other_columns:
+                other = batch[other_columns].values.tolist()
+            else:
+                other = [[] for i in range(len(ids))]
+            yield list(zip(ids, texts, other))
+    except (AttributeError, KeyError) as e:
+        raise InputError("Improper tweet_dataframe inputted: {}".format(e))
+
+
+def _batch_input(kwargs):
+    '''
+    name of the batched input given in kwargs (None if there is none),
+    checking that its parameters are there too
+    '''
+    for name, reqs in _batch_inputs.items():
+        if name in kwargs:
+            if not all(inp in kwargs for inp in reqs):
+                raise InputError("{} also needs {}".format(name,
+                                                           ' and '.join(reqs)))
+            return name
+    return None
 
 
 def Convert_to_tweet_dictionary(**kwargs):
     '''
     Validate the input used in the initiation of the object
+
+    A TweetStore can be passed as tweet_dict (or tweet_store), it is returned
+    as is. Tweets can also come from a database cursor, an iterator or a
+    pandas DataFrame, see Tweet_batches()
+
+    For rows (a tweet_list, cursor or iterator) 'other' is the list of the
+    fields other than the text and the id, leaving out the first field
     '''
     tweet_list_reqs = ['tweet_list', 'tweet_text_index', 'tweet_id_index']
 
-    if 'tweet_dict' in kwargs:
+    if 'tweet_store' in kwargs:
+        if not isinstance(kwargs['tweet_store'], TweetStore):
+            raise InputError("Improper tweet_store, a TweetStore is expected")
+        return kwargs['tweet_store']
+    elif 'tweet_dict' in kwargs:
         # validate that the dict is constructed correctly
         tweet_dict = kwargs['tweet_dict']
+        if isinstance(tweet_dict, TweetStore):
+            return tweet_dict
         if type(tweet_dict) is not dict:
             raise InputError("Imporperly constructed tweet_dict used")
         elif all('text' in tweet_dict[key].keys() for key in tweet_dict) == False:
@@ -23,6 +139,12 @@ def Convert_to_tweet_dictionary(**kwargs):
                 "Improperly constructed tweet_dict, no tweet text found")
         else:
             return tweet_dict
+    elif _batch_input(kwargs) is not None:
+        d = {}
+        for batch in Tweet_batches(**kwargs):
+            for twtid, text, other in batch:
+                d[twtid] = {'text': text, 'other': other}
+        return d
     elif all(inp in kwargs for inp in tweet_list_reqs):
         # validate that the list errors are correct and if so, construct the dict
         tweet_list = kwargs['tweet_list']
@@ -50,6 +172,360 @@ def Convert_to_tweet_dictionary(**kwargs):
             "Improper tweet input, please either input tweet list or tweet dictionary")
 
 
+def Convert_to_tweet_store(**kwargs):
+    '''
+    Convert_to_tweet_store - same inputs as Convert_to_tweet_dictionary
+    (tweet_dict, or tweet_list with tweet_text_index and tweet_id_index), but
+    builds a compact TweetStore. A tweet list, cursor, iterator or DataFrame
+    (see Tweet_batches) is added to the store directly, without building the
+    dictionary first.
+    '''
+    if 'tweet_store' in kwargs or 'tweet_dict' in kwargs:
+        tweets = Convert_to_tweet_dictionary(**kwargs)
+        if isinstance(tweets, TweetStore):
+            return tweets
+        store = TweetStore()
+        for twtid, tweet in tweets.items():
+            store.Add(twtid, tweet['text'], tweet.get('other'))
+            for key, value in tweet.items():
+                if key not in ('text', 'other'):
+                    store[twtid][key] = value
+        return store
+    if _batch_input(kwargs) is not None:
+        store = TweetStore()
+        for batch in Tweet_batches(**kwargs):
+            for twtid, text, other in batch:
+                store.Add(twtid, text, other)
+        return store
+    tweet_list_reqs = ['tweet_list', 'tweet_text_index', 'tweet_id_index']
+    if not all(inp in kwargs for inp in tweet_list_reqs):
+        raise InputError(
+            "Improper tweet input, please either input tweet list or tweet dictionary")
+    tweet_list = kwargs['tweet_list']
+    if type(tweet_list) != list and type(tweet_list) != tuple:
+        raise InputError("Improper tweet_list inputted")
+    try:
+        tweet_text_index = kwargs['tweet_text_index']
+        tweet_id_index = kwargs['tweet_id_index']
+        vars_to_get = [i for i in range(1, len(tweet_list[0]))
+                       if i not in [tweet_text_index, tweet_id_index]]
+        store = TweetStore()
+        for tweet in tweet_list:
+            store.Add(tweet[tweet_id_index], tweet[tweet_text_index],
+                      [tweet[i] for i in vars_to_get])
+        return store
+    except Exception as e:
+        raise InputError("Improper tweet_list inputted")
+
+
+class TweetStore:
+    '''
+    TweetStore - compact, columnar container of tweets, an alternative to the
+    dictionary of dictionaries built by Convert_to_tweet_dictionary that uses
+    far less memory per tweet:
+        - tweet ids are interned and mapped to integer rows
+        - the text of all tweets is one utf-8 buffer with offsets
+        - clean words are lemma ids in one flat array, with a span per row
+        - topics are small integer codes into a table of labels
+        - 'other' is not columnar: it is kept as given, one Python object
+        (i.e. the list of the other fields) per tweet
+
+    FindTopics and Conversations work on it natively (pass it as tweet_dict
+    or tweet_store). For backwards compatibility it can also be used like the
+    tweet dictionary: store[twtid]['text'], store[twtid]['topic'] = ..., etc.
+    '''
+
+    def __init__(self):
+        self._ids = []
+        self._rows = {}
+        self._text = bytearray()
+        self._text_offsets = array('q', [0])
+        self._other = []
+        # clean words - lemma ids, and where each row's span starts (-1 not
+        # set) and how long it is
+        self._vocabulary = []
+        self._lemma_ids = {}
+        self._lemmas = array('i')
+        self._lemma_start = array('q')
+        self._lemma_length = array('i')
+        # topics - code per row (-1 not set) into the table of labels
+        self._labels = []
+        self._label_codes = {}
+        self._topics = array('h')
+        # any other per tweet values set through the dictionary view
+        self._extra = {}
+
+    # ----------------------building---------------------------------------------------
+    def Add(self, twtid, text, other=None):
+        '''
+        Add - add a tweet and return its row number
+        '''
+        if type(twtid) is str:
+            twtid = sys.intern(twtid)
+        if twtid in self._rows:
+            raise InputError("Duplicate tweet id: {}".format(twtid))
+        row = len(self._ids)
+        self._ids.append(twtid)
+        self._rows[twtid] = row
+        self._text.extend(text.encode('utf-8'))
+        self._text_offsets.append(len(self._text))
+        self._other.append(other)
+        self._lemma_start.append(-1)
+        self._lemma_length.append(0)
+        self._topics.append(-1)
+        return row
+
+    # ----------------------column access (by tweet id)---------------------------------
+    def Row(self, twtid):
+        return self._rows[twtid]
+
+    def Ids(self):
+        return iter(self._ids)
+
+    def Text(self, twtid):
+        row = self._rows[twtid]
+        return self._text[self._text_offsets[row]:
+                          self._text_offsets[row + 1]].decode('utf-8')
+
+    def Other(self, twtid):
+        return self._other[self._rows[twtid]]
+
+    def Clean_words(self, twtid):
+        '''
+        list of the clean words of a tweet, None if they were not set
+        '''
+        row = self._rows[twtid]
+        start = self._lemma_start[row]
+        if start < 0:
+            return None
+        return [self._vocabulary[lemma_id] for lemma_id in
+                self._lemmas[start:start + self._lemma_length[row]]]
+
+    def Set_clean_words(self, twtid, clean_words):
+        row = self._rows[twtid]
+        if clean_words is None:
+            self._lemma_start[row] = -1
+            self._lemma_length[row] = 0
+            return
+        # a replaced span is left behind in the flat array, see Compact()
+        self._lemma_start[row] = len(self._lemmas)
+        self._lemma_length[row] = len(clean_words)
+        for word in clean_words:
+            lemma_id = self._lemma_ids.get(word)
+            if lemma_id is None:
+                lemma_id = len(self._vocabulary)
+                self._vocabulary.append(word)
+                self._lemma_ids[word] = lemma_id
+            self._lemmas.append(lemma_id)
+
+    def Topic(self, twtid):
+        '''
+        topic label of a tweet, None if not set
+        '''
+        code = self._topics[self._rows[twtid]]
+        return None if code < 0 else self._labels[code]
+
+    def Set_topic(self, twtid, topic):
+        if topic is None:
+            self._topics[self._rows[twtid]] = -1
+        else:
+            self._topics[self._rows[twtid]] = self.Topic_code(topic)
+
+    def Topic_code(self, topic):
+        '''
+        small integer code of a topic label (added to the table if new)
+        '''
+        code = self._label_codes.get(topic)
+        if code is None:
+            if len(self._labels) >= 32767:
+                raise InputError("Too many distinct topic labels")
+            code = len(self._labels)
+            self._labels.append(topic)
+            self._label_codes[topic] = code
+        return code
+
+    def Compact(self):
+        '''
+        Compact - rebuild the flat lemma array without the spans left behind
+        when clean words were replaced
+        '''
+        lemmas = array('i')
+        for row in range(len(self._ids)):
+            start = self._lemma_start[row]
+            if start >= 0:
+                self._lemma_start[row] = len(lemmas)
+                lemmas.extend(
+                    self._lemmas[start:start + self._lemma_length[row]])
+        self._lemmas = lemmas
+
+    def Memory_usage(self):
+        '''
+        Memory_usage - approximate number of bytes used by the store
+        '''
+        size = sum(sys.getsizeof(column) for column in [
+            self._ids, self._rows, self._text, self._text_offsets,
+            self._other, self._vocabulary, self._lemma_ids, self._lemmas,
+            self._lemma_start, self._lemma_length, self._labels,
+            self._label_codes, self._topics, self._extra])
+        size += sum(sys.getsizeof(twtid) for twtid in self._ids)
+        size += sum(sys.getsizeof(word) for word in self._vocabulary)
+        size += sum(sys.getsizeof(other) for other in self._other
+                    if other is not None)
+        return size
+
+    def To_tweet_dictionary(self):
+        '''
+        To_tweet_dictionary - the equivalent dictionary of dictionaries
+        '''
+        return {twtid: dict(self[twtid]) for twtid in self._ids}
+
+    # ----------------------dictionary view----------------------------------------------
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, twtid):
+        return twtid in self._rows
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, twtid):
+        if twtid not in self._rows:
+            raise KeyError(twtid)
+        return _TweetView(self, twtid)
+
+    def keys(self):
+        return list(self._ids)
+
+    def values(self):
+        return [self[twtid] for twtid in self._ids]
+
+    def items(self):
+        return [(twtid, self[twtid]) for twtid in self._ids]
+
+    def get(self, twtid, default=None):
+        return self[twtid] if twtid in self._rows else default
+
+
+class _TweetView:
+    '''
+    dictionary like view of one tweet of a TweetStore, reads and writes go to
+    the store's columns. It compares equal to the dictionary of the tweet
+    and, like a dictionary, cannot be hashed
+    '''
+    _columns = ('text', 'other', 'clean_words', 'topic')
+
+    def __init__(self, store, twtid):
+        self._store = store
+        self._twtid = twtid
+
+    def _get_(self, key):
+        store, twtid = self._store, self._twtid
+        if key == 'text':
+            return store.Text(twtid)
+        if key == 'other':
+            return store.Other(twtid)
+        if key == 'clean_words':
+            return store.Clean_words(twtid)
+        if key == 'topic':
+            return store.Topic(twtid)
+        return store._extra.get(twtid, {}).get(key)
+
+    def keys(self):
+        keys = [key for key in self._columns if self._get_(key) is not None]
+        keys.extend(self._store._extra.get(self._twtid, {}))
+        return keys
+
+    def __getitem__(self, key):
+        value = self._get_(key)
+        if value is None and key not in self.keys():
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        store, twtid = self._store, self._twtid
+        if key == 'clean_words':
+            store.Set_clean_words(twtid, value)
+        elif key == 'topic':
+            store.Set_topic(twtid, value)
+        elif key == 'other':
+            store._other[store.Row(twtid)] = value
+        elif key == 'text':
+            raise InputError("The text of a TweetStore tweet cannot be changed")
+        else:
+            store._extra.setdefault(twtid, {})[key] = value
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        value = self._get_(key)
+        return default if value is None else value
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class _TweetDictAdapter:
+    '''
+    gives a plain tweet dictionary the same by-tweet-id access methods as a
+    TweetStore, so that FindTopics and Conversations handle both the same way
+    '''
+
+    def __init__(self, tweet_dict):
+        self._tweet_dict = tweet_dict
+
+    def __contains__(self, twtid):
+        return twtid in self._tweet_dict
+
+    def __len__(self):
+        return len(self._tweet_dict)
+
+    def Ids(self):
+        return iter(self._tweet_dict)
+
+    def Text(self, twtid):
+        return self._tweet_dict[twtid]['text']
+
+    def Clean_words(self, twtid):
+        return self._tweet_dict[twtid].get('clean_words')
+
+    def Set_clean_words(self, twtid, clean_words):
+        self._tweet_dict[twtid]['clean_words'] = clean_words
+
+    def Topic(self, twtid):
+        return self._tweet_dict[twtid].get('topic')
+
+    def Set_topic(self, twtid, topic):
+        self._tweet_dict[twtid]['topic'] = topic
+
+
+def _tweet_access(tweets):
+    '''
+    by-tweet-id access to a tweet dictionary or a TweetStore
+    '''
+    if isinstance(tweets, TweetStore):
+        return tweets
+    return _TweetDictAdapter(tweets)
+
+
 if __name__ == '__main__':
     from pysqlc import DB
     db = DB('kremlin_tweets_db')
@@ -66,6 +542,6 @@ if __name__ == '__main__':
     AND tmast.twt_createdat >= '{start}'
     AND tmast.twt_createdat < '{end}'
     """.format(start='2017-03-26', end='2017-03-27')
-    data = list(db.query(q))
-    d = Convert_to_tweet_dictionary(
-        tweet_list=data, tweet_text_index=1, tweet_id_index=0)
+    # rows are converted as they come, the raw result set is never kept
+    d = Convert_to_tweet_store(
+        tweet_iter=db.query(q), tweet_text_index=1, tweet_id_index=0)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.parallel
+
+helpers to spread corpus level work over a pool of processes. Work is sent
+to the pool in chunks, with only a bounded number of chunks in flight at any
+time, and results come back in the order of the input.
+"""
+from __future__ import print_function
+import collections
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from nlpru import resources
+from nlpru.error import InputError
+
+
+def Chunked(iterable, chunksize):
+    '''
+    Chunked - generator of lists of (at most) chunksize items of an iterable
+    '''
+    if chunksize < 1:
+        raise InputError("chunksize must be a positive integer")
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _init_worker_(resource_names, initializer, initargs):
+    '''
+    run once in every worker process: load the shared resources (i.e. the
+    pymorphy2 analyzer) so that they are not loaded again for every chunk
+    '''
+    resources.Warmup(resource_names)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def Map_chunks(function,
+               chunks,
+               processes,
+               resource_names=('morph', 'stopwords'),
+               initializer=None,
+               initargs=(),
+               max_pending=None):
+    '''
+    Map_chunks - apply function to every chunk in a pool of processes and
+    yield the results in the order of the chunks
+
+    @parameters:
+        - function - picklable (module level) function taking one chunk
+        - chunks - iterable of chunks, consumed lazily
+        - processes - number of worker processes
+        - resource_names - nlpru.resources loaded once by every worker
+        - initializer, initargs - optional extra set up run by every worker
+        - max_pending - maximum number of chunks sent to the pool and not yet
+        yielded (default 2 per process), this bounds the memory used
+    '''
+    if max_pending is None:
+        max_pending = 2 * processes
+    pending = collections.deque()
+    chunks = iter(chunks)
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker_,
+                             initargs=(list(resource_names),
+                                       initializer, initargs)) as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(function, chunk))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
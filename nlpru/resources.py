@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.resources
+
+registry of the heavy resources used by the library (the pymorphy2
+analyzer, the nltk stopwords, the emoji table). Nothing is loaded on import:
+each resource is loaded once per process the first time it is asked for,
+and then shared by Cleaner, Semantics, FindTopics, etc.
+"""
+import threading
+import time
+
+_loaders = {}
+_loaded = {}
+_load_times = {}
+_lock = threading.Lock()
+
+
+def _resource(name):
+    '''
+    register the decorated function as the loader of a resource
+    '''
+    def register(loader):
+        _loaders[name] = loader
+        return loader
+    return register
+
+
+@_resource('morph')
+def _load_morph():
+    import pymorphy2
+    return pymorphy2.MorphAnalyzer()
+
+
+@_resource('stopwords')
+def _load_stopwords():
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('russian'))
+
+
+@_resource('emoji_chars')
+def _load_emoji_chars():
+    import emoji
+    # emoji>=2.0 has EMOJI_DATA, older versions UNICODE_EMOJI (which 1.x
+    # nests by language)
+    table = getattr(emoji, 'EMOJI_DATA', None)
+    if table is None:
+        table = emoji.UNICODE_EMOJI
+        if 'en' in table and type(table['en']) is dict:
+            table = table['en']
+    # keep ascii out so keycap emoji do not take digits, '#' or '*' with them
+    return frozenset(char for each in table for char in each
+                     if ord(char) > 127)
+
+
+def Get(name):
+    '''
+    Get - return the named resource, loading it if this is the first use
+
+    Available resources:
+     - 'morph' - the pymorphy2.MorphAnalyzer
+     - 'stopwords' - frozenset of the nltk russian stopwords
+     - 'emoji_chars' - frozenset of the (non ascii) emoji characters
+    '''
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    if name not in _loaders:
+        raise KeyError("Unknown nlpru resource: {}".format(name))
+    with _lock:
+        # another thread may have loaded it while we waited for the lock
+        if name not in _loaded:
+            start = time.perf_counter()
+            _loaded[name] = _loaders[name]()
+            _load_times[name] = time.perf_counter() - start
+    return _loaded[name]
+
+
+def Warmup(names=None):
+    '''
+    Warmup - load resources up front, so that long running services do not
+    pay for it on the first document. Loads every resource unless a list of
+    names is given.
+
+    returns: dictionary of load time (seconds) by resource name
+    '''
+    if names is None:
+        names = sorted(_loaders)
+    for name in names:
+        Get(name)
+    return Loaded_resources()
+
+
+def Loaded_resources():
+    '''
+    Loaded_resources - dictionary of the resources loaded so far in this
+    process and how long each took to load (seconds)
+    '''
+    return dict(_load_times)
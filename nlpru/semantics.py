@@ -3,13 +3,15 @@
 nlpru.semantics
 """
 from __future__ import print_function
-import pymorphy2
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.tokenize import word_tokenize
-from nlpru import Cleaner
+import io
+import json
+import os
 
-morph = pymorphy2.MorphAnalyzer()
+from nlpru import Cleaner
+from nlpru import stats as _stats
+from nlpru.cache import lemma_cache
+from nlpru.error import InputError
+from nlpru.tokenizer import nltk_word_tokenize
 
 
 class Semantics:
@@ -34,10 +36,16 @@ class Semantics:
                        'special_chars'] - if you want to remove specific things, 
                     specify any from the above as strings in a list, such as 
                     ['RT','mentions'] and only the specified ones will be cleaned
+        - tokenizer: function used to split documents into words for
+            lemmatization, by default nltk.word_tokenize (any function
+            returning a list of tokens, i.e. nlpru.tokenizer.word_tokenizer)
     '''
 
-    def __init__(self, clean=None):
+    def __init__(self, clean=None, tokenizer=None):
         self.C = Cleaner()
+        if tokenizer is None:
+            tokenizer = nltk_word_tokenize
+        self._tokenize = tokenizer
         if clean == None:
             self.clean = None
         elif clean == 'All':
@@ -57,8 +65,8 @@ class Semantics:
         convert every word in a document into normal form
         """
         clean_document = ""
-        for word in word_tokenize(input_document):
-            w = morph.normal_forms(word)[0]
+        for word in self._tokenize(input_document):
+            w = lemma_cache.Lemma(word)
             clean_document += w + " "
         return clean_document
 
@@ -123,13 +131,48 @@ class Semantics:
 #            print("~~~~~~~~~~~~~cleaned:~~~~~~~~~~~~~\n{}".format(cln))
         return cleaned_docs
 
+    def __prepare_docs__(self, docs_list, clean_documents, use_normal_form):
+        """
+        clean and/or lemmatize documents before they are vectorized
+        """
+        if clean_documents == True:
+            docs_list = self.__clean_docs__(docs_list)
+        if use_normal_form == True:
+            docs_list = self.__normalize_docs__(docs_list)
+        return docs_list
+
+    def __tfidf_matrix__(self,
+                         docs_list,
+                         use_normal_form,
+                         clean_documents,
+                         stop_words,
+                         use_ngrams):
+        """
+        clean/lemmatize the documents as asked and return the tf-idf matrix
+        (rows are L2 normalized, so dot products are cosine similarities)
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        docs_list = self.__prepare_docs__(docs_list,
+                                          clean_documents,
+                                          use_normal_form)
+        if use_ngrams == True:
+            tfidf_vectorizer = TfidfVectorizer(
+                stop_words=stop_words, ngram_range=(2, 3))
+        else:
+            tfidf_vectorizer = TfidfVectorizer(stop_words=stop_words)
+        return tfidf_vectorizer.fit_transform(docs_list)
+
     def Get_similarity(self,
                        docs_list,
                        use_normal_form=False,
                        clean_documents=True,
                        stop_words=None,
                        similarity_to='first',
-                       use_ngrams=True):
+                       use_ngrams=True,
+                       top_k=None,
+                       threshold=None,
+                       block_size=1000,
+                       output='sparse'):
         """
         Get cosine similarity of documents. Uses sklearn's library and the 
         tf-idf approach (TfidfVectorizer()) to calculate result
@@ -137,26 +180,351 @@ class Semantics:
         (unique) params:
             - stop_words: list (or set) of stop words to use
             - similarity_to: 'first' or 'all' expected
+            for similarity_to='all' (see Pairwise_similarity):
+            - top_k: keep only the top_k most similar other documents of each
+                document
+            - threshold: keep only the pairs at least this similar
+            - block_size: number of rows compared at a time, the memory used
+                grows with block_size * number of documents, not with the
+                square of the number of documents
+            - output: 'sparse' (scipy sparse matrix) or 'edges' (list of
+                (document index, other document index, similarity))
 
         returns: 
             depending on 'similarity_to' param, either similarity row 
             vector of the first document to all others docs is returned, or
-            (if 'All' is specified) matrix of of all docs against all others
+            (if 'all' is specified) sparse matrix of all docs against all
+            others - or the top_k/threshold pairs of it
         """
-        if clean_documents == True:
-            docs_list = self.__clean_docs__(docs_list)
-        if use_normal_form == True:
-            docs_list = self.__normalize_docs__(docs_list)
-        if use_ngrams == True:
-            tfidf_vectorizer = TfidfVectorizer(
-                stop_words=stop_words, ngram_range=(2, 3))
-        else:
-            tfidf_vectorizer = TfidfVectorizer(stop_words=stop_words)
-        tfidf_matrix = tfidf_vectorizer.fit_transform(docs_list)
+        with _stats.Timer('get_similarity.tfidf'):
+            tfidf_matrix = self.__tfidf_matrix__(docs_list,
+                                                 use_normal_form,
+                                                 clean_documents,
+                                                 stop_words,
+                                                 use_ngrams)
+        if similarity_to == 'all':
+            with _stats.Timer('get_similarity.similarity'):
+                similarity = Pairwise_similarity(tfidf_matrix,
+                                                 top_k=top_k,
+                                                 threshold=threshold,
+                                                 block_size=block_size)
+            if output == 'edges':
+                return Similarity_edges(similarity)
+            return similarity
+        from sklearn.metrics.pairwise import cosine_similarity
         cosine_similarity_matrix = cosine_similarity(
             tfidf_matrix[0:1], tfidf_matrix)
         return cosine_similarity_matrix
 
+    def Find_stories(self,
+                     docs_list,
+                     threshold=0.5,
+                     method='components',
+                     ids=None,
+                     conversations=None,
+                     top_k=None,
+                     use_normal_form=False,
+                     clean_documents=True,
+                     stop_words=None,
+                     use_ngrams=True,
+                     block_size=1000):
+        """
+        Find_stories - group documents (tweets) into stories: tweets at least
+        threshold similar (tf-idf cosine, as in Get_similarity) are linked,
+        block_size rows at a time, and the stories are found from these links
+        (see nlpru.stories.Story_labels)
+
+        (unique) params:
+            - threshold: similarity from which two tweets are linked
+            - method: 'components' (linked directly or through other tweets)
+                or 'leader' (each tweet joins the most similar earlier story
+                leader, stories do not chain)
+            - ids: tweet ids of the documents, needed to use conversations
+            - conversations: (optional) Conversations object whose replies,
+                quotes and retweets (between the given tweets) are merged
+                into one story
+            - top_k: (optional) only link each tweet to its top_k most similar
+
+        returns: dictionary of story number by tweet id (list of story numbers
+            in the order of the documents if no ids are given)
+        """
+        from nlpru.stories import Story_labels
+        tfidf_matrix = self.__tfidf_matrix__(docs_list,
+                                             use_normal_form,
+                                             clean_documents,
+                                             stop_words,
+                                             use_ngrams)
+        similarity = Pairwise_similarity(tfidf_matrix,
+                                         top_k=top_k,
+                                         threshold=threshold,
+                                         block_size=block_size)
+        links = None
+        if conversations is not None:
+            if ids is None:
+                raise InputError("ids are needed to use conversations")
+            position = {twtid: i for i, twtid in enumerate(ids)}
+            pairs = [(position[twtid], position[parent])
+                     for twtid, parent, kind in conversations.Links()
+                     if twtid in position and parent in position]
+            links = ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+        labels = Story_labels(similarity, method=method, links=links)
+        if ids is None:
+            return labels.tolist()
+        return {twtid: int(label) for twtid, label in zip(ids, labels)}
+
+
+class SimilarityIndex:
+    """
+    SimilarityIndex - tf-idf index of a reference corpus, fitted once, to find
+    the documents most similar to new ones without cleaning, lemmatizing and
+    fitting the whole corpus again for every query
+
+        index = SimilarityIndex(clean='All').Fit(corpus)
+        index.Query(["какое расследование"], top_k=5)
+        index.Save('corpus_index')
+        index = SimilarityIndex.Load('corpus_index')
+
+    @parameters: same options as Semantics/Get_similarity - clean, tokenizer,
+    use_normal_form, clean_documents, stop_words, use_ngrams. The tokenizer is
+    not saved, pass it again to Load if it was not the default one.
+    """
+
+    def __init__(self,
+                 clean=None,
+                 tokenizer=None,
+                 use_normal_form=False,
+                 clean_documents=True,
+                 stop_words=None,
+                 use_ngrams=True):
+        self._semantics = Semantics(clean=clean, tokenizer=tokenizer)
+        self.options = {'clean': clean,
+                        'use_normal_form': use_normal_form,
+                        'clean_documents': clean_documents,
+                        'stop_words': (sorted(stop_words)
+                                       if stop_words is not None else None),
+                        'use_ngrams': use_ngrams}
+        self._vectorizer = None
+        self._idf = None
+        self.matrix = None
+
+    def __len__(self):
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def __prepare__(self, docs_list):
+        return self._semantics.__prepare_docs__(docs_list,
+                                                self.options['clean_documents'],
+                                                self.options['use_normal_form'])
+
+    def __counter__(self, vocabulary):
+        """
+        vectorizer counting the n-grams of a fixed vocabulary
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        return CountVectorizer(
+            stop_words=self.options['stop_words'],
+            ngram_range=(2, 3) if self.options['use_ngrams'] == True else (1, 1),
+            vocabulary=vocabulary)
+
+    def Fit(self, docs_list):
+        """
+        Fit - fit the vocabulary and idf weights on a corpus and index it
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        tfidf_vectorizer = TfidfVectorizer(
+            stop_words=self.options['stop_words'],
+            ngram_range=(2, 3) if self.options['use_ngrams'] == True else (1, 1))
+        self.matrix = tfidf_vectorizer.fit_transform(self.__prepare__(docs_list))
+        self._idf = tfidf_vectorizer.idf_
+        self._vectorizer = self.__counter__(tfidf_vectorizer.vocabulary_)
+        return self
+
+    def Transform(self, docs_list):
+        """
+        Transform - tf-idf matrix of documents with the fitted vocabulary and
+        idf weights (n-grams not in the vocabulary are ignored)
+        """
+        from scipy import sparse
+        from sklearn.preprocessing import normalize
+        if self._vectorizer is None:
+            raise InputError("The SimilarityIndex has to be fitted first")
+        counts = self._vectorizer.transform(self.__prepare__(docs_list))
+        return normalize(counts @ sparse.diags(self._idf), copy=False)
+
+    def Append(self, docs_list):
+        """
+        Append - add documents to the index without fitting it again (the
+        vocabulary and idf weights stay as fitted)
+
+        returns: range of the indexes of the new documents
+        """
+        from scipy import sparse
+        start = len(self)
+        self.matrix = sparse.vstack([self.matrix, self.Transform(docs_list)],
+                                    format='csr')
+        return range(start, len(self))
+
+    def Query(self, docs_list, top_k=10, threshold=None, block_size=1000):
+        """
+        Query - the indexed documents most similar to each of the documents
+
+        returns: list (one per document) of lists of (index of the indexed
+        document, similarity), most similar first
+        """
+        similarity = Pairwise_similarity(self.Transform(docs_list),
+                                         other=self.matrix,
+                                         top_k=top_k,
+                                         threshold=threshold,
+                                         block_size=block_size)
+        results = [[] for i in range(similarity.shape[0])]
+        for row, col, value in Similarity_edges(similarity):
+            results[row].append((col, value))
+        return results
+
+    def Save(self, path):
+        """
+        Save - write the index to a directory: the options and vocabulary as
+        json, the idf weights and the sparse matrix as .npy arrays (which Load
+        memory maps)
+        """
+        import numpy as np
+        if self._vectorizer is None:
+            raise InputError("The SimilarityIndex has to be fitted first")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        matrix = self.matrix.tocsr()
+        with io.open(os.path.join(path, 'index.json'), 'w',
+                     encoding='utf-8') as f:
+            json.dump({'options': self.options,
+                       'shape': list(matrix.shape),
+                       'vocabulary': {term: int(i) for term, i in
+                                      self._vectorizer.vocabulary.items()}},
+                      f, ensure_ascii=False)
+        np.save(os.path.join(path, 'idf.npy'), self._idf)
+        for name in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(path, name + '.npy'), getattr(matrix, name))
+
+    @classmethod
+    def Load(cls, path, tokenizer=None, mmap=True):
+        """
+        Load - read an index written by Save(), with the matrix memory mapped
+        (unless mmap=False) so that it is only paged in as it is used
+        """
+        import numpy as np
+        from scipy import sparse
+        with io.open(os.path.join(path, 'index.json'), encoding='utf-8') as f:
+            saved = json.load(f)
+        index = cls(tokenizer=tokenizer, **saved['options'])
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ('data', 'indices', 'indptr')]
+        index.matrix = sparse.csr_matrix(tuple(arrays), shape=saved['shape'],
+                                         copy=False)
+        index._idf = np.load(os.path.join(path, 'idf.npy'))
+        index._vectorizer = index.__counter__(saved['vocabulary'])
+        return index
+
+
+def Pairwise_similarity(matrix,
+                        other=None,
+                        top_k=None,
+                        threshold=None,
+                        block_size=1000):
+    """
+    Pairwise_similarity - cosine similarity of every row of a (L2 normalized,
+    i.e. tf-idf) sparse matrix to every row of another one (by default itself)
+    worked out block_size rows at a time, keeping only what is asked for:
+        - top_k - the top_k most similar rows of each row
+        - threshold - the pairs with at least this similarity
+        - neither - every non zero similarity (the full matrix, in sparse form)
+    When a matrix is compared to itself, with top_k or threshold, a row is not
+    counted as similar to itself.
+
+    returns: scipy.sparse csr_matrix (rows of matrix x rows of other)
+    """
+    import numpy as np
+    from scipy import sparse
+    if block_size < 1:
+        raise InputError("block_size must be a positive integer")
+    if top_k is not None and top_k < 1:
+        raise InputError("top_k must be a positive integer")
+    matrix = sparse.csr_matrix(matrix)
+    skip_self = other is None and (top_k is not None or threshold is not None)
+    other_t = (matrix if other is None else sparse.csr_matrix(other)).T.tocsc()
+    blocks = []
+    for start in range(0, matrix.shape[0], block_size):
+        block = matrix[start:start + block_size] @ other_t
+        if top_k is not None and block.nnz > block.shape[0] * block.shape[1] / 4:
+            # mostly non zero - cheaper to pick the top_k from a dense block
+            blocks.append(_top_k_dense(block.toarray(), start, top_k,
+                                       threshold, skip_self))
+            continue
+        block = block.tocoo()
+        rows, cols, data = block.row, block.col, block.data
+        keep = data > 0
+        if skip_self:
+            keep &= cols != rows + start
+        if threshold is not None:
+            keep &= data >= threshold
+        rows, cols, data = rows[keep], cols[keep], data[keep]
+        if top_k is not None:
+            rows, cols, data = _keep_top_k(rows, cols, data, top_k)
+        blocks.append(sparse.csr_matrix((data, (rows, cols)),
+                                        shape=block.shape))
+    if not blocks:
+        return sparse.csr_matrix((0, other_t.shape[1]))
+    return sparse.vstack(blocks, format='csr')
+
+
+def _keep_top_k(rows, cols, data, top_k):
+    """
+    the top_k largest entries of every row of a matrix given as (rows, cols,
+    data) arrays, sorted by row and most similar first
+    """
+    import numpy as np
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    first = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - first < top_k
+    return rows[keep], cols[keep], data[keep]
+
+
+def _top_k_dense(block, start, top_k, threshold, skip_self):
+    """
+    top_k (non zero, at least threshold) similarities of every row of a dense
+    block of the similarity matrix, as a sparse matrix
+    """
+    import numpy as np
+    from scipy import sparse
+    if skip_self:
+        rows = np.arange(block.shape[0])
+        block[rows, rows + start] = 0
+    if threshold is not None:
+        block[block < threshold] = 0
+    k = min(top_k, block.shape[1])
+    cols = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    data = np.take_along_axis(block, cols, axis=1)
+    rows = np.repeat(np.arange(block.shape[0]), k)
+    cols, data = cols.ravel(), data.ravel()
+    keep = data > 0
+    return sparse.csr_matrix((data[keep], (rows[keep], cols[keep])),
+                             shape=block.shape)
+
+
+def Similarity_edges(similarity):
+    """
+    Similarity_edges - list of (row, column, similarity) of the non zero
+    entries of a sparse similarity matrix, most similar first within each row
+    """
+    similarity = similarity.tocsr()
+    edges = []
+    for row in range(similarity.shape[0]):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        pairs = sorted(zip(similarity.indices[start:end],
+                           similarity.data[start:end]),
+                       key=lambda pair: (-pair[1], pair[0]))
+        edges.extend((row, int(col), float(value)) for col, value in pairs)
+    return edges
+
 
 if __name__ == '__main__':
     S = Semantics(clean='All')
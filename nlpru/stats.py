@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.stats
+
+opt-in instrumentation shared by Cleaner, FindTopics, Conversations and
+Semantics: wall/cpu timers per stage, counters (i.e. why Check_word rejected
+words), conversation propagation rounds and cache hit rates, plus a hook
+(callback and/or logging.Logger) that receives events as they happen.
+
+    from nlpru import stats
+    collected = stats.Enable(logger=logging.getLogger('nlpru'))
+    ... run FindTopics/Conversations/... ...
+    collected.Report()
+    stats.Disable()
+
+Nothing is collected until Enable() is called - the instrumented code only
+checks that stats.active is None (the module level Timer/Count/Event do
+nothing then). Work done in worker processes (processes=)
+is not collected.
+"""
+from __future__ import print_function
+import json
+import time
+
+# the Stats collecting at the moment, None when instrumentation is off
+active = None
+
+
+class _Timer:
+    '''
+    context manager adding the wall and cpu time of a block to a stage
+    '''
+
+    def __init__(self, stats, stage):
+        self._stats = stats
+        self._stage = stage
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        timer = self._stats.timers.setdefault(
+            self._stage, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        timer['calls'] += 1
+        timer['wall_seconds'] += time.perf_counter() - self._wall
+        timer['cpu_seconds'] += time.process_time() - self._cpu
+        return False
+
+
+class Stats:
+    '''
+    Stats - what was collected while instrumentation was on
+
+    @parameters:
+        - callback - (optional) function called as callback(event, fields) for
+        every event, i.e. every round of conversation propagation
+        - logger - (optional) logging.Logger the events are logged to (info
+        level, fields as json)
+    '''
+
+    def __init__(self, callback=None, logger=None):
+        self.callback = callback
+        self.logger = logger
+        self.Reset()
+
+    def Reset(self):
+        self.timers = {}
+        self.counters = {}
+
+    def Timer(self, stage):
+        '''
+        Timer - context manager timing a block as (a call of) stage
+        '''
+        return _Timer(self, stage)
+
+    def Count(self, name, key, n=1):
+        '''
+        Count - add n to the key counter of the name group of counters
+        '''
+        counter = self.counters.setdefault(name, {})
+        counter[key] = counter.get(key, 0) + n
+
+    def Event(self, event, **fields):
+        '''
+        Event - pass an event to the callback and logger
+        '''
+        if self.callback is not None:
+            self.callback(event, fields)
+        if self.logger is not None:
+            self.logger.info("%s %s", event, json.dumps(fields,
+                                                        ensure_ascii=False,
+                                                        default=str))
+
+    def Report(self):
+        '''
+        Report - dictionary of the timers, counters and the lemma cache stats
+        '''
+        from nlpru.cache import lemma_cache
+        return {'timers': {stage: dict(timer)
+                           for stage, timer in self.timers.items()},
+                'counters': {name: dict(counter)
+                             for name, counter in self.counters.items()},
+                'lemma_cache': lemma_cache.Stats()}
+
+
+def Enable(callback=None, logger=None):
+    '''
+    Enable - turn instrumentation on, returns the Stats object collecting
+    '''
+    global active
+    active = Stats(callback=callback, logger=logger)
+    return active
+
+
+def Disable():
+    '''
+    Disable - turn instrumentation off, returns what was collected
+    '''
+    global active
+    collected, active = active, None
+    return collected
+
+
+class _NoTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_timer = _NoTimer()
+
+
+def Timer(stage):
+    '''
+    Timer - active.Timer(stage), a context manager doing nothing when
+    instrumentation is off
+    '''
+    if active is None:
+        return _no_timer
+    return active.Timer(stage)
+
+
+def Count(name, key, n=1):
+    '''
+    Count - active.Count(name, key, n) if instrumentation is on
+    '''
+    if active is not None:
+        active.Count(name, key, n)
+
+
+def Event(event, **fields):
+    '''
+    Event - active.Event(event, **fields) if instrumentation is on
+    '''
+    if active is not None:
+        active.Event(event, **fields)
@@ -41,3 +41,6 @@ ru_alphabet = 'йцукенгшщзхъфывапролджэячсмитьбю'
 ru_consonants = 'йуеъыаоэяиью'
 en_alphabet = 'qwertyuiopasdfghjklzxcvbnm'
 numbers = '0123456789'
+
+# characters stripped by Cleaner.Clean_document(remove_special_chars=True)
+special_chars = "→©ђ°ѓ¡|=/▶►‼?~é\u0304\u0303`«»;џ\ufffd_●▪™“„#ї*&%¿$-”<>'+：^№€…)(—"
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.stories
+
+grouping of tweets into stories (events) from a thresholded similarity
+graph, see Semantics.Find_stories
+"""
+from __future__ import print_function
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from nlpru.error import InputError
+
+
+def Story_labels(similarity, method='components', links=None):
+    '''
+    Story_labels - story number of every document from a sparse similarity
+    matrix in which only the pairs similar enough are non zero (i.e. from
+    nlpru.semantics.Pairwise_similarity with a threshold)
+
+    @parameters:
+        - method - 'components': documents linked directly or through other
+        documents are one story; 'leader': documents are taken in order, each
+        joins the story of the most similar earlier story leader, or starts a
+        new story (and leads it) if there is none - stories do not chain
+        - links - (optional) pair of arrays of document numbers that are to
+        be in the same story whatever their similarity, i.e. replies and the
+        tweets they reply to
+
+    returns: array of story numbers, counted from 0 in order of appearance
+    '''
+    similarity = sparse.csr_matrix(similarity)
+    n = similarity.shape[0]
+    if method == 'components':
+        labels = connected_components(similarity, directed=False)[1]
+    elif method == 'leader':
+        labels = _leader_labels(similarity)
+    else:
+        raise InputError("Unknown story clustering method: {}".format(method))
+    if links is not None and len(links[0]):
+        # join the stories of linked documents
+        rows, cols = np.asarray(links[0]), np.asarray(links[1])
+        story_links = sparse.csr_matrix(
+            (np.ones(len(rows)), (labels[rows], labels[cols])),
+            shape=(labels.max() + 1,) * 2)
+        labels = connected_components(story_links, directed=False)[1][labels]
+    return _in_order_of_appearance(labels) if n else labels
+
+
+def _leader_labels(similarity):
+    '''
+    leader clustering: one pass over the documents in order
+    '''
+    n = similarity.shape[0]
+    labels = np.full(n, -1, dtype=np.int64)
+    indptr, indices, data = similarity.indptr, similarity.indices, similarity.data
+    is_leader = np.zeros(n, dtype=bool)
+    for i in range(n):
+        cols = indices[indptr[i]:indptr[i + 1]]
+        values = data[indptr[i]:indptr[i + 1]]
+        earlier = (cols < i) & is_leader[cols]
+        if earlier.any():
+            labels[i] = labels[cols[earlier][np.argmax(values[earlier])]]
+        else:
+            labels[i] = i
+            is_leader[i] = True
+    return labels
+
+
+def _in_order_of_appearance(labels):
+    '''
+    renumber labels 0, 1, 2, ... in the order they first appear
+    '''
+    unique, first, inverse = np.unique(labels, return_index=True,
+                                       return_inverse=True)
+    rank = np.empty(len(unique), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(unique))
+    return rank[inverse]
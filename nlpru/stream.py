@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.stream
+
+streaming, constant memory version of the (clean ->) check words -> topic
+match pipeline. Tweets are read lazily from JSONL or CSV files (optionally gzipped),
+labelled one chunk at a time and written out incrementally, so the size of
+the corpus is not limited by memory.
+
+In streaming mode a tweet is (twtid, {'text': ..., 'other': {...}}), where
+'other' holds the remaining fields of the record by name.
+"""
+from __future__ import print_function
+import csv
+import gzip
+import io
+import itertools
+import json
+import time
+
+from nlpru import stats as _stats
+from nlpru.clean import Cleaner
+from nlpru.error import InputError
+from nlpru.parallel import Chunked, Map_chunks
+from nlpru.tokenizer import nltk_word_tokenize
+from nlpru.topics import _clean_words, _get_matcher
+
+
+def _file_format(path, file_format):
+    '''
+    work out the format of a file ('jsonl' or 'csv') from its extension
+    '''
+    if file_format is not None:
+        if file_format not in ('jsonl', 'csv'):
+            raise InputError("Unknown file format: {}".format(file_format))
+        return file_format
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+def _open(path, mode, encoding):
+    '''
+    open a text file, through gzip if its name ends with .gz
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding=encoding, newline='')
+    return io.open(path, mode, encoding=encoding, newline='')
+
+
+def Read_tweets(path,
+                id_field='id',
+                text_field='text',
+                file_format=None,
+                encoding='utf-8'):
+    '''
+    Read_tweets - generator of (twtid, tweet) read lazily from a file
+
+    @parameters:
+        - path - JSONL (one json object per line) or CSV file with a header,
+        gzipped if the name ends with .gz
+        - id_field, text_field - names of the tweet id and tweet text fields
+        - file_format - 'jsonl' or 'csv', by default from the file extension
+    '''
+    file_format = _file_format(path, file_format)
+    with _open(path, 'r', encoding) as f:
+        if file_format == 'csv':
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            try:
+                twtid = record.pop(id_field)
+                text = record.pop(text_field)
+            except KeyError as e:
+                raise InputError(
+                    "Improper tweet record, missing field {}".format(e))
+            yield twtid, {'text': text, 'other': record}
+
+
+class _Labeller:
+    '''
+    labels the tweets of a chunk: clean -> check words -> topic match
+    '''
+
+    def __init__(self, matcher, tokenizer, clean_options):
+        self.cleaner = Cleaner()
+        self.matcher = matcher
+        self.tokenize = tokenizer
+        self.clean_options = clean_options
+
+    def label(self, texts):
+        if self.clean_options is not None:
+            texts = self.cleaner.Clean_documents(texts, **self.clean_options)
+        results = []
+        for text in texts:
+            clean_words = _clean_words(self.cleaner, self.tokenize, text)
+            results.append((clean_words, self.matcher.Match(clean_words)))
+        return results
+
+
+# labeller of a Label_tweets worker process, set up by _init_labeller
+_worker_state = {}
+
+
+def _init_labeller(matcher, tokenizer, clean_options):
+    _worker_state['labeller'] = _Labeller(matcher, tokenizer, clean_options)
+
+
+def _label_chunk(texts):
+    return _worker_state['labeller'].label(texts)
+
+
+def Label_tweets(tweets,
+                 topic_dict,
+                 clean=False,
+                 clean_options=None,
+                 tokenizer=None,
+                 chunksize=1000,
+                 processes=None):
+    '''
+    Label_tweets - generator that adds 'clean_words' and 'topic' to every
+    (twtid, tweet) of an iterable, in the same way as FindTopics.Keyword_Match
+    (but one chunk at a time) - unless clean is set
+
+    @parameters:
+        - tweets - iterable of (twtid, tweet), i.e. from Read_tweets()
+        - topic_dict - topics to match (or a TopicMatcher), see
+        FindTopics.Keyword_Match
+        - clean - clean the text with Cleaner.Clean_documents first (default
+        False). Keyword_Match does not, so the labels can then differ from
+        its labels, i.e. removing hashtags drops the words of '#митинг'
+        - clean_options - dictionary of Clean_document options to use
+        - tokenizer - function used to split the text into words (default
+        nltk.word_tokenize)
+        - chunksize - number of tweets labelled at a time
+        - processes - number of worker processes (None - this process only)
+    '''
+    matcher = _get_matcher(topic_dict)
+    if tokenizer is None:
+        tokenizer = nltk_word_tokenize
+    if clean:
+        clean_options = dict(clean_options or {})
+    else:
+        clean_options = None
+    chunks = Chunked(tweets, chunksize)
+    if processes is None or processes <= 1:
+        labeller = _Labeller(matcher, tokenizer, clean_options)
+        for chunk in chunks:
+            results = labeller.label([tweet['text'] for _, tweet in chunk])
+            for (twtid, tweet), (clean_words, topic) in zip(chunk, results):
+                tweet['clean_words'] = clean_words
+                tweet['topic'] = topic
+                yield twtid, tweet
+    else:
+        # keep the chunks on this side, only the texts go to the workers
+        chunks, texts = itertools.tee(chunks)
+        results = Map_chunks(_label_chunk,
+                             ([tweet['text'] for _, tweet in chunk]
+                              for chunk in texts),
+                             processes,
+                             initializer=_init_labeller,
+                             initargs=(matcher, tokenizer, clean_options))
+        for chunk, chunk_results in zip(chunks, results):
+            for (twtid, tweet), (clean_words, topic) in zip(chunk,
+                                                           chunk_results):
+                tweet['clean_words'] = clean_words
+                tweet['topic'] = topic
+                yield twtid, tweet
+
+
+def Write_tweets(tweets,
+                 path,
+                 id_field='id',
+                 text_field='text',
+                 file_format=None,
+                 buffer_size=1000,
+                 encoding='utf-8'):
+    '''
+    Write_tweets - write (twtid, tweet) pairs to a JSONL or CSV file (gzipped
+    if the name ends with .gz), at most buffer_size tweets are held before
+    being written. In CSV files clean_words are separated by spaces.
+
+    returns: number of tweets written
+    '''
+    file_format = _file_format(path, file_format)
+    n = 0
+    writer = None
+    with _open(path, 'w', encoding) as f:
+        for chunk in Chunked(tweets, buffer_size):
+            rows = []
+            for twtid, tweet in chunk:
+                row = {id_field: twtid, text_field: tweet['text']}
+                row.update(tweet.get('other') or {})
+                if 'clean_words' in tweet:
+                    row['clean_words'] = tweet['clean_words']
+                if 'topic' in tweet:
+                    row['topic'] = tweet['topic']
+                rows.append(row)
+            if file_format == 'csv':
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(rows[0]),
+                                            extrasaction='ignore')
+                    writer.writeheader()
+                for row in rows:
+                    if 'clean_words' in row:
+                        row['clean_words'] = ' '.join(row['clean_words'])
+                writer.writerows(rows)
+            else:
+                f.write(''.join(json.dumps(row, ensure_ascii=False) + '\n'
+                                for row in rows))
+            n += len(rows)
+    return n
+
+
+def Print_progress(stats):
+    '''
+    Print_progress - a progress function for Process_file that prints the
+    throughput
+    '''
+    print("{tweets} tweets processed, {tweets_per_second:.0f} tweets/s".format(
+        **stats))
+
+
+def _measure(tweets, stats, report_every, progress):
+    '''
+    pass the tweets through, counting them and reporting the throughput to
+    progress (if any) and as a 'process_file_progress' nlpru.stats event
+    '''
+    start = time.perf_counter()
+    for tweet in tweets:
+        yield tweet
+        stats['tweets'] += 1
+        if stats['tweets'] % report_every == 0 and \
+                (progress is not None or _stats.active is not None):
+            stats['seconds'] = time.perf_counter() - start
+            stats['tweets_per_second'] = stats['tweets'] / stats['seconds']
+            _stats.Event('process_file_progress', **stats)
+            if progress is not None:
+                progress(dict(stats))
+    stats['seconds'] = time.perf_counter() - start
+    if stats['seconds'] > 0:
+        stats['tweets_per_second'] = stats['tweets'] / stats['seconds']
+
+
+def Process_file(input_path,
+                 output_path,
+                 topic_dict,
+                 id_field='id',
+                 text_field='text',
+                 clean=False,
+                 clean_options=None,
+                 tokenizer=None,
+                 chunksize=1000,
+                 processes=None,
+                 report_every=100000,
+                 progress=None):
+    '''
+    Process_file - read tweets from input_path, label them by topic and write
+    them to output_path, all as a stream (memory use does not depend on the
+    size of the file)
+
+    @parameters:
+        - input_path/output_path - JSONL or CSV files, gzipped if .gz
+        - topic_dict - topics to match, see FindTopics.Keyword_Match
+        - clean, clean_options, tokenizer, chunksize, processes - see
+        Label_tweets()
+        - report_every - call progress every this many tweets
+        - progress - (optional) function called with a dictionary of
+        'tweets', 'seconds' and 'tweets_per_second', i.e. Print_progress.
+        With nlpru.stats enabled the same is also sent as a
+        'process_file_progress' event
+
+    returns: final dictionary of 'tweets', 'seconds', 'tweets_per_second'
+    '''
+    stats = {'tweets': 0, 'seconds': 0.0, 'tweets_per_second': 0.0}
+    tweets = Read_tweets(input_path, id_field=id_field, text_field=text_field)
+    labelled = Label_tweets(tweets,
+                            topic_dict,
+                            clean=clean,
+                            clean_options=clean_options,
+                            tokenizer=tokenizer,
+                            chunksize=chunksize,
+                            processes=processes)
+    Write_tweets(_measure(labelled, stats, report_every, progress),
+                 output_path,
+                 id_field=id_field,
+                 text_field=text_field,
+                 buffer_size=chunksize)
+    return stats
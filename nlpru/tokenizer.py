@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+nlpru.tokenizer
+
+fast, precompiled tokenizer for Russian social media text, an opt-in
+alternative to nltk.word_tokenize (it does not run Punkt sentence splitting
+or the English Treebank rules). The library uses nltk.word_tokenize unless
+another tokenizer is given (see nltk_word_tokenize below), pass
+tokenizer=word_tokenizer to FindTopics/Semantics/Label_tweets to use this
+one.
+
+Two modes are available:
+ - 'social' - urls, @mentions, #hashtags and emoji (incl. modifier/ZWJ
+   sequences and flags) are kept as single tokens, words may contain inner
+   hyphens and apostrophes ('из-за', 'кто-нибудь'), '...' and '…' are one
+   token, any other punctuation character is a token on its own
+ - 'word_tokenize' - closer to nltk.word_tokenize: '@', '#' and the parts of
+   urls are separate tokens, double quotes become `` and '' as in nltk.
+   It is NOT the same as word_tokenize, so the clean words (and topics) of
+   some tweets change when it is used instead:
+    > every character that is not a letter, digit or '_' is a token on its
+      own (apart from '...' and inner hyphens). nltk only splits off its
+      fixed set of punctuation (, ; : @ # $ % & ? ! ( ) [ ] { } < > quotes
+      and '--'), so 'Москва/Питер', 'суд=цирк', 'a+b', 'x^2', '№5', 'a~b',
+      'ул.Ленина', "сэ'к", '…слово' and 'слово\\' stay one token there
+    > ',' and ':' between digits are split ('4,5' gives '4', ',', '5'),
+      '--' gives '-', '-' and a leading or trailing '-' is split from the
+      word ('-7' gives '-', '7')
+    > a '.' is always split from the word before it, nltk only splits the
+      ones Punkt finds at the end of a sentence. This matters for Cleaner
+      output, where '.' is written as '\\.': inside a sentence nltk keeps
+      'москве\\.' as one token (which Check_word rejects), here it gives
+      'москве', '\\', '.' and the word counts
+    > English contractions are not split the nltk way ("it's" gives 'it',
+      "'", 's' rather than 'it', "'s")
+
+A Tokenizer instance can be passed to FindTopics and Semantics with the
+tokenizer= parameter (any function returning a list/iterable of tokens can).
+"""
+import re
+
+from nlpru.error import InputError
+
+# characters that make up emoji (pictographs, dingbats/symbols); an emoji
+# token is one of them with its modifiers and ZWJ joined parts, or a flag
+# (pair of regional indicators)
+_emoji_char = (u'[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF'
+               u'\u2300-\u23FF\u3030\u303D\u3297\u3299]')
+# variation selector / skin tone modifiers that can follow an emoji
+_emoji_modifier = u'(?:\uFE0F|[\U0001F3FB-\U0001F3FF])*'
+
+_emoji = (u'[\U0001F1E6-\U0001F1FF]{2}|' +
+          _emoji_char + _emoji_modifier +
+          u'(?:\u200D' + _emoji_char + _emoji_modifier + u')*')
+
+_patterns = {
+    'social': [
+        ('url', r'(?:https?://|www\.)\S*[^\s.,!?:;)»"\'…]'),
+        ('mention', r'@\w+'),
+        ('hashtag', r'#\w+'),
+        ('emoji', _emoji),
+        ('word', r"\w+(?:[-'’]\w+)*"),
+        ('ellipsis', r'\.\.\.+|…'),
+        ('punctuation', r'[^\w\s]'),
+    ],
+    'word_tokenize': [
+        ('ellipsis', r'\.\.\.'),
+        ('open_quote', r'(?:^|(?<=[\s(\[{<]))"'),
+        ('close_quote', r'"'),
+        ('word', r'\w+(?:-\w+)*'),
+        ('emoji', _emoji),
+        ('punctuation', r'[^\w\s]'),
+    ],
+}
+# tokens that are not returned as they appear in the text
+_replacements = {'open_quote': '``', 'close_quote': "''"}
+
+_compiled = {}
+
+
+def _compile(mode):
+    '''
+    compile (once) the pattern of a tokenizer mode
+    '''
+    if mode not in _compiled:
+        if mode not in _patterns:
+            raise InputError("Unknown tokenizer mode: {}".format(mode))
+        _compiled[mode] = re.compile(
+            '|'.join('(?P<{}>{})'.format(kind, pattern)
+                     for kind, pattern in _patterns[mode]),
+            re.UNICODE)
+    return _compiled[mode]
+
+
+class Tokenizer:
+    '''
+    Tokenizer - splits a document into tokens. Calling the object is the same
+    as calling Tokenize().
+
+    @parameters:
+        - mode - 'social' (default) or 'word_tokenize', see the nlpru.tokenizer
+        documentation for the differences
+    '''
+
+    def __init__(self, mode='social'):
+        self.mode = mode
+        self._pattern = _compile(mode)
+
+    def __call__(self, document):
+        return self.Tokenize(document)
+
+    def Tokenize(self, document):
+        '''
+        Tokenize - generator of the tokens of a document
+        '''
+        for match in self._pattern.finditer(document):
+            if match.lastgroup in _replacements:
+                yield _replacements[match.lastgroup]
+            else:
+                yield match.group()
+
+    def Span_tokenize(self, document):
+        '''
+        Span_tokenize - generator of (token, start, end, kind) tuples, where
+        document[start:end] is the text the token was taken from and kind is
+        one of 'url', 'mention', 'hashtag', 'emoji', 'word', 'ellipsis',
+        'punctuation' (or 'open_quote'/'close_quote' in 'word_tokenize' mode)
+        '''
+        for match in self._pattern.finditer(document):
+            kind = match.lastgroup
+            yield (_replacements.get(kind, match.group()),
+                   match.start(), match.end(), kind)
+
+
+def nltk_word_tokenize(document):
+    '''
+    nltk.word_tokenize (imported when first used) - the tokenizer used by
+    the library unless another one is given
+    '''
+    from nltk.tokenize import word_tokenize
+    return word_tokenize(document)
+
+
+# the precompiled tokenizer, opt-in (tokenizer=word_tokenizer)
+word_tokenizer = Tokenizer(mode='word_tokenize')
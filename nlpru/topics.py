@@ -3,11 +3,22 @@
 nlpru.topics
 """
 from __future__ import print_function
+import functools
+import itertools
+import json
+import types
+from nlpru import stats as _stats
 from nlpru.clean import Cleaner
-from nlpru.models import Convert_to_tweet_dictionary
-from nlpru.error import TopicModelError
+from nlpru.cache import LemmaStore, Text_hash
+from nlpru.models import Convert_to_tweet_dictionary, _tweet_access
+from nlpru.error import InputError, TopicModelError
+from nlpru.tokenizer import nltk_word_tokenize
+from nlpru.parallel import Chunked, Map_chunks
 
-from nltk.tokenize import word_tokenize
+# labels given to tweets matching no topic, or more than one topic
+no_topic_label = "none detected"
+two_topics_label = 'applies to 2 topics'
+many_topics_label = 'applies to more than 2 topics'
 
 
 class FindTopics:
@@ -15,9 +26,29 @@ class FindTopics:
     To detect topics, choose a choise of method, and pass in the required inputs
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self,
+                 tokenizer=None,
+                 check_word_options=None,
+                 cache_path=None,
+                 **kwargs):
         """
         @parameters: 
+            - tokenizer -- (optional) function used to split the tweets into
+                words, by default nltk's word_tokenize. Any function that
+                returns a list of tokens can be used, i.e. the faster
+                nlpru.tokenizer.word_tokenizer (which splits some tweets
+                differently, see nlpru.tokenizer)
+            - check_word_options -- (optional) dictionary of Cleaner.Check_word
+                options used on every word, by default
+                {'remove_proper_nouns': False}
+            - cache_path -- (optional) sqlite file in which the clean words of
+                every tweet are kept between runs (keyed by tweet id, checked
+                against a hash of the text), so re-running on an unchanged
+                corpus needs no morphological analysis. The tokenizer must
+                then be known by name (a module level function, a Tokenizer
+                or a functools.partial of one) - not a lambda, closure or
+                bound method, which could not be told apart from another one
+
             If you are inputting a list of tuples:
             - tweet_list -- specify list of tweets to categorize
             - tweet_text_index -- specify the index of the tweet text in the tuple;
@@ -29,18 +60,48 @@ class FindTopics:
             - tweet_dict - dictionary of tweets by twtid as the key
                 - NOTE: the following dict is expected:
                     {'twtid':{'text':'bla bla bla ... ',...},....}
+
+            For large corpora a compact nlpru.models.TweetStore can be passed
+            instead (as tweet_dict or tweet_store), the clean words and topics
+            are then kept in its columns
+
+            Tweets can also be read in batches from a database cursor
+            (tweet_cursor), any iterator of rows (tweet_iter) or a pandas
+            DataFrame (tweet_dataframe), see nlpru.models.Tweet_batches. To
+            keep them compact as well use
+            tweet_store=Convert_to_tweet_store(tweet_cursor=..., ...)
         """
         self._Cln = Cleaner()
+        if tokenizer is None:
+            tokenizer = nltk_word_tokenize
+        self._tokenize = tokenizer
+        self._check_word_options = {'remove_proper_nouns': False}
+        if check_word_options is not None:
+            self._check_word_options.update(check_word_options)
+        if cache_path is not None and \
+                _options_key(tokenizer, self._check_word_options) is None:
+            raise InputError("cache_path needs a tokenizer known by name, "
+                             "not {!r}".format(tokenizer))
+        self._store = LemmaStore(cache_path) if cache_path is not None else None
+        # twtid -> (hash of the text, options key) the stored clean_words were
+        # made from - a hash, so that no copy of the texts is kept
+        self._clean_state = {}
         self._tweet_dict = Convert_to_tweet_dictionary(**kwargs)
+        self._tweets = _tweet_access(self._tweet_dict)
 
     # --------Methods-------------------------------------------------------------------------
-    def Keyword_Match(self, topic_dict):
+    def Keyword_Match(self,
+                      topic_dict,
+                      processes=None,
+                      chunksize=1000,
+                      checkpoint=None):
         """
         Keyword_Match() is the main method to see if a tweet contains a set of 
         keywords required
         
         @parametrs:
-            - topic_dict - a dictionary of keywords to search of the following 
+            - topic_dict - a dictionary of keywords to search (or a TopicMatcher
+            compiled from one, to reuse it across calls) of the following 
             pattern: 
                 
         topic_dict = {
@@ -57,33 +118,37 @@ class FindTopics:
         in the tweet to be categorized as part of "topic 1"
             - NOTE: This is optional, and the presence of the 'not' object is 
             not necessary
+        - besides single (lemmatized) words, 'contains' and 'not' accept:
+            - phrases - consecutive lemmas, as a string with spaces or a tuple:
+            "уголовный дело" or ('уголовный', 'дело')
+            - proximity rules - two lemmas at most 'within' words apart (in
+            any order): {'near': ['суд', 'приговор'], 'within': 3}
+
+            - processes - (optional) number of worker processes to spread the
+            tweets over, None (default) or 1 does everything in this process.
+            The output is the same either way
+            - chunksize - number of tweets sent to a worker at a time
+            (and written to the checkpoint at a time)
+            - checkpoint - (optional) nlpru.checkpoint.Checkpoint: the clean
+            words and topic of every chunk of tweets are written to it as they
+            are done, and the tweets found in it (with the same text and
+            options) are not done again - so a stopped run can be restarted
             
         @output:
             - the output is a dictionary of tweets with the applied topic categories
+            (the TweetStore itself if one was given)
         """
-        #validate construction of topic_dict
-        topic_dict = self.__validate_topic_dict_construction__(topic_dict)
-        #iterate through the topics inputted
-        for tweet in self._tweet_dict:
-            #clean each word in the tweet (tokenize, lemmatize, etc)
-            clean_words = self.__clean_words__(self._tweet_dict[tweet]['text'])
-            self._tweet_dict[tweet]['clean_words'] = clean_words
-            topic = "none detected"
-            num_assigned = 0
-            #iterate through possible list of topics
-            for each_topic in topic_dict:
-                #if keywords match those that 'contains' and NOT those 'not', 
-                #categorize the tweet by topic
-                if len(set(topic_dict[each_topic]['contains']).intersection(clean_words)) != 0:
-                    if len(set(topic_dict[each_topic]['not']).intersection(clean_words)) == 0:
-                        topic = each_topic
-                        num_assigned += 1
-            if num_assigned <= 1:
-                self._tweet_dict[tweet]['topic'] = topic
-            if num_assigned == 2:
-                self._tweet_dict[tweet]['topic'] = 'applies to 2 topics'
-            if num_assigned > 2:
-                self._tweet_dict[tweet]['topic'] = 'applies to more than 2 topics'
+        #validate topic_dict and compile it into an inverted index
+        matcher = _get_matcher(topic_dict)
+        #clean each word in the tweets (tokenize, lemmatize, etc) - unless it
+        #was already done for the same text and options
+        with _stats.Timer('keyword_match.clean_words'):
+            self.__update_clean_words__(processes, chunksize, checkpoint,
+                                        matcher)
+        tweets = self._tweets
+        with _stats.Timer('keyword_match.match'):
+            for tweet in tweets.Ids():
+                tweets.Set_topic(tweet, matcher.Match(tweets.Clean_words(tweet)))
         return self._tweet_dict
     
     def __validate_topic_dict_construction__(self, topic_dict):
@@ -91,32 +156,397 @@ class FindTopics:
         __validate_topic__() converts the inputted topic_dict with the allowed
         flexibilities, and converts it into the format required for Keyword_Match()
         """
-        for each_topic in topic_dict:
-            try:
-                if 'contains' not in topic_dict[each_topic]:
-                    if type(topic_dict[each_topic]) == list:
-                        temp_list = topic_dict[each_topic]
-                        topic_dict.pop(each_topic)
-                        topic_dict[each_topic] = {'contains':temp_list}
-                    else:
-                        raise TopicModelError("improper topic dictionary construction, 'conains' missing")
-                if 'not' not in topic_dict[each_topic]:
-                    topic_dict[each_topic]['not'] = []
-            except Exception as e:
-                raise TopicModelError("Error in validating topic_dict: {}".format(e))
-        return topic_dict
+        return _validate_topic_dict(topic_dict)
 
     def __clean_words__(self, document):
         """
         isolate the checking of words from a document into a separate function
         (for easier use later)
         """
-        words = []
-        for word in word_tokenize(document):
-            result = self._Cln.Check_word(word, remove_proper_nouns=False)
-            if result['status'] == 'ok':
-                words.append(result['word'])
-        return words
+        return _clean_words(self._Cln, self._tokenize, document,
+                            self._check_word_options)
+
+    def __update_clean_words__(self,
+                               processes,
+                               chunksize,
+                               checkpoint=None,
+                               matcher=None):
+        """
+        make sure every tweet has up to date 'clean_words': they are reused if
+        they were computed by this object from the same text with the same
+        options (or are in the checkpoint), then looked up in the on-disk
+        store (if any), and only the remaining tweets are tokenized and
+        lemmatized
+        """
+        key = _options_key(self._tokenize, self._check_word_options)
+        if key is None:
+            if checkpoint is not None:
+                raise InputError("Checkpoints need a tokenizer known by "
+                                 "name, not {!r}".format(self._tokenize))
+            # only reused by this object, which always has the same tokenizer
+            key = json.dumps([None, sorted(self._check_word_options.items())])
+        tweets = self._tweets
+        restored = 0
+        if checkpoint is not None:
+            for tweet, text_hash, clean_words, topic in checkpoint.Tweets(key):
+                if tweet in tweets and \
+                        Text_hash(tweets.Text(tweet)) == text_hash:
+                    self.__set_clean_words__(tweet, clean_words, key,
+                                             text_hash)
+                    restored += 1
+            _stats.Count('clean_words', 'from_checkpoint', restored)
+        missing = []
+        reused = 0
+        for chunk in Chunked(tweets.Ids(), chunksize):
+            stale = [tweet for tweet in chunk
+                     if tweets.Clean_words(tweet) is None or
+                     self._clean_state.get(tweet) !=
+                     (Text_hash(tweets.Text(tweet)), key)]
+            reused += len(chunk) - len(stale)
+            if stale and self._store is not None:
+                found = self._store.Get_many(
+                    [(tweet, tweets.Text(tweet)) for tweet in stale], key)
+                _stats.Count('clean_words', 'from_store', len(found))
+                for tweet, clean_words in found.items():
+                    self.__set_clean_words__(tweet, clean_words, key)
+                stale = [tweet for tweet in stale if tweet not in found]
+            missing.extend(stale)
+        _stats.Count('clean_words', 'reused', reused - restored)
+        _stats.Count('clean_words', 'computed', len(missing))
+        if processes is None or processes <= 1:
+            results = (self.__clean_words__(tweets.Text(tweet))
+                       for tweet in missing)
+        else:
+            texts = (tweets.Text(tweet) for tweet in missing)
+            results = itertools.chain.from_iterable(Map_chunks(
+                _clean_words_chunk,
+                Chunked(texts, chunksize),
+                processes,
+                initializer=_init_clean_words,
+                initargs=(self._tokenize, self._check_word_options)))
+        for chunk in Chunked(zip(missing, results), chunksize):
+            for tweet, clean_words in chunk:
+                self.__set_clean_words__(tweet, clean_words, key)
+            if self._store is not None:
+                self._store.Put_many(
+                    [(tweet, tweets.Text(tweet), clean_words)
+                     for tweet, clean_words in chunk], key)
+            if checkpoint is not None:
+                checkpoint.Put_tweets(
+                    [(tweet, tweets.Text(tweet), clean_words,
+                      matcher.Match(clean_words))
+                     for tweet, clean_words in chunk], key)
+
+    def __set_clean_words__(self, tweet, clean_words, key, text_hash=None):
+        self._tweets.Set_clean_words(tweet, clean_words)
+        if text_hash is None:
+            text_hash = Text_hash(self._tweets.Text(tweet))
+        self._clean_state[tweet] = (text_hash, key)
+
+
+def _validate_topic_dict(topic_dict):
+    """
+    convert the topic_dict (with the allowed flexibilities) into the format
+    required by TopicMatcher
+    """
+    # iterate over a copy of the keys, list topics are replaced while looping
+    for each_topic in list(topic_dict):
+        try:
+            if 'contains' not in topic_dict[each_topic]:
+                if type(topic_dict[each_topic]) == list:
+                    topic_dict[each_topic] = {'contains': topic_dict[each_topic]}
+                else:
+                    raise TopicModelError("improper topic dictionary construction, 'conains' missing")
+            if 'not' not in topic_dict[each_topic]:
+                topic_dict[each_topic]['not'] = []
+        except Exception as e:
+            raise TopicModelError("Error in validating topic_dict: {}".format(e))
+    return topic_dict
+
+
+def _topics_label(topics):
+    """
+    label of a tweet from the (distinct) topics it applies to
+    """
+    if len(topics) == 0:
+        return no_topic_label
+    if len(topics) == 1:
+        return next(iter(topics))
+    if len(topics) == 2:
+        return two_topics_label
+    return many_topics_label
+
+
+def _clean_words(cleaner, tokenize, document, check_word_options=None):
+    """
+    tokenize a document and keep the checked (lemmatized) words
+    """
+    if check_word_options is None:
+        check_word_options = {'remove_proper_nouns': False}
+    results = cleaner.Check_words(tokenize(document), **check_word_options)
+    return [result['word'] for result in results if result['status'] == 'ok']
+
+
+def _tokenizer_name(tokenize):
+    """
+    name of a tokenizer that is the same in every process and run, or None
+    for tokenizers that cannot be told apart by name: lambdas, closures,
+    bound methods and other callable objects
+    """
+    if hasattr(tokenize, 'mode'):
+        return '{}.{}({})'.format(type(tokenize).__module__,
+                                  type(tokenize).__name__,
+                                  tokenize.mode)
+    if isinstance(tokenize, functools.partial):
+        name = _tokenizer_name(tokenize.func)
+        arguments = repr((tokenize.args, sorted(tokenize.keywords.items())))
+        if name is None or ' at 0x' in arguments:
+            return None
+        return name + arguments
+    qualname = getattr(tokenize, '__qualname__', None)
+    owner = getattr(tokenize, '__self__', None)
+    if qualname is None or '<' in qualname or \
+            (owner is not None and not isinstance(owner, types.ModuleType)):
+        return None
+    return '{}.{}'.format(getattr(tokenize, '__module__', ''), qualname)
+
+
+def _options_key(tokenize, check_word_options):
+    """
+    string identifying the tokenizer and Check_word options, clean words are
+    only reused when it is the same - None if the tokenizer has no name (see
+    _tokenizer_name), its clean words are then not stored anywhere
+    """
+    tokenizer_name = _tokenizer_name(tokenize)
+    if tokenizer_name is None:
+        return None
+    return json.dumps([tokenizer_name, sorted(check_word_options.items())])
+
+
+class _PhraseAutomaton:
+    """
+    Aho-Corasick automaton over sequences of lemmas: finds every phrase that
+    ends at each word of a tweet in a single pass
+    """
+
+    def __init__(self, phrases):
+        self._goto = [{}]
+        out = [[]]
+        for phrase_id, phrase in enumerate(phrases):
+            state = 0
+            for lemma in phrase:
+                if lemma not in self._goto[state]:
+                    self._goto.append({})
+                    out.append([])
+                    self._goto[state][lemma] = len(self._goto) - 1
+                state = self._goto[state][lemma]
+            out[state].append(phrase_id)
+        # failure links, breadth first so that shorter states are done first
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for lemma, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and lemma not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(lemma, 0)
+                out[next_state].extend(out[self._fail[next_state]])
+        self._out = [tuple(phrase_ids) for phrase_ids in out]
+
+    def step(self, state, lemma):
+        """
+        move on by one lemma, returns the new state and the ids of the
+        phrases that end there
+        """
+        while state and lemma not in self._goto[state]:
+            state = self._fail[state]
+        state = self._goto[state].get(lemma, 0)
+        return state, self._out[state]
+
+
+def _parse_rule(rule):
+    """
+    parse one entry of a topic's 'contains'/'not' list into a
+    ('word', lemma), ('phrase', [lemmas]) or ('near', lemma, lemma, within)
+    rule
+    """
+    if isinstance(rule, dict):
+        try:
+            first, second = rule['near']
+            within = int(rule.get('within', 1))
+        except Exception as e:
+            raise TopicModelError(
+                "improper proximity rule {}: {}".format(rule, e))
+        if within < 1:
+            raise TopicModelError(
+                "improper proximity rule {}: 'within' must be at least 1".format(rule))
+        return ('near', first, second, within)
+    if isinstance(rule, (list, tuple)):
+        lemmas = list(rule)
+    elif isinstance(rule, str) and len(rule.split()) > 1:
+        lemmas = rule.split()
+    else:
+        return ('word', rule)
+    if len(lemmas) == 0:
+        raise TopicModelError("empty phrase in topic_dict")
+    if len(lemmas) == 1:
+        return ('word', lemmas[0])
+    return ('phrase', lemmas)
+
+
+class TopicMatcher:
+    """
+    TopicMatcher - a topic_dict (see FindTopics.Keyword_Match) compiled into
+    an inverted index from each keyword to the topics it belongs to, plus an
+    Aho-Corasick automaton for the phrases and an index of the proximity
+    rules, so a tweet is matched in one pass over its words whatever the
+    number of topics and rules. Compile it once and pass it to Keyword_Match
+    to reuse it; it can be pickled, or saved to/loaded from json.
+    """
+
+    def __init__(self, topic_dict=None):
+        self.topics = []
+        # keyword -> ids (positions in self.topics) of the topics it is
+        # 'contains'/'not' for
+        self._contains = {}
+        self._not = {}
+        # [lemmas, topic id, is 'not'] and [lemma, lemma, within, topic id,
+        # is 'not']
+        self._phrases = []
+        self._near = []
+        if topic_dict is not None:
+            topic_dict = _validate_topic_dict(topic_dict)
+            for topic_id, each_topic in enumerate(topic_dict):
+                self.topics.append(each_topic)
+                for negated, key in [(False, 'contains'), (True, 'not')]:
+                    for rule in topic_dict[each_topic][key]:
+                        self._add_rule_(_parse_rule(rule), topic_id, negated)
+        self._freeze_()
+
+    def _add_rule_(self, rule, topic_id, negated):
+        if rule[0] == 'word':
+            index = self._not if negated else self._contains
+            index.setdefault(rule[1], set()).add(topic_id)
+        elif rule[0] == 'phrase':
+            self._phrases.append([rule[1], topic_id, negated])
+        else:
+            self._near.append([rule[1], rule[2], rule[3], topic_id, negated])
+
+    def _freeze_(self):
+        self._contains = {word: frozenset(ids)
+                          for word, ids in self._contains.items()}
+        self._not = {word: frozenset(ids) for word, ids in self._not.items()}
+        self._automaton = None
+        if self._phrases:
+            self._automaton = _PhraseAutomaton(
+                [phrase[0] for phrase in self._phrases])
+        # lemma -> [(other lemma, within, topic id, is 'not'), ...]
+        self._near_index = None
+        if self._near:
+            self._near_index = {}
+            for first, second, within, topic_id, negated in self._near:
+                self._near_index.setdefault(first, []).append(
+                    (second, within, topic_id, negated))
+                if second != first:
+                    self._near_index.setdefault(second, []).append(
+                        (first, within, topic_id, negated))
+
+    def Match(self, clean_words):
+        """
+        Match() returns the topic label of a tweet from its clean words: the
+        topic, 'none detected', 'applies to 2 topics' or 'applies to more
+        than 2 topics'
+        """
+        matched = set()
+        excluded = set()
+        automaton = self._automaton
+        near_index = self._near_index
+        state = 0
+        last_seen = {}
+        for position, word in enumerate(clean_words):
+            if word in self._contains:
+                matched.update(self._contains[word])
+            if word in self._not:
+                excluded.update(self._not[word])
+            if automaton is not None:
+                state, phrase_ids = automaton.step(state, word)
+                for phrase_id in phrase_ids:
+                    topic_id, negated = self._phrases[phrase_id][1:]
+                    (excluded if negated else matched).add(topic_id)
+            if near_index is not None and word in near_index:
+                for other, within, topic_id, negated in near_index[word]:
+                    seen = last_seen.get(other)
+                    if seen is not None and position - seen <= within:
+                        (excluded if negated else matched).add(topic_id)
+                last_seen[word] = position
+        if excluded:
+            matched -= excluded
+        return _topics_label([self.topics[topic_id] for topic_id in matched])
+
+    def Save(self, path):
+        """
+        Save() writes the compiled rules to a json file
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'topics': self.topics,
+                       'contains': {word: sorted(ids) for word, ids
+                                    in self._contains.items()},
+                       'not': {word: sorted(ids) for word, ids
+                               in self._not.items()},
+                       'phrases': self._phrases,
+                       'near': self._near},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def Load(cls, path):
+        """
+        Load() reads a TopicMatcher written by Save()
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            matcher = cls()
+            matcher.topics = data['topics']
+            matcher._contains = data['contains']
+            matcher._not = data['not']
+            matcher._phrases = data.get('phrases', [])
+            matcher._near = data.get('near', [])
+            matcher._freeze_()
+        except (KeyError, TypeError, ValueError) as e:
+            raise TopicModelError("Improper TopicMatcher file: {}".format(e))
+        return matcher
+
+
+def _get_matcher(topic_dict):
+    """
+    TopicMatcher for a topic_dict, or the TopicMatcher itself if one is given
+    """
+    if isinstance(topic_dict, TopicMatcher):
+        return topic_dict
+    return TopicMatcher(topic_dict)
+
+
+# state of a Keyword_Match worker process, set up once by _init_clean_words
+_worker_state = {}
+
+
+def _init_clean_words(tokenize, check_word_options):
+    """
+    set up a Keyword_Match worker process
+    """
+    _worker_state['cleaner'] = Cleaner()
+    _worker_state['tokenize'] = tokenize
+    _worker_state['check_word_options'] = check_word_options
+
+
+def _clean_words_chunk(texts):
+    """
+    worker side of Keyword_Match: the clean words of every text
+    """
+    return [_clean_words(_worker_state['cleaner'], _worker_state['tokenize'],
+                         text, _worker_state['check_word_options'])
+            for text in texts]
 
 
 if __name__ == '__main__':
@@ -19,5 +19,7 @@ setup(name='nlpru',
               'pymorphy2',
               'nltk',
               'emoji',
+              'numpy',
+              'scipy',
               'sklearn'],
       zip_safe=False)
\ No newline at end of file
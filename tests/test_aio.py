@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Label_stream fed by a TweetQueue filled in the same event loop
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('pymorphy2')
+
+from nlpru import InputError
+from nlpru.aio import Label_stream, TweetQueue
+from nlpru.stream import Label_tweets
+from nlpru.tokenizer import word_tokenizer
+
+_topics = {'courts': ['суд', 'приговор'], 'politics': ['выборы']}
+_words = [u'суд', u'вынес', u'приговор', u'выборы', u'москва', u'погода']
+
+
+def _tweets(n):
+    return [(i, {'text': u' '.join(_words[(i + j) % len(_words)]
+                                    for j in range(i % 4 + 1))})
+            for i in range(n)]
+
+
+async def _produce(queue, tweets, delay=0):
+    for twtid, tweet in tweets:
+        await queue.Put(twtid, dict(tweet))
+        if delay:
+            await asyncio.sleep(delay)
+    await queue.Close()
+
+
+def test_order_and_labels_match_label_tweets():
+    tweets = _tweets(200)
+    expected = [(twtid, tweet['clean_words'], tweet['topic'])
+                for twtid, tweet in Label_tweets(
+                    [(twtid, dict(tweet)) for twtid, tweet in tweets],
+                    _topics, tokenizer=word_tokenizer)]
+
+    async def run():
+        queue = TweetQueue(maxsize=7)
+        producer = asyncio.ensure_future(_produce(queue, tweets))
+        labelled = [(twtid, tweet['clean_words'], tweet['topic'])
+                    async for twtid, tweet in Label_stream(
+                        queue, _topics, tokenizer=word_tokenizer,
+                        batch_size=16, max_in_flight=3, workers=3)]
+        await producer
+        return labelled
+    assert asyncio.run(run()) == expected
+
+
+def test_slow_consumer_holds_back_the_producer():
+    batch_size, max_in_flight, max_queued, maxsize = 10, 2, 5, 5
+
+    async def run():
+        queue = TweetQueue(maxsize=maxsize)
+        put = [0]
+
+        async def producer():
+            for twtid, tweet in _tweets(1000):
+                await queue.Put(twtid, tweet)
+                put[0] += 1
+        task = asyncio.ensure_future(producer())
+        stream = Label_stream(queue, _topics, tokenizer=word_tokenizer,
+                              batch_size=batch_size,
+                              max_in_flight=max_in_flight,
+                              max_queued=max_queued)
+        await stream.__anext__()
+        await asyncio.sleep(0.3)
+        held = put[0]
+        task.cancel()
+        await stream.aclose()
+        return held
+    # the batches in flight (and the one being handed over), the tweets
+    # read ahead, the queue and the tweet being batched
+    assert asyncio.run(run()) <= \
+        (max_in_flight + 1) * batch_size + max_queued + maxsize + 1
+
+
+def test_max_wait_sends_a_partial_batch():
+    async def run():
+        queue = TweetQueue()
+        stream = Label_stream(queue, _topics, tokenizer=word_tokenizer,
+                              batch_size=100, max_wait=0.05)
+        await queue.Put(1, {'text': u'суд вынес приговор'})
+        twtid, tweet = await asyncio.wait_for(stream.__anext__(), 5)
+        await queue.Close()
+        await stream.aclose()
+        return twtid, tweet['topic']
+    assert asyncio.run(run()) == (1, 'courts')
+
+
+def test_source_error_propagates():
+    async def source():
+        yield 1, {'text': u'суд'}
+        raise ValueError('source failed')
+
+    async def run():
+        return [twtid async for twtid, tweet in Label_stream(
+            source(), _topics, tokenizer=word_tokenizer, batch_size=1)]
+    with pytest.raises(ValueError, match='source failed'):
+        asyncio.run(run())
+
+
+def test_closed_queue():
+    async def run():
+        queue = TweetQueue(maxsize=1)
+        await queue.Put(1, {'text': u'суд'})
+        # closing waits for room for the end of the stream
+        closing = asyncio.ensure_future(queue.Close())
+        await asyncio.sleep(0)
+        with pytest.raises(InputError):
+            await queue.Put(2, {'text': u'суд'})
+        read = [twtid async for twtid, tweet in queue]
+        await closing
+        # the end is not lost on the next read, and nothing is put back
+        again = await asyncio.wait_for(
+            asyncio.ensure_future(_read_all(queue)), 1)
+        await queue.Close()
+        return read, again
+    assert asyncio.run(run()) == ([1], [])
+
+
+async def _read_all(queue):
+    return [twtid async for twtid, tweet in queue]
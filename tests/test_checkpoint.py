@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+checkpoints of recategorization are tied to their input and only take ids
+that come back the same; an interrupted Keyword_Match resumes from its
+checkpoint, but only for the same text and options
+"""
+import copy
+import json
+
+import pytest
+
+from nlpru import Conversations, FindTopics, InputError, stats
+from nlpru.checkpoint import Checkpoint
+
+
+def _tweets():
+    return {1: {'text': '', 'topic': 'a'},
+            2: {'text': '', 'topic': 'none detected'},
+            3: {'text': '', 'topic': 'none detected'}}
+
+
+def _recategorize(path, reply_list, tweets=None):
+    checkpoint = Checkpoint(path)
+    try:
+        return Conversations(reply_list=reply_list).Recategorize_topics(
+            'a', tweet_dict=tweets or _tweets(), checkpoint=checkpoint)
+    finally:
+        checkpoint.Close()
+
+
+def test_resume_gives_same_output(tmp_path):
+    path = str(tmp_path / 'job.checkpoint')
+    first = _recategorize(path, [(2, 1), (3, 2)])
+    assert first == _recategorize(path, [(2, 1), (3, 2)])
+    assert first[3]['topic'] == 'a'
+
+
+def test_other_links_with_same_counts_are_refused(tmp_path):
+    path = str(tmp_path / 'job.checkpoint')
+    _recategorize(path, [(2, 1), (3, 2)])
+    with pytest.raises(InputError):
+        _recategorize(path, [(2, 1), (3, 1)])
+
+
+def test_other_starting_topics_are_refused(tmp_path):
+    path = str(tmp_path / 'job.checkpoint')
+    _recategorize(path, [(2, 1)])
+    tweets = _tweets()
+    tweets[3]['topic'] = 'b'
+    with pytest.raises(InputError):
+        _recategorize(path, [(2, 1)], tweets)
+
+
+def test_tuple_ids_are_refused(tmp_path):
+    tweets = {(1, 'x'): {'text': '', 'topic': 'a'},
+              (2, 'x'): {'text': '', 'topic': 'none detected'}}
+    with pytest.raises(InputError):
+        _recategorize(str(tmp_path / 'job.checkpoint'),
+                      [((2, 'x'), (1, 'x'))], tweets)
+
+
+class _Stop(Exception):
+    pass
+
+
+class _StoppingCheckpoint(Checkpoint):
+    '''
+    checkpoint of a run that is stopped after writing some chunks
+    '''
+
+    def __init__(self, path, chunks):
+        Checkpoint.__init__(self, path)
+        self._chunks = chunks
+
+    def Put_tweets(self, rows, options):
+        Checkpoint.Put_tweets(self, rows, options)
+        self._chunks -= 1
+        if self._chunks == 0:
+            raise _Stop()
+
+
+def _keyword_match(tweets, checkpoint=None, **kwargs):
+    pytest.importorskip('pymorphy2')
+    from nlpru.benchmark import benchmark_topics
+    from nlpru.tokenizer import word_tokenizer
+    kwargs.setdefault('tokenizer', word_tokenizer)
+    collected = stats.Enable()
+    try:
+        labelled = FindTopics(tweet_dict=tweets, **kwargs).Keyword_Match(
+            json.loads(json.dumps(benchmark_topics)), chunksize=10,
+            checkpoint=checkpoint)
+        counters = collected.Report()['counters']['clean_words']
+    finally:
+        stats.Disable()
+    return ({twtid: (tweet['clean_words'], tweet['topic'])
+             for twtid, tweet in labelled.items()}, counters)
+
+
+def _corpus():
+    from nlpru.benchmark import Synthetic_tweets
+    return {twtid: {'text': text}
+            for twtid, text in Synthetic_tweets(50, seed=5)}
+
+
+def _interrupted(path):
+    checkpoint = _StoppingCheckpoint(path, chunks=2)
+    with pytest.raises(_Stop):
+        _keyword_match(_corpus(), checkpoint)
+    checkpoint.Close()
+
+
+def test_keyword_match_resumes(tmp_path):
+    expected, _ = _keyword_match(_corpus())
+    path = str(tmp_path / 'job.checkpoint')
+    _interrupted(path)
+    checkpoint = Checkpoint(path)
+    labelled, counters = _keyword_match(_corpus(), checkpoint)
+    checkpoint.Close()
+    assert labelled == expected
+    assert counters['from_checkpoint'] == 20
+    assert counters['computed'] == 30
+
+
+def test_keyword_match_redoes_changed_text(tmp_path):
+    path = str(tmp_path / 'job.checkpoint')
+    _interrupted(path)
+    tweets = _corpus()
+    changed = list(tweets)[0]
+    tweets[changed]['text'] = u'суд вынес приговор'
+    expected, _ = _keyword_match(copy.deepcopy(tweets))
+    checkpoint = Checkpoint(path)
+    labelled, counters = _keyword_match(tweets, checkpoint)
+    checkpoint.Close()
+    assert labelled == expected
+    assert labelled[changed][0] == [u'суд', u'вынести', u'приговор']
+    assert counters['from_checkpoint'] == 19
+
+
+def test_keyword_match_ignores_other_options(tmp_path):
+    path = str(tmp_path / 'job.checkpoint')
+    _interrupted(path)
+    options = {'check_word_options': {'remove_proper_nouns': True}}
+    expected, _ = _keyword_match(_corpus(), **options)
+    checkpoint = Checkpoint(path)
+    labelled, counters = _keyword_match(_corpus(), checkpoint, **options)
+    checkpoint.Close()
+    assert labelled == expected
+    assert counters.get('from_checkpoint', 0) == 0
+    assert counters['computed'] == 50
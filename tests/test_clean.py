@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Clean_document against the output of the original (pre-engine)
+implementation on a fixed corpus, tests/data/clean_golden.json. Cases where
+the output changed on purpose (emoji are now removed, swears are removed in
+one pass - see nlpru.clean._CleaningEngine) carry the original output in
+'baseline' and the reason in 'difference'.
+"""
+import io
+import json
+import os
+
+import pytest
+
+pytest.importorskip('pymorphy2')
+pytest.importorskip('emoji')
+
+from nlpru import Cleaner
+
+_golden = os.path.join(os.path.dirname(__file__), 'data', 'clean_golden.json')
+
+
+def _cases():
+    with io.open(_golden, encoding='utf-8') as f:
+        return json.load(f)['cases']
+
+
+def test_clean_document_matches_golden_corpus():
+    cleaner = Cleaner()
+    wrong = [(case['text'], case['flags'])
+             for case in _cases()
+             if cleaner.Clean_document(case['text'], **case['flags']) !=
+             case['expected']]
+    assert wrong == []
+
+
+def test_clean_documents_matches_clean_document():
+    cleaner = Cleaner()
+    cases = [case for case in _cases() if case['flags'] == {}]
+    assert list(cleaner.Clean_documents([case['text'] for case in cases])) == \
+        [case['expected'] for case in cases]
+
+
+def test_only_documented_differences():
+    differences = {case.get('difference') for case in _cases()
+                   if 'baseline' in case}
+    assert differences <= {'emoji', 'swears'}
+    assert any(case['text'] == u'ещётвою матьбля' and
+               case.get('baseline') == u'ещля' and case['expected'] == u'ещё'
+               for case in _cases())
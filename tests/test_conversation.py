@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+recategorization through the conversations on small hand-built graphs: a
+chain, a cycle and a diamond, with the labels and hop distances written out;
+and the incremental updates against recategorizing the same graph at once
+"""
+import random
+
+from nlpru import Conversations
+
+# 'a' chain: a2 replies to a1 (on the topic), a3 quotes a2, a4 retweets a3
+# 'c' cycles: c2 and c3 reply to each other (not linked to the topic), c4
+# replies to c1 (on the topic) and quotes c5 which replies to c4
+# 'd' diamond: d2 replies to and d3 quotes d1 (on the topic), d4 replies to d2
+# and quotes d3, d5 retweets d4; x replies to d1 but is on another topic and
+# y replies to a tweet that is not in the tweets
+_replies = [('a2', 'a1'), ('c2', 'c3'), ('c3', 'c2'), ('c4', 'c1'),
+            ('c5', 'c4'), ('d2', 'd1'), ('d4', 'd2'), ('x', 'd1'),
+            ('y', 'missing')]
+_quotes = [('a3', 'a2'), ('c4', 'c5'), ('d3', 'd1'), ('d4', 'd3')]
+_retweets = [('a4', 'a3'), ('d5', 'd4')]
+
+
+def _tweets():
+    tweets = {twtid: {'text': '', 'topic': 'none detected'}
+              for twtid in ['a1', 'a2', 'a3', 'a4', 'c1', 'c2', 'c3', 'c4',
+                            'c5', 'd1', 'd2', 'd3', 'd4', 'd5', 'x', 'y']}
+    for twtid in ['a1', 'c1', 'd1']:
+        tweets[twtid]['topic'] = 'T'
+    tweets['x']['topic'] = 'other'
+    return tweets
+
+
+def _conversations():
+    return Conversations(reply_list=_replies, quote_list=_quotes,
+                         retweet_list=_retweets)
+
+
+def _fixed_point(tweets, topic, no_topic='none detected'):
+    '''
+    the original recategorization: go over every tweet until nothing changes
+    '''
+    parents = {}
+    for links in (_replies, _quotes, _retweets):
+        for twtid, parent in links:
+            parents.setdefault(twtid, []).append(parent)
+    changed = True
+    while changed:
+        changed = False
+        for twtid, tweet in tweets.items():
+            if tweet['topic'] == no_topic and any(
+                    parent in tweets and tweets[parent]['topic'] == topic
+                    for parent in parents.get(twtid, [])):
+                tweet['topic'] = topic
+                changed = True
+    return tweets
+
+
+def test_labels_and_hop_distances():
+    conversations = _conversations()
+    tweets = conversations.Recategorize_topics('T', tweet_dict=_tweets(),
+                                               hop_distance=True)
+    assert {twtid: tweet['topic'] for twtid, tweet in tweets.items()} == {
+        'a1': 'T', 'a2': 'T', 'a3': 'T', 'a4': 'T',
+        'c1': 'T', 'c2': 'none detected', 'c3': 'none detected',
+        'c4': 'T', 'c5': 'T',
+        'd1': 'T', 'd2': 'T', 'd3': 'T', 'd4': 'T', 'd5': 'T',
+        'x': 'other', 'y': 'none detected'}
+    assert conversations.Hop_distances() == {
+        'a2': 1, 'a3': 2, 'a4': 3,
+        'c4': 1, 'c5': 2,
+        'd2': 1, 'd3': 1, 'd4': 2, 'd5': 3}
+
+
+def test_same_labels_as_fixed_point_loop():
+    tweets = _conversations().Recategorize_topics('T', tweet_dict=_tweets())
+    assert tweets == _fixed_point(_tweets(), 'T')
+
+
+def test_conflicts_between_topics():
+    # m is one link from T and U, n one link from T, U and V, m2 replies to
+    # m; w is two links from T (through s) but one from U
+    tweets = {twtid: {'text': '', 'topic': 'none detected'}
+              for twtid in ['m', 'm2', 'n', 's', 'w']}
+    tweets.update({'t': {'text': '', 'topic': 'T'},
+                   'u': {'text': '', 'topic': 'U'},
+                   'v': {'text': '', 'topic': 'V'}})
+    conversations = Conversations(
+        reply_list=[('m', 't'), ('n', 't'), ('m2', 'm'), ('s', 't'),
+                    ('w', 's')],
+        quote_list=[('m', 'u'), ('n', 'u'), ('w', 'u')],
+        retweet_list=[('n', 'v')])
+    labelled = conversations.Recategorize_all_topics(tweet_dict=tweets)
+    assert {twtid: tweet['topic'] for twtid, tweet in labelled.items()} == {
+        't': 'T', 'u': 'U', 'v': 'V',
+        'm': 'applies to 2 topics', 'm2': 'applies to 2 topics',
+        'n': 'applies to more than 2 topics', 's': 'T', 'w': 'U'}
+    # a tweet reached by several topics counts for each of them
+    assert conversations.Recategorized_counts() == {'T': 4, 'U': 4, 'V': 1}
+
+
+def _batch_topics(base, edges):
+    kinds = {'reply': [], 'quote': [], 'retweet': []}
+    for (twtid, kind), parent in edges.items():
+        kinds[kind].append((twtid, parent))
+    labelled = Conversations(
+        reply_list=kinds['reply'], quote_list=kinds['quote'],
+        retweet_list=kinds['retweet']).Recategorize_all_topics(
+            tweet_dict={twtid: {'text': '', 'topic': topic}
+                        for twtid, topic in base.items()})
+    return {twtid: tweet['topic'] for twtid, tweet in labelled.items()}
+
+
+def test_incremental_updates_match_batch():
+    topics = ['none detected'] * 4 + ['T', 'U', 'V']
+    for seed in range(20):
+        rand = random.Random(seed)
+        steps = [('tweet', twtid, rand.choice(topics)) for twtid in range(40)]
+        # links to earlier and later tweets, so parents also arrive late
+        steps += [('edge', twtid, kind, rand.randrange(40))
+                  for twtid in range(40)
+                  for kind in ['reply', 'quote', 'retweet']
+                  if rand.random() < 0.4]
+        rand.shuffle(steps)
+        # then topics change and links are replaced
+        steps += [rand.choice([('topic', rand.randrange(40),
+                                rand.choice(topics)),
+                               ('edge', rand.randrange(40),
+                                rand.choice(['reply', 'quote', 'retweet']),
+                                rand.randrange(40))])
+                  for _ in range(40)]
+        conversations = Conversations()
+        base, edges = {}, {}
+        for step in steps:
+            if step[0] == 'tweet':
+                conversations.Add_tweet(step[1], step[2])
+                base[step[1]] = step[2]
+            elif step[0] == 'edge':
+                conversations.Add_edge(step[1], step[3], step[2])
+                edges[(step[1], step[2])] = step[3]
+            else:
+                conversations.Set_topic(step[1], step[2])
+                base[step[1]] = step[2]
+            assert conversations.Topics() == _batch_topics(base, edges), \
+                (seed, step)
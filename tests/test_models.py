@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+tweets read in batches from a database cursor or an iterator give the same
+tweet dictionary as the same rows passed as a list
+"""
+import sqlite3
+
+import pytest
+
+from nlpru import Convert_to_tweet_dictionary, Convert_to_tweet_store
+from nlpru.models import Tweet_batches
+
+_rows = [(i, u'твит номер {}'.format(i), u'ru', u'user_{}'.format(i % 3))
+         for i in range(1, 11)]
+
+
+class _CountingCursor:
+    '''
+    sqlite3 cursor counting the fetchmany() calls
+    '''
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.fetchmany_calls = 0
+
+    def fetchmany(self, size):
+        self.fetchmany_calls += 1
+        return self._cursor.fetchmany(size)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _cursor():
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE tweets (id INTEGER, text TEXT, lang TEXT, "
+               "author TEXT)")
+    db.executemany("INSERT INTO tweets VALUES (?, ?, ?, ?)", _rows)
+    return _CountingCursor(db.execute("SELECT * FROM tweets ORDER BY id"))
+
+
+def test_cursor_batches_match_list():
+    cursor = _cursor()
+    from_cursor = Convert_to_tweet_dictionary(tweet_cursor=cursor,
+                                              tweet_text_index=1,
+                                              tweet_id_index=0,
+                                              batch_size=3)
+    from_list = Convert_to_tweet_dictionary(tweet_list=_rows,
+                                            tweet_text_index=1,
+                                            tweet_id_index=0)
+    assert from_cursor == from_list
+    # 4 batches of at most 3 rows, then the empty fetch that ends it
+    assert cursor.fetchmany_calls == 5
+
+
+def test_cursor_batch_sizes():
+    batches = list(Tweet_batches(batch_size=4, tweet_cursor=_cursor(),
+                                 tweet_text_index=1, tweet_id_index=0))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert batches[0][0] == (1, u'твит номер 1', [u'ru', u'user_1'])
+
+
+def test_first_field_is_left_out_of_other():
+    # id and text not at the start: the first field is left out of 'other'
+    # for rows from a list, a cursor and an iterator alike
+    rows = [(u'n{}'.format(twtid), text, twtid, lang)
+            for twtid, text, lang, _ in _rows]
+    expected = {twtid: {'text': text, 'other': [lang]}
+                for twtid, text, lang, _ in _rows}
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE tweets (n TEXT, text TEXT, id INTEGER, "
+               "lang TEXT)")
+    db.executemany("INSERT INTO tweets VALUES (?, ?, ?, ?)", rows)
+    inputs = [lambda: {'tweet_list': rows},
+              lambda: {'tweet_iter': iter(rows)},
+              lambda: {'tweet_cursor': db.execute("SELECT * FROM tweets"),
+                       'batch_size': 3}]
+    for kwargs in inputs:
+        assert Convert_to_tweet_dictionary(tweet_text_index=1,
+                                           tweet_id_index=2,
+                                           **kwargs()) == expected
+        assert Convert_to_tweet_store(tweet_text_index=1,
+                                      tweet_id_index=2,
+                                      **kwargs()).To_tweet_dictionary() == \
+            expected
+
+
+def test_tweet_view_compares_like_a_dict():
+    store = Convert_to_tweet_store(tweet_list=_rows, tweet_text_index=1,
+                                   tweet_id_index=0)
+    view = store[1]
+    assert view == {'text': u'твит номер 1', 'other': [u'ru', u'user_1']}
+    assert not view != {'text': u'твит номер 1',
+                        'other': [u'ru', u'user_1']}
+    with pytest.raises(TypeError):
+        hash(view)
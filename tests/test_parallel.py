@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Clean_corpus and Keyword_Match spread over processes give the same output,
+in the same order, as when everything is done in this process
+"""
+import json
+
+import pytest
+
+pytest.importorskip('pymorphy2')
+pytest.importorskip('emoji')
+
+from nlpru import Cleaner, FindTopics
+from nlpru.benchmark import Synthetic_tweets, benchmark_topics
+from nlpru.tokenizer import word_tokenizer
+
+# small chunks, so that the work is spread over many of them
+_chunksize = 7
+
+
+def test_clean_corpus_processes_match_serial():
+    cleaner = Cleaner()
+    tweets = Synthetic_tweets(200, seed=3)
+    texts = [text for _, text in tweets]
+    serial = cleaner.Clean_corpus(texts, remove_swears=True)
+    assert cleaner.Clean_corpus(texts, processes=2, chunksize=_chunksize,
+                                remove_swears=True) == serial
+    corpus = {twtid: {'text': text} for twtid, text in tweets}
+    cleaned = cleaner.Clean_corpus(corpus, processes=2, chunksize=_chunksize,
+                                   remove_swears=True)
+    assert list(cleaned.items()) == \
+        list(zip([twtid for twtid, _ in tweets], serial))
+
+
+def test_keyword_match_processes_match_serial():
+    tweets = Synthetic_tweets(200, seed=4)
+
+    def labels(**kwargs):
+        labelled = FindTopics(
+            tweet_dict={twtid: {'text': text} for twtid, text in tweets},
+            tokenizer=word_tokenizer).Keyword_Match(
+                json.loads(json.dumps(benchmark_topics)), **kwargs)
+        return [(twtid, tweet['clean_words'], tweet['topic'])
+                for twtid, tweet in labelled.items()]
+    serial = labels()
+    assert labels(processes=2, chunksize=_chunksize) == serial
+    assert any(topic != 'none detected' for _, _, topic in serial)
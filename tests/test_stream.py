@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+streaming a gzipped JSONL file through Process_file into CSV and JSONL gives
+the labels of FindTopics.Keyword_Match, and the other fields come through
+"""
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+pytest.importorskip('pymorphy2')
+
+from nlpru import FindTopics
+from nlpru.stream import Process_file, Read_tweets, Write_tweets
+from nlpru.tokenizer import word_tokenizer
+
+_topics = {'courts': [u'суд', u'приговор'], 'protest': [u'митинг']}
+_records = [
+    {'id': u'1', 'text': u'Суд вынес приговор', 'lang': u'ru'},
+    {'id': u'2', 'text': u'все на #митинг', 'lang': u'ru'},
+    {'id': u'3', 'text': u'RT @user: митинг у здания суда', 'lang': u'ru'},
+    {'id': u'4', 'text': u'хорошая погода', 'lang': u'en'},
+]
+
+
+def _write_input(tmp_path):
+    path = str(tmp_path / 'tweets.jsonl.gz')
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for record in _records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return path
+
+
+def _keyword_match():
+    tweets = {record['id']: {'text': record['text']} for record in _records}
+    labelled = FindTopics(tweet_dict=tweets,
+                          tokenizer=word_tokenizer).Keyword_Match(
+        json.loads(json.dumps(_topics)))
+    return {twtid: (tweet['clean_words'], tweet['topic'])
+            for twtid, tweet in labelled.items()}
+
+
+def test_read_write_round_trip(tmp_path):
+    path = _write_input(tmp_path)
+    tweets = list(Read_tweets(path))
+    assert tweets == [(record['id'], {'text': record['text'],
+                                      'other': {'lang': record['lang']}})
+                      for record in _records]
+    out = str(tmp_path / 'copy.csv.gz')
+    assert Write_tweets(tweets, out, buffer_size=3) == len(_records)
+    assert list(Read_tweets(out)) == tweets
+
+
+def test_process_file_to_jsonl_and_csv(tmp_path):
+    path = _write_input(tmp_path)
+    expected = _keyword_match()
+    # 'митинг' of '#митинг' is only found when hashtags are kept
+    assert expected['2'][1] == 'protest'
+
+    out = str(tmp_path / 'labelled.jsonl')
+    stats = Process_file(path, out, _topics, tokenizer=word_tokenizer,
+                         chunksize=3)
+    assert stats['tweets'] == len(_records)
+    with io.open(out, encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert [row['id'] for row in rows] == [r['id'] for r in _records]
+    assert [row['lang'] for row in rows] == [r['lang'] for r in _records]
+    assert {row['id']: (row['clean_words'], row['topic'])
+            for row in rows} == expected
+
+    out = str(tmp_path / 'labelled.csv')
+    Process_file(path, out, _topics, tokenizer=word_tokenizer, chunksize=3)
+    with io.open(out, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert {row['id']: (row['clean_words'].split(), row['topic'])
+            for row in rows} == expected
+
+
+def test_cleaning_first_can_change_labels(tmp_path):
+    out = str(tmp_path / 'labelled.jsonl')
+    Process_file(_write_input(tmp_path), out, _topics,
+                 tokenizer=word_tokenizer, clean=True)
+    with io.open(out, encoding='utf-8') as f:
+        topics = {row['id']: row['topic'] for row in map(json.loads, f)}
+    assert topics['2'] == 'none detected'
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+the default tokenizer gives the same labels as nltk.word_tokenize, the
+opt-in word_tokenizer differs from it as documented in nlpru.tokenizer
+"""
+import copy
+import json
+
+import pytest
+
+word_tokenize = pytest.importorskip('nltk.tokenize').word_tokenize
+pytest.importorskip('pymorphy2')
+
+from nlpru import FindTopics
+from nlpru.benchmark import Synthetic_tweets, benchmark_topics
+from nlpru.tokenizer import Tokenizer, word_tokenizer
+
+
+def _labels(tweets, **kwargs):
+    tweet_dict = {twtid: {'text': text} for twtid, text in tweets}
+    topics = json.loads(json.dumps(benchmark_topics))
+    labelled = FindTopics(tweet_dict=tweet_dict, **kwargs).Keyword_Match(topics)
+    return {twtid: (tweet['topic'], tweet['clean_words'])
+            for twtid, tweet in labelled.items()}
+
+
+def test_default_labels_match_nltk():
+    tweets = Synthetic_tweets(3000, seed=7)
+    assert _labels(copy.deepcopy(tweets)) == \
+        _labels(tweets, tokenizer=word_tokenize)
+
+
+@pytest.mark.parametrize('text, nltk_tokens, tokens', [
+    (u'Москва/Питер', [u'Москва/Питер'], [u'Москва', u'/', u'Питер']),
+    (u'суд=цирк', [u'суд=цирк'], [u'суд', u'=', u'цирк']),
+    (u'№5', [u'№5'], [u'№', u'5']),
+    (u'4,5', [u'4,5'], [u'4', u',', u'5']),
+    (u'-7', [u'-7'], [u'-', u'7']),
+    (u'ул.Ленина', [u'ул.Ленина'], [u'ул', u'.', u'Ленина']),
+])
+def test_word_tokenizer_documented_differences(text, nltk_tokens, tokens):
+    assert word_tokenize(text) == nltk_tokens
+    assert list(word_tokenizer(text)) == tokens
+
+
+def test_social_mode_keeps_entities():
+    tokens = list(Tokenizer(mode='social')(
+        u'@navalny #выборы https://t.co/x из-за 🙂'))
+    assert tokens == [u'@navalny', u'#выборы', u'https://t.co/x', u'из-за',
+                      u'🙂']
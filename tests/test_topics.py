@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Keyword_Match and the compiled TopicMatcher give the same labels as checking
+every topic in turn against the clean words of a tweet; clean words are only
+reused for the same tokenizer
+"""
+import copy
+import functools
+import pickle
+
+import pytest
+
+pytest.importorskip('pymorphy2')
+
+from nlpru import FindTopics, InputError
+from nlpru.checkpoint import Checkpoint
+from nlpru.topics import (TopicMatcher, _options_key, no_topic_label,
+                          two_topics_label, many_topics_label)
+from nlpru.tokenizer import word_tokenizer
+
+# overlapping topics, 'not' exclusions (of words and phrases) and phrases
+_topics = {
+    'courts': {'contains': [u'суд', u'приговор', u'уголовный дело'],
+               'not': [u'погода']},
+    'politics': {'contains': [u'выборы', u'депутат', u'суд'],
+                 'not': [u'футбольный матч']},
+    'protest': [u'митинг', u'уголовный дело', u'задержать'],
+    'sport': {'contains': [u'футбольный матч', u'гол'],
+              'not': [u'депутат']},
+}
+
+_words = [u'суд', u'приговор', u'уголовный', u'дело', u'погода', u'выборы',
+          u'депутат', u'футбольный', u'матч', u'митинг', u'задержать',
+          u'гол', u'москва', u'вчера', u'сильный']
+
+
+def _corpus(n=600):
+    tweets = {}
+    for i in range(n):
+        length = i % 7 + 1
+        tweets[i] = {'text': u' '.join(_words[(i * 7 + j * (i % 5 + 1)) %
+                                              len(_words)]
+                                       for j in range(length))}
+    return tweets
+
+
+def _split(text, limit):
+    return text.split()[:limit]
+
+
+def _contains(clean_words, rule):
+    phrase = rule.split()
+    return any(clean_words[start:start + len(phrase)] == phrase
+               for start in range(len(clean_words) - len(phrase) + 1))
+
+
+def _expected_label(clean_words, topic_dict):
+    topics = []
+    for topic, rules in topic_dict.items():
+        if isinstance(rules, list):
+            rules = {'contains': rules, 'not': []}
+        if any(_contains(clean_words, rule) for rule in rules['contains']) \
+                and not any(_contains(clean_words, rule)
+                            for rule in rules.get('not', [])):
+            topics.append(topic)
+    if len(topics) == 0:
+        return no_topic_label
+    if len(topics) == 1:
+        return topics[0]
+    if len(topics) == 2:
+        return two_topics_label
+    return many_topics_label
+
+
+def test_keyword_match_matches_per_topic_loop():
+    labelled = FindTopics(tweet_dict=_corpus(),
+                          tokenizer=word_tokenizer).Keyword_Match(
+        copy.deepcopy(_topics))
+    wrong = [twtid for twtid, tweet in labelled.items()
+             if tweet['topic'] != _expected_label(tweet['clean_words'],
+                                                  _topics)]
+    assert wrong == []
+    labels = set(tweet['topic'] for tweet in labelled.values())
+    # the corpus reaches every kind of label
+    assert {no_topic_label, two_topics_label, many_topics_label,
+            'courts', 'protest'} <= labels
+
+
+def test_matcher_save_load_and_pickle(tmp_path):
+    labelled = FindTopics(tweet_dict=_corpus(),
+                          tokenizer=word_tokenizer).Keyword_Match(
+        copy.deepcopy(_topics))
+    matcher = TopicMatcher(copy.deepcopy(_topics))
+    path = str(tmp_path / 'topics.json')
+    matcher.Save(path)
+    for other in [TopicMatcher.Load(path),
+                  pickle.loads(pickle.dumps(matcher))]:
+        assert [other.Match(tweet['clean_words'])
+                for tweet in labelled.values()] == \
+            [tweet['topic'] for tweet in labelled.values()]
+
+
+def test_tokenizers_without_a_name_do_not_share_clean_words(tmp_path):
+    tweets = {1: {'text': u'суд вынес приговор'}}
+    first = FindTopics(tweet_dict=tweets, tokenizer=lambda text: text.split())
+    first.Keyword_Match(copy.deepcopy(_topics))
+    assert tweets[1]['clean_words'] == [u'суд', u'вынести', u'приговор']
+    second = FindTopics(tweet_dict=tweets,
+                        tokenizer=lambda text: text.split()[:1])
+    second.Keyword_Match(copy.deepcopy(_topics))
+    assert tweets[1]['clean_words'] == [u'суд']
+    # they can not be told apart on disk, so they are not stored there
+    with pytest.raises(InputError):
+        FindTopics(tweet_dict=tweets, tokenizer=lambda text: text.split(),
+                   cache_path=str(tmp_path / 'lemmas.db'))
+    with pytest.raises(InputError):
+        FindTopics(tweet_dict=tweets,
+                   tokenizer=lambda text: text.split()).Keyword_Match(
+            copy.deepcopy(_topics),
+            checkpoint=Checkpoint(str(tmp_path / 'job.checkpoint')))
+
+
+def test_named_tokenizers_have_their_own_keys():
+    options = {'remove_proper_nouns': False}
+    keys = [_options_key(tokenize, options)
+            for tokenize in [word_tokenizer, str.split,
+                             functools.partial(_split, limit=1),
+                             functools.partial(_split, limit=2)]]
+    assert None not in keys and len(set(keys)) == len(keys)
+    assert _options_key(functools.partial(_split, limit=1), options) == keys[2]
+    assert _options_key(lambda text: text.split(), options) is None